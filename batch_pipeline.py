@@ -0,0 +1,387 @@
+import os
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from features.build_features_pipeline import fetch_all_country_metadata, fetch_all_internal_risk, enrich_merchants
+from features.underwriting_features import build_underwriting_features
+from ingestion.schema_validator import validate_schema_columns, validate_rows
+from ingestion.entity_resolution import resolve_entities, entity_clusters
+from ingestion.service_bootstrap import ensure_internal_api_running
+from model.train_risk_model import load_model, predict_risk
+from model.portfolio_risk import merge_predictions
+from model.portfolio_aggregation import PortfolioAccumulator
+from reporting.generate_report import generate_underwriting_report
+from common.instrumentation import stage
+from common.dtype_policy import compact_frame
+from common.logger_config import configure_logger
+
+
+logger = configure_logger("batch_pipeline")
+
+
+# portfolios loaded or scored at the same time (each one holds its frames in
+# memory; between loading and scoring a portfolio waits on disk)
+DEFAULT_CONCURRENCY = 4
+
+# parallel lookups against the internal API / REST Countries, sharing one pooled session
+LOOKUP_WORKERS = 10
+
+SUMMARY_COLUMNS = [
+    "name",
+    "input",
+    "output",
+    "status",
+    "rows",
+    "invalid",
+    "scored",
+    "total_merchants",
+    "high_risk_merchants",
+    "high_risk_ratio",
+    "high_risk_volume",
+    "expected_disputes",
+    "avg_risk_probability",
+    "report_provider",
+    "seconds",
+    "error"
+]
+
+
+# ------------------------------------------------------
+# Manifest
+# ------------------------------------------------------
+def load_manifest(path: str) -> list:
+    """
+    Portfolios to score: a .csv with input,output[,name] columns or a .json
+    list of the same objects. Relative paths resolve against the manifest's
+    folder; the name defaults to the input file's stem.
+    """
+
+    base = os.path.dirname(path)
+
+    if path.lower().endswith(".json"):
+        with open(path) as f:
+            entries = json.load(f)
+    else:
+        with open(path, newline="") as f:
+            entries = list(csv.DictReader(f))
+
+    portfolios = []
+    for e in entries:
+        input_path = os.path.join(base, e["input"])
+        portfolios.append({
+            "name": e.get("name") or os.path.splitext(os.path.basename(input_path))[0],
+            "input": input_path,
+            "output": os.path.join(base, e["output"])
+        })
+
+    names = [p["name"] for p in portfolios]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate portfolio names in {path}: {duplicates}")
+
+    # two portfolios writing to one folder would overwrite each other's files
+    outputs = [os.path.normpath(p["output"]) for p in portfolios]
+    duplicates = sorted({o for o in outputs if outputs.count(o) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate portfolio output folders in {path}: {duplicates}")
+
+    return portfolios
+
+
+def pooled_session(pool_size: int = LOOKUP_WORKERS) -> requests.Session:
+    """One keep-alive pool per host, sized for the lookup threads."""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# ------------------------------------------------------
+# Per-portfolio stages
+# ------------------------------------------------------
+def load_portfolio(portfolio: dict) -> pd.DataFrame:
+    """Read, validate and resolve entities for one portfolio (its own outputs folder)."""
+
+    output_dir = portfolio["output"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    with stage(f"batch.load.{portfolio['name']}") as s:
+        df = pd.read_csv(portfolio["input"])
+
+        validate_schema_columns(df)
+        valid_df, invalid_df = validate_rows(df)
+
+        if len(invalid_df) > 0:
+            invalid_df.to_csv(os.path.join(output_dir, "invalid_rows.csv"), index=False)
+
+        df = compact_frame(resolve_entities(compact_frame(valid_df)))
+        entity_clusters(df).to_csv(os.path.join(output_dir, "entity_clusters.csv"), index=False)
+        s.set_rows(len(df))
+
+    portfolio["rows"] = len(df)
+    portfolio["invalid"] = len(invalid_df)
+    return df
+
+
+def score_portfolio(portfolio: dict, df: pd.DataFrame, model, internal_map: dict, country_map: dict, explain_top_k: int = 0):
+    """Enrich, score and aggregate one portfolio from the shared lookups; writes the usual output files."""
+
+    output_dir = portfolio["output"]
+
+    with stage(f"batch.score.{portfolio['name']}") as s:
+        enriched = enrich_merchants(df, internal_map, country_map)
+        enriched.to_csv(os.path.join(output_dir, "enriched_merchants.csv"), index=False)
+
+        features = compact_frame(build_underwriting_features(enriched))
+        features.to_csv(os.path.join(output_dir, "underwriting_features.csv"), index=False)
+
+        scored = compact_frame(predict_risk(model, features, explain_top_k=explain_top_k))
+        scored.to_csv(os.path.join(output_dir, "merchant_predictions.csv"), index=False)
+
+        merged = compact_frame(merge_predictions(enriched, scored))
+        merged.to_csv(os.path.join(output_dir, "portfolio_view.csv"), index=False)
+
+        accumulator = PortfolioAccumulator().update(merged)
+        accumulator.segment_metrics().to_csv(os.path.join(output_dir, "portfolio_segments.csv"), index=False)
+
+        metrics = accumulator.metrics()
+        with open(os.path.join(output_dir, "portfolio_metrics.json"), "w") as f:
+            json.dump(metrics, f, indent=2)
+
+        s.set_rows(len(merged))
+
+    portfolio["scored"] = len(merged)
+    return metrics, merged, accumulator
+
+
+# ------------------------------------------------------
+# Batch run
+# ------------------------------------------------------
+def run_batch(
+    manifest_path: str,
+    output_dir: str,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    explain_top_k: int = 0,
+    reports: bool = True,
+    model=None,
+    ensure_api: bool = True
+) -> dict:
+    """
+    Score every portfolio of a manifest in one process.
+
+    The model is loaded once; country metadata and internal risk are looked
+    up once for the union of all portfolios (a merchant_id in several
+    portfolios costs one request) over one pooled session; portfolios are
+    loaded and scored up to `max_concurrency` at a time. Loaded portfolios
+    wait for the lookups on disk, so only their merchant_ids and countries
+    stay in memory. A failing portfolio is recorded in the summary and does
+    not stop the others.
+
+    Writes batch_summary.csv (one row per portfolio), batch_summary.json
+    (plus the combined metrics and lookup counts) and batch_segments.csv
+    (segment rollups over all portfolios) to `output_dir`.
+    """
+
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+
+    portfolios = load_manifest(manifest_path)
+    logger.info(f"Batch of {len(portfolios)} portfolios from {manifest_path} (concurrency {max_concurrency})")
+
+    if ensure_api:
+        ensure_internal_api_running()
+
+    if model is None:
+        model = load_model()
+
+    for portfolio in portfolios:
+        portfolio.update({"status": "ok", "error": None})
+
+    def failed(portfolio, e):
+        logger.exception(f"Portfolio {portfolio['name']} failed: {e}")
+        portfolio.update({"status": "failed", "error": str(e)})
+
+    # resolved frames wait here between loading and scoring
+    spill_dir = tempfile.mkdtemp(prefix=".batch-", dir=output_dir)
+    try:
+        # ------------------------------------------------------
+        # 1. Load and validate every portfolio
+        # ------------------------------------------------------
+        spilled, keys = {}, {}
+
+        def load_one(number, portfolio):
+            df = load_portfolio(portfolio)
+            path = os.path.join(spill_dir, f"{number}.pkl")
+            df.to_pickle(path)
+            return path, df["merchant_id"].unique(), df["country"].dropna().unique()
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {executor.submit(load_one, i, p): p for i, p in enumerate(portfolios)}
+            for future, portfolio in futures.items():
+                try:
+                    path, ids, found = future.result()
+                except Exception as e:
+                    failed(portfolio, e)
+                    continue
+
+                spilled[portfolio["name"]] = path
+                keys[portfolio["name"]] = (ids, found)
+
+        # ------------------------------------------------------
+        # 2. Shared lookups (union of all portfolios)
+        # ------------------------------------------------------
+        per_portfolio_ids = [ids for ids, _ in keys.values()]
+        merchant_ids = pd.unique(pd.Series([m for ids in per_portfolio_ids for m in ids], dtype=object))
+        countries = pd.unique(pd.Series([c for _, found in keys.values() for c in found], dtype=object))
+
+        lookups = {
+            "merchant_ids_requested": int(sum(len(ids) for ids in per_portfolio_ids)),
+            "merchant_ids_fetched": len(merchant_ids),
+            "countries_fetched": len(countries)
+        }
+
+        session = pooled_session(LOOKUP_WORKERS)
+        try:
+            with stage("batch.country_metadata"):
+                country_map = fetch_all_country_metadata(countries, session=session)
+
+            with stage("batch.internal_risk", rows=len(merchant_ids)):
+                internal_map = fetch_all_internal_risk(merchant_ids, max_workers=LOOKUP_WORKERS, session=session)
+        finally:
+            session.close()
+
+        logger.info(
+            f"Looked up {lookups['merchant_ids_fetched']} distinct merchant_ids "
+            f"for {lookups['merchant_ids_requested']} portfolio rows and {lookups['countries_fetched']} countries"
+        )
+
+        # ------------------------------------------------------
+        # 3. Score portfolios concurrently
+        # ------------------------------------------------------
+        combined = PortfolioAccumulator()
+
+        def run_one(portfolio):
+            portfolio_started = time.perf_counter()
+            metrics, merged, accumulator = score_portfolio(
+                portfolio, pd.read_pickle(spilled[portfolio["name"]]), model, internal_map, country_map, explain_top_k
+            )
+
+            if reports and len(merged):
+                report_path = os.path.join(portfolio["output"], "underwriting_report.txt")
+                # not streamed: several reports may be generated at once
+                _, portfolio["report_provider"] = generate_underwriting_report(metrics, merged, report_path, stream=False)
+
+            portfolio["seconds"] = round(time.perf_counter() - portfolio_started, 3)
+            return metrics, accumulator
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {executor.submit(run_one, p): p for p in portfolios if p["name"] in spilled}
+            for future, portfolio in futures.items():
+                try:
+                    metrics, accumulator = future.result()
+                except Exception as e:
+                    failed(portfolio, e)
+                    continue
+
+                portfolio.update(metrics)
+                combined.merge(accumulator)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    # ------------------------------------------------------
+    # 4. Consolidated summary
+    # ------------------------------------------------------
+    summary = pd.DataFrame(portfolios).reindex(columns=SUMMARY_COLUMNS)
+    summary.to_csv(os.path.join(output_dir, "batch_summary.csv"), index=False)
+
+    scored = [p for p in portfolios if p["status"] == "ok"]
+    result = {
+        "manifest": manifest_path,
+        "portfolios": len(portfolios),
+        "succeeded": len(scored),
+        "failed": len(portfolios) - len(scored),
+        "combined": combined.metrics() if scored else None,
+        "lookups": lookups,
+        "seconds": round(time.perf_counter() - started, 3),
+        "portfolio_results": summary.astype(object).where(summary.notna(), None).to_dict(orient="records")
+    }
+
+    with open(os.path.join(output_dir, "batch_summary.json"), "w") as f:
+        json.dump(result, f, indent=2, default=str)
+
+    if scored:
+        combined.segment_metrics().to_csv(os.path.join(output_dir, "batch_segments.csv"), index=False)
+
+    print_batch_summary(result, output_dir)
+    return result
+
+
+def print_batch_summary(result: dict, output_dir: str):
+
+    lines = [
+        "",
+        "=" * 52,
+        "BATCH EXECUTION SUMMARY",
+        "=" * 52,
+        f"Portfolios:               {result['succeeded']} scored, {result['failed']} failed",
+        f"Lookups:                  {result['lookups']['merchant_ids_fetched']} merchant_ids "
+        f"for {result['lookups']['merchant_ids_requested']} portfolio rows"
+    ]
+
+    if result["combined"]:
+        combined = result["combined"]
+        lines += [
+            f"Merchants (all):          {combined['total_merchants']}",
+            f"High risk merchants:      {combined['high_risk_merchants']} ({combined['high_risk_ratio']*100:.1f}%)"
+        ]
+
+    lines += [""]
+    for p in result["portfolio_results"]:
+        if p["status"] == "ok":
+            lines.append(f" - {p['name']:<20} {p['total_merchants']:>8} merchants  {p['high_risk_ratio']*100:5.1f}% high risk  -> {p['output']}")
+        else:
+            lines.append(f" - {p['name']:<20} FAILED: {p['error']}")
+
+    lines += [
+        "",
+        f"Summary: {output_dir}/batch_summary.csv, {output_dir}/batch_summary.json",
+        f"Completed in {result['seconds']:.1f}s",
+        "=" * 52
+    ]
+
+    block = "\n".join(lines)
+    print(block)
+    logger.info(block)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Score several merchant portfolios in one process")
+    parser.add_argument("--manifest", required=True, help="Manifest (.csv / .json with input,output[,name])")
+    parser.add_argument("--output", default="output", help="Folder for the consolidated summary")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--no-reports", action="store_true", help="Skip the per-portfolio underwriting reports")
+
+    args = parser.parse_args()
+
+    run_batch(args.manifest, args.output, max_concurrency=args.concurrency, reports=not args.no_reports)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python run_pipeline.py --predict --batch partners.csv --batch-concurrency 4 --output output/batch
+# python -m batch_pipeline --manifest partners.json --output output/batch
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+
+# low-cardinality labels -> category (one small integer code per row)
+CATEGORY_COLUMNS = [
+    "country",
+    "normalized_country",
+    "region",
+    "subregion",
+    "internal_risk_flag",
+    "internal_risk",
+    "volume_tier",
+    "geo_risk",
+    "behavior_risk",
+    "overall_risk_hint"
+]
+
+# high-cardinality identifiers and free text -> Arrow-backed strings
+STRING_COLUMNS = [
+    "merchant_id",
+    "entity_id",
+    "name",
+    "registration_number"
+]
+
+# integers are not narrowed below this: arithmetic on int8/int16 overflows silently
+MIN_INT_DTYPE = np.int32
+
+
+# ------------------------------------------------------
+# Dtypes
+# ------------------------------------------------------
+def _arrow_string_dtype():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+
+    try:
+        # NaN-missing Arrow strings: the pandas 3 default "str" dtype
+        return pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError:
+        return pd.StringDtype("pyarrow")
+
+
+def _downcast_numeric(series: pd.Series) -> pd.Series:
+    """int64 -> int32 when the values fit; float64 -> float32 only when no value changes."""
+
+    if pd.api.types.is_bool_dtype(series):
+        return series
+
+    if pd.api.types.is_integer_dtype(series) and series.dtype.itemsize > np.dtype(MIN_INT_DTYPE).itemsize:
+        info = np.iinfo(MIN_INT_DTYPE)
+        if len(series) == 0 or (series.min() >= info.min and series.max() <= info.max):
+            return series.astype(MIN_INT_DTYPE)
+        return series
+
+    if pd.api.types.is_float_dtype(series) and series.dtype == np.float64:
+        narrowed = series.astype(np.float32)
+        # money and rates with decimals rarely survive float32, so they stay float64
+        if np.array_equal(narrowed.to_numpy(np.float64), series.to_numpy(), equal_nan=True):
+            return narrowed
+
+    return series
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Dtype policy applied at stage boundaries (in place; returns the frame).
+
+      - CATEGORY_COLUMNS become categoricals
+      - STRING_COLUMNS become Arrow strings (when pyarrow is installed)
+      - other numeric columns are downcast losslessly
+
+    Values, column order and CSV output are unchanged.
+    """
+
+    string_dtype = _arrow_string_dtype()
+
+    for col in df.columns:
+        series = df[col]
+
+        if col in CATEGORY_COLUMNS:
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                df[col] = series.astype("category")
+        elif col in STRING_COLUMNS:
+            if string_dtype is not None and series.dtype != string_dtype:
+                # registration numbers may be parsed as numbers; keep missing values missing
+                df[col] = series.where(series.isna(), series.astype(str)).astype(string_dtype)
+        elif pd.api.types.is_numeric_dtype(series):
+            df[col] = _downcast_numeric(series)
+
+    return df
+
+
+# ------------------------------------------------------
+# Memory reporting
+# ------------------------------------------------------
+def frame_bytes(df: pd.DataFrame) -> int:
+    """Deep memory footprint (object strings are measured, not just their pointers)."""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def log_frame_memory(logger, label: str, df: pd.DataFrame, span=None) -> int:
+    """Log a frame's footprint; with a stage span the bytes also go into the run trace."""
+
+    nbytes = frame_bytes(df)
+    logger.info(f"{label}: {len(df)} rows x {df.shape[1]} columns, {nbytes / 2**20:.2f} MB in memory")
+
+    if span is not None:
+        span.set_memory(nbytes)
+
+    return nbytes
@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# ru_maxrss is reported in KiB on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+# ------------------------------------------------------
+# Run state
+# ------------------------------------------------------
+_state = {
+    "enabled": False,
+    "run_id": None,
+    "started": None,
+    "stages": [],
+    "calls": {}
+}
+_lock = threading.Lock()
+_local = threading.local()
+
+# callables hook(path, event) run on "enter" / "exit" of every stage (the profiler uses these)
+_stage_hooks = []
+
+
+def enable(run_id: str = None):
+    """Start recording spans for a new run."""
+    with _lock:
+        _state.update(
+            enabled=True,
+            run_id=run_id or datetime.now().strftime("%Y%m%d_%H%M%S"),
+            started=time.time(),
+            stages=[],
+            calls={}
+        )
+
+
+def disable():
+    _state["enabled"] = False
+
+
+def is_enabled() -> bool:
+    return _state["enabled"]
+
+
+def add_stage_hook(hook):
+    _stage_hooks.append(hook)
+
+
+def remove_stage_hook(hook):
+    if hook in _stage_hooks:
+        _stage_hooks.remove(hook)
+
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+def _stack() -> list:
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+# ------------------------------------------------------
+# Spans
+# ------------------------------------------------------
+class _NullSpan:
+    """Returned while instrumentation is off: entering and leaving cost two method calls."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_rows(self, rows):
+        pass
+
+    def set_memory(self, nbytes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _StageSpan:
+
+    __slots__ = ("name", "path", "rows", "frame_bytes", "_wall", "_cpu", "_rss", "_start")
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.frame_bytes = None
+
+    def set_rows(self, rows):
+        self.rows = int(rows)
+
+    def set_memory(self, nbytes):
+        """Footprint of the frame the stage hands on (see common.dtype_policy)."""
+        self.frame_bytes = int(nbytes)
+
+    def __enter__(self):
+        stack = _stack()
+        stack.append(self.name)
+        self.path = "/".join(stack)
+
+        for hook in _stage_hooks:
+            hook(self.path, "enter")
+
+        self._start = time.time()
+        self._rss = peak_rss_bytes()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        rss = peak_rss_bytes()
+
+        for hook in _stage_hooks:
+            hook(self.path, "exit")
+
+        _stack().pop()
+
+        record = {
+            "stage": self.path,
+            "depth": self.path.count("/"),
+            "started_at": round(self._start, 3),
+            "wall_seconds": round(wall, 4),
+            "cpu_seconds": round(cpu, 4),
+            "peak_rss_delta_bytes": None if rss is None else rss - self._rss,
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / wall, 1) if self.rows and wall > 0 else None,
+            "frame_bytes": self.frame_bytes,
+            "status": "error" if exc_type else "ok"
+        }
+        with _lock:
+            _state["stages"].append(record)
+
+        return False
+
+
+class _CallSpan:
+    """Outbound calls are aggregated per name; a trace with one entry per merchant would be useless."""
+
+    __slots__ = ("name", "_wall")
+
+    def __init__(self, name):
+        self.name = name
+
+    def set_rows(self, rows):
+        pass
+
+    def set_memory(self, nbytes):
+        pass
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+
+        with _lock:
+            stats = _state["calls"].get(self.name)
+            if stats is None:
+                stats = _state["calls"][self.name] = {"count": 0, "errors": 0, "wall_seconds": 0.0, "max_seconds": 0.0}
+            stats["count"] += 1
+            stats["errors"] += exc_type is not None
+            stats["wall_seconds"] += wall
+            stats["max_seconds"] = max(stats["max_seconds"], wall)
+
+        return False
+
+
+def stage(name: str, rows: int = None):
+    """
+    Time a pipeline stage: wall time, CPU time, peak RSS growth and rows.
+    Nested stages are recorded as parent/child paths.
+
+        with stage("predict") as s:
+            scored = predict_risk(...)
+            s.set_rows(len(scored))
+    """
+    if not _state["enabled"]:
+        return _NULL_SPAN
+    return _StageSpan(name, rows)
+
+
+def span(name: str):
+    """Time an outbound call (HTTP, LLM, subprocess); aggregated by name."""
+    if not _state["enabled"]:
+        return _NULL_SPAN
+    return _CallSpan(name)
+
+
+# ------------------------------------------------------
+# Reporting
+# ------------------------------------------------------
+def stages() -> list:
+    with _lock:
+        return list(_state["stages"])
+
+
+def calls() -> dict:
+    with _lock:
+        return {name: dict(stats) for name, stats in _state["calls"].items()}
+
+
+def stage_cost_lines() -> list:
+    """Stage-cost table sorted by wall time, as lines for the run summary."""
+
+    records = stages()
+    if not records:
+        return []
+
+    total = sum(r["wall_seconds"] for r in records if r["depth"] == 0) or 1.0
+
+    lines = [
+        "Stage costs (slowest first):",
+        f"  {'stage':38s} {'wall s':>9s} {'cpu s':>9s} {'% run':>6s} {'rss +MB':>8s} {'rows/s':>10s} {'frame MB':>9s}"
+    ]
+    # on equal (rounded) wall time a parent stage goes before its children
+    for r in sorted(records, key=lambda r: (-r["wall_seconds"], r["depth"])):
+        rss = "-" if r["peak_rss_delta_bytes"] is None else f"{r['peak_rss_delta_bytes'] / 2**20:.1f}"
+        rate = "-" if r["rows_per_second"] is None else f"{r['rows_per_second']:.0f}"
+        frame = "-" if r.get("frame_bytes") is None else f"{r['frame_bytes'] / 2**20:.2f}"
+        lines.append(
+            f"  {r['stage'][:38]:38s} {r['wall_seconds']:9.3f} {r['cpu_seconds']:9.3f} "
+            f"{100 * r['wall_seconds'] / total:6.1f} {rss:>8s} {rate:>10s} {frame:>9s}"
+        )
+
+    call_stats = calls()
+    if call_stats:
+        lines.append("Outbound calls:")
+        for name, stats in sorted(call_stats.items(), key=lambda kv: kv[1]["wall_seconds"], reverse=True):
+            lines.append(
+                f"  {name:38s} n={stats['count']:<7d} errors={stats['errors']:<5d} "
+                f"total={stats['wall_seconds']:.2f}s max={stats['max_seconds']:.2f}s"
+            )
+
+    return lines
+
+
+def _metric_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text() -> str:
+    """Prometheus text exposition format, for the node_exporter textfile collector."""
+
+    lines = []
+
+    def gauge(metric, help_text, samples):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ",".join(f'{k}="{_metric_label(v)}"' for k, v in labels.items())
+            lines.append(f"{metric}{{{label_text}}} {value}")
+
+    records = stages()
+    gauge("underwriting_stage_wall_seconds", "Wall-clock time of a pipeline stage",
+          [({"stage": r["stage"]}, r["wall_seconds"]) for r in records])
+    gauge("underwriting_stage_cpu_seconds", "Process CPU time spent during a pipeline stage",
+          [({"stage": r["stage"]}, r["cpu_seconds"]) for r in records])
+    gauge("underwriting_stage_peak_rss_delta_bytes", "Growth of peak RSS during a pipeline stage",
+          [({"stage": r["stage"]}, r["peak_rss_delta_bytes"]) for r in records])
+    gauge("underwriting_stage_rows", "Rows processed by a pipeline stage",
+          [({"stage": r["stage"]}, r["rows"]) for r in records])
+    gauge("underwriting_stage_frame_bytes", "In-memory size of the frame a stage hands on",
+          [({"stage": r["stage"]}, r.get("frame_bytes")) for r in records])
+
+    call_stats = calls()
+    gauge("underwriting_call_count", "Outbound calls made during the run",
+          [({"call": name}, s["count"]) for name, s in call_stats.items()])
+    gauge("underwriting_call_errors", "Outbound calls that raised",
+          [({"call": name}, s["errors"]) for name, s in call_stats.items()])
+    gauge("underwriting_call_wall_seconds", "Total wall time spent in outbound calls",
+          [({"call": name}, round(s["wall_seconds"], 4)) for name, s in call_stats.items()])
+
+    gauge("underwriting_run_timestamp_seconds", "Start time of the instrumented run",
+          [({"run_id": _state["run_id"]}, round(_state["started"], 3))])
+
+    return "\n".join(lines) + "\n"
+
+
+def write_trace(output_dir: str) -> tuple:
+    """Write trace_<run_id>.json and pipeline_metrics.prom; returns both paths."""
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    trace_path = os.path.join(output_dir, f"trace_{_state['run_id']}.json")
+    with open(trace_path, "w") as f:
+        json.dump({
+            "run_id": _state["run_id"],
+            "started_at": _state["started"],
+            "stages": stages(),
+            "calls": calls()
+        }, f, indent=2)
+
+    # the textfile collector may read at any time -> write then rename
+    prom_path = os.path.join(output_dir, "pipeline_metrics.prom")
+    tmp_path = prom_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, prom_path)
+
+    return trace_path, prom_path
@@ -1,74 +1,266 @@
-import logging
 import os
-from logging.handlers import RotatingFileHandler
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 
-def setup_logger():
+LOG_DIR = "logs"
+
+# LOG_FORMAT=json switches the log files to one JSON object per line
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+MAX_BYTES = 50_000_000
+BACKUP_COUNT = 5
+
+CONSOLE_FORMAT = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s", "%H:%M:%S")
+FILE_FORMAT = logging.Formatter("%(asctime)s | %(levelname)s | %(name)s | %(message)s")
+
+# per logger: its background writer, the QueueHandler feeding it and a factory
+# for the file handler (rebuilt in forked children, which have no writer thread)
+_listeners = {}
+
+
+# ------------------------------------------------------
+# Structured output
+# ------------------------------------------------------
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; `extra={...}` fields become top-level keys."""
+
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                payload[key] = value
+
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+
+        return json.dumps(payload, default=str)
 
-    os.makedirs("logs", exist_ok=True)
 
-    logger = logging.getLogger("featurelog")
-    logger.setLevel(logging.INFO)
+# ------------------------------------------------------
+# Logger factory
+# ------------------------------------------------------
+def configure_logger(
+    name: str,
+    log_file: str = None,
+    level: str = None,
+    log_format: str = None,
+    console: bool = True,
+    max_bytes: int = MAX_BYTES,
+    backup_count: int = BACKUP_COUNT
+) -> logging.Logger:
+    """
+    Logger writing to the console and to logs/<name>.log.
+
+    File writes go through a QueueHandler; a QueueListener thread does the
+    disk I/O, so pipeline and worker threads never block on the log file.
+    Console output stays synchronous so it interleaves in order with print().
+    """
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level or LOG_LEVEL)
 
     # prevent duplicate handlers if re-run
     if logger.handlers:
         return logger
 
-    # ---- console handler ----
-    console_handler = logging.StreamHandler()
-    console_format = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] %(message)s",
-        "%H:%M:%S"
-    )
-    console_handler.setFormatter(console_format)
-
-    # ---- file handler ----
-    file_handler = RotatingFileHandler(
-        "logs/featurelog.log",
-        maxBytes=1_000_000,
-        backupCount=3
-    )
-    file_format = logging.Formatter(
-        "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-    )
-    file_handler.setFormatter(file_format)
-
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    logger.propagate = False
+
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(CONSOLE_FORMAT)
+        logger.addHandler(console_handler)
+
+    log_file = log_file or os.path.join(LOG_DIR, f"{name}.log")
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+
+    formatter = JsonFormatter() if (log_format or LOG_FORMAT) == "json" else FILE_FORMAT
+
+    def make_file_handler():
+        handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(formatter)
+        return handler
+
+    file_handler = make_file_handler()
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+
+    queue_handler = QueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+
+    _listeners[name] = {
+        "listener": listener,
+        "queue_handler": queue_handler,
+        "file_handler": file_handler,
+        "make_file_handler": make_file_handler
+    }
 
     return logger
 
+
+def _write_directly(name: str, entry: dict, file_handler):
+    """Swap the logger's QueueHandler for a synchronous file handler."""
+
+    logger = logging.getLogger(name)
+    logger.removeHandler(entry["queue_handler"])
+    logger.addHandler(file_handler)
+
+
+def flush_loggers():
+    """Drain every queue to disk; the writer threads keep running afterwards."""
+    for entry in list(_listeners.values()):
+        listener = entry["listener"]
+        listener.stop()
+        listener.start()
+
+
+def shutdown_loggers(*names):
+    """
+    Stop the writer threads of the named loggers (all of them by default);
+    records logged afterwards are written synchronously.
+    """
+    for name in names or list(_listeners):
+        entry = _listeners.pop(name, None)
+        if entry is None:
+            continue
+        entry["listener"].stop()
+        _write_directly(name, entry, entry["file_handler"])
+
+
+def _after_fork_in_child():
+    # the writer threads do not survive fork: a forked worker (process pools)
+    # writes its records itself, through its own handler and lock
+    while _listeners:
+        name, entry = _listeners.popitem()
+        _write_directly(name, entry, entry["make_file_handler"]())
+
+
+atexit.register(shutdown_loggers)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def setup_logger():
+    return configure_logger("featurelog")
+
+
 def setup_logger_run():
+    return configure_logger("mainpipeline_log")
 
-    os.makedirs("logs", exist_ok=True)
 
-    logger = logging.getLogger("mainpipeline_log")
-    logger.setLevel(logging.INFO)
+# ------------------------------------------------------
+# Sampled per-entity logging
+# ------------------------------------------------------
+class EntityProgress:
+    """
+    Outcome logging for fan-outs over many entities (merchants, countries).
 
-    # prevent duplicate handlers if re-run
-    if logger.handlers:
-        return logger
+    The first `log_first` entities are logged individually, then one in every
+    `sample_every`; failures are logged individually up to `max_failures`
+    per summary interval. Every `summary_interval` seconds a progress line
+    (done / failed / rate) is logged, and close() logs the final totals.
+    """
 
-    # ---- console handler ----
-    console_handler = logging.StreamHandler()
-    console_format = logging.Formatter(
-        "[%(asctime)s] [%(levelname)s] %(message)s",
-        "%H:%M:%S"
-    )
-    console_handler.setFormatter(console_format)
-
-    # ---- file handler ----
-    file_handler = RotatingFileHandler(
-        "logs/mainpipeline_log.log",
-        maxBytes=1_000_000,
-        backupCount=3
-    )
-    file_format = logging.Formatter(
-        "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-    )
-    file_handler.setFormatter(file_format)
-
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    def __init__(
+        self,
+        logger,
+        label: str,
+        total: int = None,
+        log_first: int = 10,
+        sample_every: int = 1000,
+        max_failures: int = 20,
+        summary_interval: float = 5.0
+    ):
+        self.logger = logger
+        self.label = label
+        self.total = total
+        self.log_first = log_first
+        self.sample_every = sample_every
+        self.max_failures = max_failures
+        self.summary_interval = summary_interval
 
-    return logger
+        self.done = 0
+        self.failed = 0
+        self.suppressed = 0
+        self._failures_in_interval = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_summary = self._started
+
+    def success(self, entity_id, **fields):
+        with self._lock:
+            self.done += 1
+            log_it = self.done <= self.log_first or self.done % self.sample_every == 0
+            self._maybe_summarise()
+
+        if log_it:
+            self.logger.info(
+                f"SUCCESS {self.label}={entity_id}",
+                extra={"entity": self.label, "entity_id": entity_id, "status": "ok", **fields}
+            )
+
+    def failure(self, entity_id, **fields):
+        with self._lock:
+            self.done += 1
+            self.failed += 1
+            self._failures_in_interval += 1
+            log_it = self._failures_in_interval <= self.max_failures
+            if not log_it:
+                self.suppressed += 1
+            self._maybe_summarise()
+
+        if log_it:
+            self.logger.error(
+                f"FAILED {self.label}={entity_id}",
+                extra={"entity": self.label, "entity_id": entity_id, "status": "failed", **fields}
+            )
+
+    def _maybe_summarise(self):
+        now = time.monotonic()
+        if now - self._last_summary < self.summary_interval:
+            return
+
+        self._last_summary = now
+        self._failures_in_interval = 0
+        self._log_summary("progress", now)
+
+    def _log_summary(self, kind, now):
+        elapsed = now - self._started
+        of_total = f"/{self.total}" if self.total is not None else ""
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+
+        self.logger.info(
+            f"{self.label} {kind}: {self.done}{of_total} done, {self.failed} failed "
+            f"({rate:.0f}/s, {self.suppressed} failure lines suppressed)",
+            extra={
+                "entity": self.label,
+                "summary": kind,
+                "done": self.done,
+                "failed": self.failed,
+                "total": self.total,
+                "rate_per_second": round(rate, 1)
+            }
+        )
+
+    def close(self):
+        with self._lock:
+            self._log_summary("complete", time.monotonic())
@@ -1,3 +1,6 @@
+from common.instrumentation import stage_cost_lines
+
+
 def print_and_log_summary(metrics, provider, output_dir, logger):
     # 1. Define the risk level logic
     risk_level = (
@@ -29,6 +32,11 @@ def print_and_log_summary(metrics, provider, output_dir, logger):
         "="*52
     ]
 
+    # stage-cost table (only when the run was traced)
+    cost_lines = stage_cost_lines()
+    if cost_lines:
+        summary_lines[-2:-2] = cost_lines + [""]
+
     # 3. Join them into a single block of text
     full_summary = "\n".join(summary_lines)
 
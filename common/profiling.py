@@ -0,0 +1,227 @@
+import os
+import io
+import re
+import shutil
+import signal
+import pstats
+import cProfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+from common import instrumentation
+
+
+PROFILE_MODES = ["cpu", "memory", "both"]
+
+TOP_FUNCTIONS = 25
+TOP_PER_STAGE = 5
+TOP_ALLOCATIONS = 15
+
+# frames kept per allocation; deeper costs more memory while tracing
+TRACEMALLOC_FRAMES = 10
+
+
+# allocations made by the profilers themselves
+_PROFILER_NOISE = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+]
+
+
+def _safe_name(path: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", path)
+
+
+# ------------------------------------------------------
+# Per-stage profiler
+# ------------------------------------------------------
+class PipelineProfiler:
+    """
+    Hooks into the instrumentation stages and, for every top-level stage,
+    keeps a cProfile (cpu) and/or a tracemalloc growth snapshot (memory).
+
+    cProfile only sees the thread that runs the stage; time spent in worker
+    threads or processes shows up as waiting. The optional py-spy flame
+    graph samples every thread and child process.
+    """
+
+    def __init__(self, mode: str, output_root: str = "output", flamegraph: bool = False):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+
+        self.mode = mode
+        self.cpu = mode in ("cpu", "both")
+        self.memory = mode in ("memory", "both")
+        self.flamegraph = flamegraph
+
+        self.output_dir = os.path.join(output_root, f"profile_{datetime.now():%Y%m%d_%H%M%S}")
+        self.stages = {}
+        self._profile = None
+        self._snapshot = None
+        self._spy = None
+
+    # --------------------------------------------------
+    # Lifecycle
+    # --------------------------------------------------
+    def start(self) -> "PipelineProfiler":
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+        if self.flamegraph:
+            self._start_flamegraph()
+
+        instrumentation.add_stage_hook(self._on_stage)
+        print(f"Profiling ({self.mode}) -> {self.output_dir}")
+        return self
+
+    def stop(self) -> str:
+        """Stop profiling and write summary.txt; returns its path."""
+
+        instrumentation.remove_stage_hook(self._on_stage)
+
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        if self._spy is not None:
+            self._stop_flamegraph()
+
+        return self.write_summary()
+
+    # --------------------------------------------------
+    # Stage hooks
+    # --------------------------------------------------
+    def _on_stage(self, path: str, event: str):
+        # nested stages are covered by their parent's profile
+        if "/" in path:
+            return
+
+        if event == "enter":
+            self._enter(path)
+        else:
+            self._exit(path)
+
+    def _enter(self, path):
+        if self.memory:
+            tracemalloc.reset_peak()
+            self._snapshot = tracemalloc.take_snapshot().filter_traces(_PROFILER_NOISE)
+
+        if self.cpu:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def _exit(self, path):
+        record = self.stages.setdefault(path, {})
+        name = _safe_name(path)
+
+        if self.cpu and self._profile is not None:
+            self._profile.disable()
+            prof_path = os.path.join(self.output_dir, f"cpu_{name}.prof")
+            self._profile.dump_stats(prof_path)
+            record["cpu_profile"] = prof_path
+            self._profile = None
+
+        if self.memory and self._snapshot is not None:
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(_PROFILER_NOISE)
+            growth = after.compare_to(self._snapshot, "lineno")[:TOP_ALLOCATIONS]
+
+            mem_path = os.path.join(self.output_dir, f"memory_{name}.txt")
+            with open(mem_path, "w") as f:
+                f.write(f"peak traced memory during stage: {peak / 2**20:.1f} MB\n\n")
+                for stat in growth:
+                    f.write(f"{stat}\n")
+
+            record.update(memory_report=mem_path, peak_traced_mb=round(peak / 2**20, 1), top_growth=growth[:TOP_PER_STAGE])
+            self._snapshot = None
+
+    # --------------------------------------------------
+    # Sampling profiler (optional)
+    # --------------------------------------------------
+    def _start_flamegraph(self):
+        if shutil.which("py-spy") is None:
+            print("py-spy not installed -> no flame graph (pip install py-spy)")
+            return
+
+        svg_path = os.path.join(self.output_dir, "flamegraph.svg")
+        self._spy = subprocess.Popen(
+            ["py-spy", "record", "--pid", str(os.getpid()), "--subprocesses", "--threads", "-o", svg_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+    def _stop_flamegraph(self):
+        # SIGINT makes py-spy stop sampling and write the svg
+        self._spy.send_signal(signal.SIGINT)
+        try:
+            self._spy.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self._spy.kill()
+
+        if self._spy.returncode not in (0, None) or not os.path.exists(os.path.join(self.output_dir, "flamegraph.svg")):
+            print("py-spy could not attach (ptrace permissions?) -> no flame graph")
+
+        self._spy = None
+
+    # --------------------------------------------------
+    # Summary
+    # --------------------------------------------------
+    def write_summary(self) -> str:
+
+        lines = [f"Pipeline profile {os.path.basename(self.output_dir)}", ""]
+
+        cost = {r["stage"]: r for r in instrumentation.stages() if r["depth"] == 0}
+
+        profiles = [r["cpu_profile"] for r in self.stages.values() if "cpu_profile" in r]
+        if profiles:
+            lines.append(f"Hottest functions across all stages (by own time, top {TOP_FUNCTIONS}).")
+            lines.append("Lock 'acquire' time is the stage thread waiting on worker threads or processes.")
+            lines.append(_pstats_table(pstats.Stats(*profiles), TOP_FUNCTIONS))
+
+        for path, record in self.stages.items():
+            wall = cost.get(path, {}).get("wall_seconds")
+            lines.append(f"--- stage {path}" + (f" ({wall:.3f}s wall)" if wall is not None else ""))
+
+            if "cpu_profile" in record:
+                lines.append(f"cpu profile: {record['cpu_profile']}  (snakeviz / python -m pstats)")
+                lines.append(_pstats_table(pstats.Stats(record["cpu_profile"]), TOP_PER_STAGE))
+
+            if "memory_report" in record:
+                lines.append(f"peak traced memory: {record['peak_traced_mb']} MB  ({record['memory_report']})")
+                for stat in record["top_growth"]:
+                    lines.append(f"  {stat}")
+
+            lines.append("")
+
+        if os.path.exists(os.path.join(self.output_dir, "flamegraph.svg")):
+            lines.append(f"flame graph: {os.path.join(self.output_dir, 'flamegraph.svg')}")
+
+        summary_path = os.path.join(self.output_dir, "summary.txt")
+        with open(summary_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        return summary_path
+
+
+def _pstats_table(stats: pstats.Stats, top: int) -> str:
+    buffer = io.StringIO()
+    stats.stream = buffer
+    stats.strip_dirs().sort_stats("tottime").print_stats(top)
+
+    # drop pstats' preamble, keep the column header and rows
+    text = buffer.getvalue()
+    start = text.find("   ncalls")
+    return text[start:].rstrip() + "\n" if start >= 0 else text
+
+
+def start_profiling(mode: str, output_root: str = "output", flamegraph: bool = False) -> PipelineProfiler:
+    """Enable stage instrumentation and start a per-stage profiler."""
+
+    if not instrumentation.is_enabled():
+        instrumentation.enable()
+
+    return PipelineProfiler(mode, output_root, flamegraph).start()
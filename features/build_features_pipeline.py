@@ -1,22 +1,37 @@
 import os
 import pandas as pd
 import json
+import queue
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ingestion.service_bootstrap import ensure_internal_api_running
 from ingestion.internal_service_client import get_internal_risk
 from ingestion.external_country_service import get_country_details
 from ingestion.pdf_processor import extract_pdf_text
+from ingestion.document_ingestion import ingest_documents
+from ingestion.document_index import index_documents
 from ingestion.claritypay_scraper import scrape_claritypay
 from ingestion.schema_validator import validate_schema_columns, validate_rows
-from common.logger_config import setup_logger
+from ingestion.entity_resolution import resolve_entities, entity_clusters
+from common.logger_config import setup_logger, EntityProgress
+from common.instrumentation import stage
+from common.dtype_policy import compact_frame, log_frame_memory
 from features.underwriting_features import build_underwriting_features
 
 
 logger = setup_logger()
 
 
-TOTAL_STEPS = 10
+TOTAL_STEPS = 8
+
+# individual "skipping merchant" warnings before only the total is logged
+SKIP_LOG_LIMIT = 20
+
+# streaming enrichment: merchants fetched ahead of the consumer before fetching
+# pauses, and merchants per enriched / feature batch
+ENRICH_QUEUE_DEPTH = 1000
+ENRICH_BATCH_SIZE = 5000
 
 
 def log_step(step, total, message):
@@ -24,202 +39,465 @@ def log_step(step, total, message):
 
 
 # ======================================================
-# MAIN PIPELINE FUNCTION (CLI CALLS THIS)
+# PARALLEL LOOKUPS
 # ======================================================
-def run_pipeline(input_path: str, output_dir: str):
+def fetch_all_country_metadata(countries, max_workers=5, session=None):
+    results = {}
+    progress = EntityProgress(logger, "country", total=len(countries))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_country = {
+            executor.submit(get_country_details, country, session): country
+            for country in countries
+        }
+
+        for future in as_completed(future_to_country):
+            country = future_to_country[future]
+            try:
+                results[country] = future.result()
+                if results[country] is None:
+                    progress.failure(country, reason="no data")
+                else:
+                    progress.success(country)
+            except Exception:
+                results[country] = None
+                progress.failure(country)
+
+    progress.close()
+    return results
+
+
+def fetch_all_internal_risk(merchant_ids, max_workers=10, session=None):
+    results = {}
+    progress = EntityProgress(logger, "merchant_id", total=len(merchant_ids))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_mid = {
+            executor.submit(get_internal_risk, mid, session): mid
+            for mid in merchant_ids
+        }
+
+        for future in as_completed(future_to_mid):
+            mid = future_to_mid[future]
+            try:
+                results[mid] = future.result()
+                if results[mid] is None:
+                    progress.failure(mid, reason="no data")
+                else:
+                    progress.success(mid)
+            except Exception:
+                results[mid] = None
+                progress.failure(mid)
+
+    progress.close()
+    return results
+
+
+# ======================================================
+# ENRICHMENT
+# ======================================================
+def enrich_merchants(df, internal_map, country_map, skip_log_limit=SKIP_LOG_LIMIT, log_total=True):
+    """
+    One enriched row per merchant with internal data; the others are skipped and logged.
+    `log_total=False` leaves the "Skipped N" summary to the caller (streamed batches).
+    """
+
+    records = []
+    skipped = 0
+    with_entity = "entity_id" in df.columns
+
+    for _, row in df.iterrows():
+        merchant_id = row["merchant_id"]
+        country = row["country"]
+
+        internal = internal_map.get(merchant_id)
+        geo = country_map.get(country)
+
+        if internal is None:
+            skipped += 1
+            if skipped <= skip_log_limit:
+                logger.warning(f"Skipping merchant_id={merchant_id} due to missing internal data")
+            continue
+
+        record = {"merchant_id": merchant_id}
+        if with_entity:
+            record["entity_id"] = row["entity_id"]
+
+        record.update({
+            "name": row["name"],
+            "country": country,
+            "registration_number": row["registration_number"],
+            "monthly_volume": row["monthly_volume"],
+            "transaction_count": row["transaction_count"],
+            "dispute_count": row["dispute_count"],
+
+            "internal_risk_flag": internal["internal_risk_flag"],
+            "internal_last_30d_volume": internal["transaction_summary"]["last_30d_volume"],
+            "internal_last_30d_txn_count": internal["transaction_summary"]["last_30d_txn_count"],
+            "internal_avg_ticket_size": internal["transaction_summary"]["avg_ticket_size"],
+
+            "normalized_country": geo["country_name"] if geo else None,
+            "region": geo["region"] if geo else None,
+            "subregion": geo["subregion"] if geo else None
+        })
+        records.append(record)
+
+    if skipped and log_total:
+        logger.warning(f"Skipped {skipped} merchants due to missing internal data")
+
+    return compact_frame(pd.DataFrame(records))
+
+
+# ======================================================
+# STREAMING ENRICHMENT (bounded producer / consumer)
+# ======================================================
+_DONE = object()
+
+
+def _produce_internal_risk(merchant_ids, results_queue, window, stop, stats, max_workers, session):
+    """
+    Fetch thread. Each merchant takes a window slot before its request is
+    submitted and the consumer frees the slot once the merchant's first row
+    is enriched, so fetching pauses when the consumer falls `queue_depth`
+    merchants behind.
+    """
+
+    def fetch(mid):
+        try:
+            result = get_internal_risk(mid, session)
+        except Exception:
+            result = None
+        results_queue.put((mid, result))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for mid in merchant_ids:
+                if not window.acquire(blocking=False):
+                    stats["stalls"] += 1
+                    while not window.acquire(timeout=0.5):
+                        if stop.is_set():
+                            return
+                if stop.is_set():
+                    return
+                executor.submit(fetch, mid)
+    finally:
+        results_queue.put(_DONE)
+
+
+def stream_enriched_batches(
+    df,
+    country_map,
+    max_workers=10,
+    queue_depth=ENRICH_QUEUE_DEPTH,
+    batch_size=ENRICH_BATCH_SIZE,
+    session=None,
+    stats=None
+):
+    """
+    Yields enriched record batches (same rows and order as enrich_merchants
+    over the whole frame) while the internal-risk lookups are still running.
+
+    Results arrive in completion order; a row is released once its
+    merchant's lookup is back and every row before it has been released.
+    At most `queue_depth` merchants are fetched or waiting ahead of the
+    consumer, and raw API responses are dropped once their rows are
+    enriched. Batches whose merchants were all skipped are not yielded.
+    """
+
+    stats = stats if stats is not None else {}
+    stats.update({"batches": 0, "stalls": 0, "max_buffered": 0})
+
+    row_ids = df["merchant_id"].to_numpy()
+    first_rows = ~pd.Series(row_ids).duplicated().to_numpy()
+    merchant_ids = row_ids[first_rows]
+    remaining = pd.Series(row_ids).value_counts().to_dict()
+
+    # unbounded on purpose: the window already caps what can be in it
+    results_queue = queue.Queue()
+    window = threading.Semaphore(max(queue_depth, 1))
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_produce_internal_risk,
+        args=(merchant_ids, results_queue, window, stop, stats, max_workers, session),
+        name="internal-risk-producer",
+        daemon=True
+    )
+
+    progress = EntityProgress(logger, "merchant_id", total=len(merchant_ids))
+    results = {}
+    skipped = 0
+    released = 0
+    batch_start = 0
+
+    def emit(start, end):
+        nonlocal skipped
+        batch = df.iloc[start:end]
+        internal_map = {}
+        for mid in batch["merchant_id"]:
+            internal_map[mid] = results[mid]
+            remaining[mid] -= 1
+            if remaining[mid] == 0:
+                del results[mid]
+
+        enriched = enrich_merchants(batch, internal_map, country_map,
+                                    skip_log_limit=max(SKIP_LOG_LIMIT - skipped, 0), log_total=False)
+        skipped += len(batch) - len(enriched)
+        if len(enriched):
+            stats["batches"] += 1
+        return enriched
+
+    producer.start()
+    try:
+        while True:
+            item = results_queue.get()
+            if item is _DONE:
+                break
+
+            mid, internal = item
+            results[mid] = internal
+            stats["max_buffered"] = max(stats["max_buffered"], len(results))
+            if internal is None:
+                progress.failure(mid, reason="no data")
+            else:
+                progress.success(mid)
+
+            while released < len(row_ids) and row_ids[released] in results:
+                if first_rows[released]:
+                    window.release()
+                released += 1
+                if released - batch_start >= batch_size:
+                    enriched = emit(batch_start, released)
+                    batch_start = released
+                    if len(enriched):
+                        yield enriched
+
+        if released < len(row_ids):
+            raise RuntimeError(f"Internal risk fetch stopped after {released} of {len(row_ids)} rows")
+
+        if released > batch_start:
+            enriched = emit(batch_start, released)
+            if len(enriched):
+                yield enriched
+    finally:
+        stop.set()
+        producer.join()
+        progress.close()
+
+    if skipped:
+        logger.warning(f"Skipped {skipped} merchants due to missing internal data")
+
+
+# ======================================================
+# DATASET-WIDE STAGES
+# ======================================================
+def load_merchants(input_path: str, output_dir: str) -> pd.DataFrame:
+    """Load, validate and resolve entities (needs every merchant at once, so never sharded)."""
 
-    OUTPUT_DATASET = os.path.join(output_dir, "enriched_merchants.csv")
-    OUTPUT_PDF_TEXT = os.path.join(output_dir, "merchant_summary.txt")
     OUTPUT_INVALID = os.path.join(output_dir, "invalid_rows.csv")
-    OUTPUT_SCRAPE = os.path.join(output_dir, "claritypay_site_data.json")
+    OUTPUT_ENTITIES = os.path.join(output_dir, "entity_clusters.csv")
 
-    os.makedirs(output_dir, exist_ok=True)
+    with stage("load_validate") as s:
+        df = pd.read_csv(input_path)
 
-    # ------------------------------------------------------
-    # 1. Load merchant dataset
-    # ------------------------------------------------------
-    log_step(1, TOTAL_STEPS, "Loading merchant dataset")
+        validate_schema_columns(df)
+        valid_df, invalid_df = validate_rows(df)
 
-    df = pd.read_csv(input_path)
+        logger.info(f"Loaded {len(df)} rows")
+        logger.info(f"Valid rows: {len(valid_df)}")
 
-    validate_schema_columns(df)
-    valid_df, invalid_df = validate_rows(df)
+        if len(invalid_df) > 0:
+            logger.warning(f"{len(invalid_df)} invalid rows detected")
+            invalid_df.to_csv(OUTPUT_INVALID, index=False)
+            logger.info(f"Invalid rows saved to {OUTPUT_INVALID}")
 
-    logger.info(f"Loaded {len(df)} rows")
-    logger.info(f"Valid rows: {len(valid_df)}")
+        df = compact_frame(valid_df)
+        s.set_rows(len(df))
+        log_frame_memory(logger, "Merchant frame", df, s)
 
-    if len(invalid_df) > 0:
-        logger.warning(f"{len(invalid_df)} invalid rows detected")
-        invalid_df.to_csv(OUTPUT_INVALID, index=False)
-        logger.info(f"Invalid rows saved to {OUTPUT_INVALID}")
+    # the same business under several merchant_ids -> one entity_id (blocked, not all-pairs)
+    with stage("entity_resolution", rows=len(df)):
+        df = compact_frame(resolve_entities(df))
 
-    df = valid_df
+        clusters = entity_clusters(df)
+        clusters.to_csv(OUTPUT_ENTITIES, index=False)
+        logger.info(
+            f"{df['entity_id'].nunique()} distinct entities; "
+            f"{clusters['entity_id'].nunique()} with several merchant_ids saved to {OUTPUT_ENTITIES}"
+        )
 
-    # ------------------------------------------------------
-    # 2. Ensure internal API is running
-    # ------------------------------------------------------
-    log_step(2, TOTAL_STEPS, "Ensuring internal API is running")
+    return df
 
-    ensure_internal_api_running()
-    logger.info("Internal API is ready to use")
 
-    # ------------------------------------------------------
-    # 3. Start PDF extraction in background
-    # ------------------------------------------------------
-    log_step(3, TOTAL_STEPS, "Starting background PDF extraction")
+def start_document_extraction(output_dir: str, documents_source: str = None):
+    """Background PDF extraction; returns (executor, pdf_future, documents_future)."""
 
     background_executor = ThreadPoolExecutor(max_workers=2)
     pdf_future = background_executor.submit(extract_pdf_text)
 
-    # ------------------------------------------------------
-    # 4. Fetch country metadata
-    # ------------------------------------------------------
-    log_step(4, TOTAL_STEPS, "Fetching country metadata (parallel)")
+    # merchant statements (directory or manifest of PDFs), page ranges across a process pool
+    documents_future = None
+    if documents_source:
+        documents_future = background_executor.submit(ingest_documents, documents_source, output_dir)
 
-    def fetch_all_country_metadata(countries, max_workers=5):
-        results = {}
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_country = {
-                executor.submit(get_country_details, country): country
-                for country in countries
-            }
+    return background_executor, pdf_future, documents_future
 
-            for future in as_completed(future_to_country):
-                country = future_to_country[future]
-                try:
-                    results[country] = future.result()
-                    logger.info(f"SUCCESS country={country}")
-                except Exception:
-                    results[country] = None
-                    logger.error(f"FAILED country={country}")
 
-        return results
+def finish_document_extraction(output_dir: str, pdf_future, documents_future=None) -> str:
+    """Wait for the background extraction; indexes merchant documents. Returns the PDF text."""
 
-    unique_countries = df["country"].dropna().unique()
-    country_map = fetch_all_country_metadata(unique_countries)
-    logger.info(f"Fetched metadata for {len(country_map)} countries")
+    with stage("pdf_wait"):
+        pdf_text = pdf_future.result()
+        logger.info(f"Extracted {len(pdf_text)} characters from PDF")
 
-    # ------------------------------------------------------
-    # 5. Fetch internal risk
-    # ------------------------------------------------------
-    log_step(5, TOTAL_STEPS, "Fetching internal risk data (parallel)")
+        if documents_future is not None:
+            documents = documents_future.result()
+            parsed = [d for d in documents if not d["cached"] and not d["error"]]
+            logger.info(
+                f"Ingested {len(documents)} merchant documents "
+                f"({len(parsed)} parsed, {sum(d['pages'] for d in parsed)} pages; index {os.path.join(output_dir, 'documents.csv')})"
+            )
 
-    def fetch_all_internal_risk(merchant_ids, max_workers=10):
-        results = {}
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_mid = {
-                executor.submit(get_internal_risk, mid): mid
-                for mid in merchant_ids
-            }
+            failed = [d for d in documents if d["error"]]
+            if failed:
+                logger.warning(f"{len(failed)} merchant documents could not be read (see the error column of documents.csv)")
 
-            for future in as_completed(future_to_mid):
-                mid = future_to_mid[future]
-                try:
-                    results[mid] = future.result()
-                    logger.info(f"SUCCESS merchant_id={mid}")
-                except Exception:
-                    results[mid] = None
-                    logger.error(f"FAILED merchant_id={mid}")
+            index_path = index_documents(output_dir, documents)
+            logger.info(f"Document full-text index saved {index_path}")
 
-        return results
+    return pdf_text
 
-    merchant_ids = df["merchant_id"].unique()
-    internal_map = fetch_all_internal_risk(merchant_ids)
-    logger.info(f"Fetched internal risk for {len(internal_map)} merchants")
 
-    # ------------------------------------------------------
-    # 6. Build enriched dataset
-    # ------------------------------------------------------
-    log_step(6, TOTAL_STEPS, "Building enriched dataset")
+def scrape_site(output_dir: str) -> dict:
 
-    records = []
+    OUTPUT_SCRAPE = os.path.join(output_dir, "claritypay_site_data.json")
+    OUTPUT_SCRAPE_CACHE = os.path.join(output_dir, ".scrape_cache.json")
 
-    for _, row in df.iterrows():
-        merchant_id = row["merchant_id"]
-        country = row["country"]
+    with stage("scrape"):
+        # TTL cache + ETag/Last-Modified revalidation; an unchanged page costs one 304
+        site_data = scrape_claritypay(cache_path=OUTPUT_SCRAPE_CACHE)
 
-        internal = internal_map.get(merchant_id)
-        geo = country_map.get(country)
+        with open(OUTPUT_SCRAPE, "w") as f:
+            json.dump(site_data, f, indent=2)
 
-        if internal is None:
-            logger.warning(f"Skipping merchant_id={merchant_id} due to missing internal data")
-            continue
+        logger.info(f"Website data saved {OUTPUT_SCRAPE}")
 
-        records.append({
-            "merchant_id": merchant_id,
-            "name": row["name"],
-            "country": country,
-            "registration_number": row["registration_number"],
-            "monthly_volume": row["monthly_volume"],
-            "transaction_count": row["transaction_count"],
-            "dispute_count": row["dispute_count"],
+    return site_data
 
-            "internal_risk_flag": internal["internal_risk_flag"],
-            "internal_last_30d_volume": internal["transaction_summary"]["last_30d_volume"],
-            "internal_last_30d_txn_count": internal["transaction_summary"]["last_30d_txn_count"],
-            "internal_avg_ticket_size": internal["transaction_summary"]["avg_ticket_size"],
 
-            "normalized_country": geo["country_name"] if geo else None,
-            "region": geo["region"] if geo else None,
-            "subregion": geo["subregion"] if geo else None
-        })
+# ======================================================
+# MAIN PIPELINE FUNCTION (CLI CALLS THIS)
+# ======================================================
+def run_pipeline(
+    input_path: str,
+    output_dir: str,
+    documents_source: str = None,
+    queue_depth: int = ENRICH_QUEUE_DEPTH,
+    batch_size: int = ENRICH_BATCH_SIZE
+):
+
+    OUTPUT_DATASET = os.path.join(output_dir, "enriched_merchants.csv")
+    OUTPUT_FEATURES = os.path.join(output_dir, "underwriting_features.csv")
+    OUTPUT_PDF_TEXT = os.path.join(output_dir, "merchant_summary.txt")
 
-    final_df = pd.DataFrame(records)
-    logger.info(f"Final dataset size: {len(final_df)}")
+    os.makedirs(output_dir, exist_ok=True)
 
     # ------------------------------------------------------
-    # 7. Wait for PDF extraction
+    # 1. Load merchant dataset
     # ------------------------------------------------------
-    log_step(7, TOTAL_STEPS, "Waiting for PDF processing to complete")
+    log_step(1, TOTAL_STEPS, "Loading merchant dataset")
 
-    pdf_text = pdf_future.result()
-    logger.info(f"Extracted {len(pdf_text)} characters from PDF")
+    df = load_merchants(input_path, output_dir)
 
     # ------------------------------------------------------
-    # 8. Scrape website
+    # 2. Ensure internal API is running
     # ------------------------------------------------------
-    log_step(8, TOTAL_STEPS, "Scraping claritypay.com")
-    
-    if os.path.exists(OUTPUT_SCRAPE):
-        logger.info(f"Loading existing scrape data from {OUTPUT_SCRAPE}")
-        with open(OUTPUT_SCRAPE, "r") as f:
-            site_data = json.load(f)
-    else:
-        site_data = None
+    log_step(2, TOTAL_STEPS, "Ensuring internal API is running")
 
-    if not site_data:
-        logger.info("Scraping website data...")
-        site_data = scrape_claritypay()
+    with stage("internal_api_bootstrap"):
+        ensure_internal_api_running()
+        logger.info("Internal API is ready to use")
 
-    with open(OUTPUT_SCRAPE, "w") as f:
-        json.dump(site_data, f, indent=2)
+    # ------------------------------------------------------
+    # 3. Start PDF extraction in background
+    # ------------------------------------------------------
+    log_step(3, TOTAL_STEPS, "Starting background PDF extraction")
 
-    logger.info(f"Website data saved {OUTPUT_SCRAPE}")
+    background_executor, pdf_future, documents_future = start_document_extraction(output_dir, documents_source)
 
     # ------------------------------------------------------
-    # 9. Save outputs
+    # 4. Fetch country metadata
     # ------------------------------------------------------
-    log_step(9, TOTAL_STEPS, "Saving outputs")
+    log_step(4, TOTAL_STEPS, "Fetching country metadata (parallel)")
 
-    final_df.to_csv(OUTPUT_DATASET, index=False)
-    logger.info(f"Dataset saved {OUTPUT_DATASET}")
+    with stage("country_metadata"):
+        unique_countries = df["country"].dropna().unique()
+        country_map = fetch_all_country_metadata(unique_countries)
+        logger.info(f"Fetched metadata for {len(country_map)} countries")
 
-    with open(OUTPUT_PDF_TEXT, "w", encoding="utf-8") as f:
-        f.write(pdf_text)
+    # ------------------------------------------------------
+    # 5. Internal risk -> enriched records -> features (streaming)
+    # ------------------------------------------------------
+    log_step(5, TOTAL_STEPS, "Fetching internal risk and building enriched / feature batches (streaming)")
+
+    with stage("enrich_stream") as s:
+        stats = {}
+        enriched_parts, feature_parts = [], []
+
+        batches = stream_enriched_batches(df, country_map, queue_depth=queue_depth, batch_size=batch_size, stats=stats)
+        for batch in batches:
+            features = compact_frame(build_underwriting_features(batch))
+
+            # written as they are built; the header goes with the first batch
+            first = not enriched_parts
+            batch.to_csv(OUTPUT_DATASET, mode="w" if first else "a", header=first, index=False)
+            features.to_csv(OUTPUT_FEATURES, mode="w" if first else "a", header=first, index=False)
+
+            enriched_parts.append(batch)
+            feature_parts.append(features)
+
+        if enriched_parts:
+            final_df = compact_frame(pd.concat(enriched_parts, ignore_index=True))
+            features_df = compact_frame(pd.concat(feature_parts, ignore_index=True))
+        else:
+            # every merchant was skipped: nothing to build features from
+            final_df = compact_frame(pd.DataFrame())
+            features_df = compact_frame(pd.DataFrame())
+            final_df.to_csv(OUTPUT_DATASET, index=False)
+            features_df.to_csv(OUTPUT_FEATURES, index=False)
+
+        logger.info(
+            f"Final dataset size: {len(final_df)} in {stats['batches']} batches "
+            f"(fetching paused {stats['stalls']} times, at most {stats['max_buffered']} lookups buffered)"
+        )
+        logger.info(f"Dataset saved {OUTPUT_DATASET}")
+        logger.info(f"Underwriting feature view saved {OUTPUT_FEATURES}")
+
+        s.set_rows(len(final_df))
+        log_frame_memory(logger, "Enriched frame", final_df, s)
+        log_frame_memory(logger, "Feature frame", features_df)
+
+    # ------------------------------------------------------
+    # 6. Wait for PDF extraction
+    # ------------------------------------------------------
+    log_step(6, TOTAL_STEPS, "Waiting for PDF processing to complete")
 
-    logger.info(f"PDF text saved {OUTPUT_PDF_TEXT}")
+    pdf_text = finish_document_extraction(output_dir, pdf_future, documents_future)
 
     # ------------------------------------------------------
-    # 10. Build underwriting features
+    # 7. Scrape website
     # ------------------------------------------------------
-    log_step(10, TOTAL_STEPS, "Building underwriting feature view")
+    log_step(7, TOTAL_STEPS, "Scraping claritypay.com")
 
-    features_df = build_underwriting_features(final_df)
+    scrape_site(output_dir)
+
+    # ------------------------------------------------------
+    # 8. Save outputs
+    # ------------------------------------------------------
+    log_step(8, TOTAL_STEPS, "Saving outputs")
 
-    features_path = os.path.join(output_dir, "underwriting_features.csv")
-    features_df.to_csv(features_path, index=False)
+    with stage("save_outputs"):
+        with open(OUTPUT_PDF_TEXT, "w", encoding="utf-8") as f:
+            f.write(pdf_text)
 
-    logger.info(f"Underwriting feature view saved {features_path}")
+        logger.info(f"PDF text saved {OUTPUT_PDF_TEXT}")
 
     logger.info("Data pipeline complete -> returning datasets to caller")
 
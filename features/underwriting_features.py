@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 
@@ -5,20 +6,61 @@ HIGH_RISK_REGIONS = {"Africa", "South America"}
 MEDIUM_RISK_REGIONS = {"Asia"}
 
 
-def classify_volume(volume):
-    if volume >= 100000:
-        return "high"
-    elif volume >= 10000:
-        return "medium"
-    return "low"
+RISK_LEVELS = ["low", "medium", "high"]
 
 
-def classify_geo_risk(region):
-    if region in HIGH_RISK_REGIONS:
-        return "high"
-    if region in MEDIUM_RISK_REGIONS:
-        return "medium"
-    return "low"
+def classify_volume(volume) -> pd.Categorical:
+    """Volume tier of every monthly volume: high from 100k, medium from 10k, else low."""
+
+    volume = np.asarray(volume, dtype=float)
+    return pd.Categorical(
+        np.select([volume >= 100000, volume >= 10000], ["high", "medium"], default="low"),
+        categories=RISK_LEVELS
+    )
+
+
+def classify_geo_risk(region) -> pd.Categorical:
+    """Geo risk of every region (missing or unlisted regions are low)."""
+
+    region = pd.Series(region)
+    return pd.Categorical(
+        np.select([region.isin(HIGH_RISK_REGIONS), region.isin(MEDIUM_RISK_REGIONS)], ["high", "medium"], default="low"),
+        categories=RISK_LEVELS
+    )
+
+
+def combine_labels(*columns: pd.Series, sep: str = "_") -> pd.Categorical:
+    """
+    Same values as joining the columns' strings row by row (missing if any
+    part is missing), built as a categorical: only the distinct
+    combinations are ever turned into strings.
+    """
+
+    combined = np.zeros(len(columns[0]), dtype=np.int64)
+    missing = np.zeros(len(columns[0]), dtype=bool)
+    all_labels = []
+
+    for column in columns:
+        values = pd.Categorical(column)
+        labels = [str(c) for c in values.categories]
+        combined = combined * max(len(labels), 1) + np.maximum(values.codes, 0)
+        missing |= values.codes < 0
+        all_labels.append(labels)
+
+    present, codes = np.unique(combined[~missing], return_inverse=True)
+
+    names = []
+    for key in present:
+        parts = []
+        for labels in reversed(all_labels):
+            key, code = divmod(int(key), len(labels))
+            parts.append(labels[code])
+        names.append(sep.join(reversed(parts)))
+
+    full_codes = np.full(len(combined), -1, dtype=np.int64)
+    full_codes[~missing] = codes.reshape(-1)
+
+    return pd.Categorical.from_codes(full_codes, categories=names)
 
 
 def build_underwriting_features(enriched_df: pd.DataFrame) -> pd.DataFrame:
@@ -35,11 +77,11 @@ def build_underwriting_features(enriched_df: pd.DataFrame) -> pd.DataFrame:
     )
 
     # --- volume tier ---
-    df["volume_tier"] = df["monthly_volume"].apply(classify_volume)
+    df["volume_tier"] = classify_volume(df["monthly_volume"])
 
     # --- geo risk ---
     if "region" in df.columns:
-        df["geo_risk"] = df["region"].apply(classify_geo_risk)
+        df["geo_risk"] = classify_geo_risk(df["region"])
     else:
         # allow precomputed geo_risk OR default
         df["geo_risk"] = df.get("geo_risk", "unknown")
@@ -52,11 +94,7 @@ def build_underwriting_features(enriched_df: pd.DataFrame) -> pd.DataFrame:
         df["internal_risk"] = df.get("internal_risk", "unknown")
 
     # --- heuristic combined signal ---
-    df["overall_risk_hint"] = (
-        df["behavior_risk"].astype(str) + "_" +
-        df["geo_risk"].astype(str) + "_" +
-        df["internal_risk"].astype(str)
-    )
+    df["overall_risk_hint"] = combine_labels(df["behavior_risk"], df["geo_risk"], df["internal_risk"])
 
     expected_columns = [
         "merchant_id",
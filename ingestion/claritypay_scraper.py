@@ -1,16 +1,23 @@
-import requests
-from bs4 import BeautifulSoup
-import time
 from datetime import datetime
 
+from lxml import etree
+
+from ingestion.site_crawler import CACHE_TTL_SECONDS, crawl_site, normalize_url
 
-URL = "https://claritypay.com"
 
-HEADERS = {
-    "User-Agent": "MLE-Assignment-Bot/1.0 (Educational Project; Respectful Scraping)"
-}
+URL = "https://claritypay.com"
 
+# per-host politeness delay (applied by the crawler without blocking other work)
 REQUEST_DELAY_SECONDS = 1
+MAX_PAGES = 25
+
+SITE_DATA_KEYS = ["value_propositions", "partners", "public_stats"]
+
+VALUE_PROP_TAGS = {"h1", "h2", "h3", "p"}
+VALUE_PROP_KEYWORDS = ["pay", "flexible", "transparent", "terms", "checkout"]
+
+# text inside these never counts as page copy
+SKIPPED_TEXT_TAGS = {"script", "style", "template", "noscript"}
 
 
 # ------------------------------------------------------
@@ -22,106 +29,158 @@ def log(message):
 
 
 # ------------------------------------------------------
-# Fetch Page
+# Single-pass extraction
 # ------------------------------------------------------
-def fetch_page(url: str) -> str:
-    log("Fetching claritypay.com homepage")
-    time.sleep(REQUEST_DELAY_SECONDS)  # polite rate limiting
-
-    response = requests.get(url, headers=HEADERS, timeout=10)
-    response.raise_for_status()
-
-    log("Page fetched successfully")
-    return response.text
-
-
-# ------------------------------------------------------
-# Extract Value Propositions
-# ------------------------------------------------------
-def extract_value_propositions(soup):
-    log("Extracting value propositions")
-
-    propositions = []
-    keywords = ["pay", "flexible", "transparent", "terms", "checkout"]
-
-    for tag in soup.find_all(["h1", "h2", "h3", "p"]):
-        text = tag.get_text(strip=True)
-
-        if len(text) < 120 and any(k in text.lower() for k in keywords):
-            propositions.append(text)
-
-    unique_props = list(set(propositions))
-    log(f"Found {len(unique_props)} potential value propositions")
-
-    return unique_props
-
-
-# ------------------------------------------------------
-# Extract Public Stats
-# ------------------------------------------------------
-def extract_public_stats(soup):
-    log("Extracting public statistics")
-
-    stats = []
-
-    for text in soup.stripped_strings:
-        if any(char.isdigit() for char in text):
-            if any(sym in text for sym in ["+", "$"]):
-                if len(text) < 100:
-                    stats.append(text)
-
-    unique_stats = list(set(stats))
-    log(f"Found {len(unique_stats)} potential public stats")
-
-    return unique_stats
+class _SiteExtractor:
+    """
+    lxml parser target: receives start/end/data events while the HTML is
+    parsed, so value propositions, public stats and partner names are all
+    collected in one pass without building a tree.
+    """
+
+    def __init__(self):
+        self.value_propositions = set()
+        self.public_stats = set()
+        self.partners = set()
+        self.links = []
+
+        self._pending = []     # data chunks of the current text node
+        self._captures = []    # open h1/h2/h3/p: [tag, stripped strings]
+        self._skip_depth = 0
+
+    # one text node ends at every tag boundary
+    def _flush_text(self):
+        if not self._pending:
+            return
+
+        text = "".join(self._pending).strip()
+        self._pending = []
+
+        if not text or self._skip_depth:
+            return
+
+        for capture in self._captures:
+            capture[1].append(text)
+
+        if len(text) < 100 and any(sym in text for sym in "+$") and any(c.isdigit() for c in text):
+            self.public_stats.add(text)
+
+    def start(self, tag, attrib):
+        self._flush_text()
+        tag = tag.lower() if isinstance(tag, str) else tag
+
+        if tag in SKIPPED_TEXT_TAGS:
+            self._skip_depth += 1
+        elif tag in VALUE_PROP_TAGS:
+            self._captures.append([tag, []])
+        elif tag == "a" and attrib.get("href"):
+            self.links.append(attrib["href"])
+        elif tag == "img":
+            # partner names usually live in logo alt text
+            alt = (attrib.get("alt") or "").strip()
+            if alt and len(alt) < 50 and "logo" not in alt.lower():
+                self.partners.add(alt)
+
+    def end(self, tag):
+        self._flush_text()
+        tag = tag.lower() if isinstance(tag, str) else tag
+
+        if tag in SKIPPED_TEXT_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in VALUE_PROP_TAGS and self._captures and self._captures[-1][0] == tag:
+            _, parts = self._captures.pop()
+            text = "".join(parts)
+            if len(text) < 120 and any(k in text.lower() for k in VALUE_PROP_KEYWORDS):
+                self.value_propositions.add(text)
+
+    def data(self, text):
+        self._pending.append(text)
+
+    def comment(self, text):
+        self._flush_text()
+
+    def close(self):
+        self._flush_text()
+        return {
+            "value_propositions": sorted(self.value_propositions),
+            "partners": sorted(self.partners),
+            "public_stats": sorted(self.public_stats),
+            "links": self.links
+        }
 
 
-# ------------------------------------------------------
-# Extract Partner Names
-# ------------------------------------------------------
-def extract_partners(soup):
-    log("Extracting partner names")
+def extract_page(chunks, encoding: str = "utf-8"):
+    """
+    (site data, links) from HTML given as a string/bytes or an iterable of
+    byte chunks (parsed as they arrive).
+    """
 
-    partners = []
+    if isinstance(chunks, (str, bytes)):
+        chunks = [chunks]
 
-    # Often partner names appear in image alt text
-    for img in soup.find_all("img"):
-        alt = img.get("alt")
+    parser = etree.HTMLParser(target=_SiteExtractor(), encoding=encoding)
+    for chunk in chunks:
+        parser.feed(chunk.encode(encoding) if isinstance(chunk, str) else chunk)
+    data = parser.close()
+    links = data.pop("links")
 
-        if alt and len(alt) < 50 and "logo" not in alt.lower():
-            partners.append(alt.strip())
+    return data, links
 
-    unique_partners = list(set(partners))
-    log(f"Found {len(unique_partners)} potential partners")
 
-    return unique_partners
+def extract_site_data(html) -> dict:
+    """Value propositions, partners and public stats of one page."""
+    data, _ = extract_page(html)
+    return data
 
 
 # ------------------------------------------------------
 # Main Scraper Function
 # ------------------------------------------------------
-def scrape_claritypay():
-
-    log("Starting scrape process")
+def scrape_claritypay(
+    url: str = URL,
+    cache_path: str = None,
+    ttl: float = CACHE_TTL_SECONDS,
+    max_pages: int = MAX_PAGES,
+    host_delay: float = None
+):
+    """
+    Crawl the homepage plus linked partner / pricing / legal pages and
+    merge what they contain into the claritypay_site_data.json shape.
+    """
+
+    log("Starting crawl")
 
     try:
-        html = fetch_page(URL)
-        soup = BeautifulSoup(html, "lxml")
-
-        data = {
-            "value_propositions": extract_value_propositions(soup),
-            "partners": extract_partners(soup),
-            "public_stats": extract_public_stats(soup)
-        }
+        pages, stats = crawl_site(
+            url,
+            extract_page,
+            cache_path=cache_path,
+            ttl=ttl,
+            max_pages=max_pages,
+            host_delay=REQUEST_DELAY_SECONDS if host_delay is None else host_delay,
+            log=log
+        )
+    except Exception as e:
+        pages, stats = {}, {"error": str(e)}
 
-        log("Scraping completed successfully")
-        return data
+    log(f"Crawl finished: {len(pages)} pages ({stats})")
 
-    except Exception as e:
-        log(f"Scraping failed: {e}")
+    if normalize_url(url) not in pages:
+        log("Scraping failed: start page unavailable")
         return {
             "value_propositions": [],
             "partners": [],
             "public_stats": [],
-            "error": str(e)
+            "error": stats.get("error") or f"could not fetch {url}"
         }
+
+    merged = {key: set() for key in SITE_DATA_KEYS}
+    for entry in pages.values():
+        for key in SITE_DATA_KEYS:
+            merged[key].update(entry["data"][key])
+
+    data = {key: sorted(values) for key, values in merged.items()}
+    log(f"Merged site data from: {', '.join(sorted(pages))}")
+
+    log("Scraping completed successfully")
+    return data
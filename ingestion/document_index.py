@@ -0,0 +1,238 @@
+import os
+import csv
+import sqlite3
+import argparse
+import time
+
+from ingestion.document_ingestion import INDEX_FILE, read_document_pages
+
+
+INDEX_PATH = "document_index.sqlite"
+
+# terms pulled as report evidence for the riskiest merchants
+EVIDENCE_TERMS = ["chargeback", "dispute", "refund policy", "fraud", "reversal"]
+EVIDENCE_PER_MERCHANT = 2
+
+SNIPPET_TOKENS = 24
+
+
+# ------------------------------------------------------
+# Query helpers
+# ------------------------------------------------------
+def phrase(text: str) -> str:
+    """Quote text as one FTS5 phrase ("refund policy" matches the words adjacent, in order)."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def any_of(terms: list) -> str:
+    """FTS5 query matching any of the terms; multi-word terms are matched as phrases."""
+    return " OR ".join(phrase(t) for t in terms)
+
+
+# ------------------------------------------------------
+# Index
+# ------------------------------------------------------
+class DocumentIndex:
+    """
+    SQLite FTS5 index over extracted document text, one row per page,
+    keyed by merchant_id, document hash and page number.
+
+        with DocumentIndex("output/document_index.sqlite") as index:
+            index.add_documents(records)
+            hits = index.search(phrase("refund policy"), merchant_id="M001")
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+        try:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    merchant_id TEXT NOT NULL,
+                    sha256      TEXT NOT NULL,
+                    path        TEXT,
+                    pages       INTEGER,
+                    indexed_at  REAL,
+                    PRIMARY KEY (merchant_id, sha256)
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+                    text,
+                    merchant_id UNINDEXED,
+                    sha256 UNINDEXED,
+                    page UNINDEXED,
+                    tokenize = 'porter unicode61'
+                );
+            """)
+        except sqlite3.OperationalError as e:
+            raise RuntimeError(f"SQLite build without FTS5 support: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    # --------------------------------------------------
+    # Loading
+    # --------------------------------------------------
+    def add_documents(self, records: list) -> int:
+        """
+        Index ingestion records (merchant_id, path, sha256, text_path).
+        Documents already indexed under the same hash, or that failed to
+        ingest, are skipped; a changed file at the same path replaces its
+        old pages.
+        Returns the number of pages added.
+        """
+
+        added = 0
+
+        with self.conn:
+            for record in records:
+                if record.get("error"):
+                    continue
+
+                merchant_id, sha = str(record["merchant_id"]), record["sha256"]
+
+                exists = self.conn.execute(
+                    "SELECT 1 FROM documents WHERE merchant_id = ? AND sha256 = ?", (merchant_id, sha)
+                ).fetchone()
+                if exists:
+                    continue
+
+                # previous version of the same file
+                stale = self.conn.execute(
+                    "SELECT sha256 FROM documents WHERE merchant_id = ? AND path = ?", (merchant_id, record["path"])
+                ).fetchall()
+                for (old_sha,) in stale:
+                    self.conn.execute("DELETE FROM pages WHERE merchant_id = ? AND sha256 = ?", (merchant_id, old_sha))
+                    self.conn.execute("DELETE FROM documents WHERE merchant_id = ? AND sha256 = ?", (merchant_id, old_sha))
+
+                pages = read_document_pages(record["text_path"])
+                self.conn.executemany(
+                    "INSERT INTO pages (text, merchant_id, sha256, page) VALUES (?, ?, ?, ?)",
+                    ((text, merchant_id, sha, number) for number, text in enumerate(pages, start=1) if text.strip())
+                )
+                self.conn.execute(
+                    "INSERT INTO documents VALUES (?, ?, ?, ?, ?)",
+                    (merchant_id, sha, record["path"], len(pages), time.time())
+                )
+                added += len(pages)
+
+        return added
+
+    def optimize(self):
+        """Merge FTS5 segments after large loads (faster queries, smaller file)."""
+        with self.conn:
+            self.conn.execute("INSERT INTO pages(pages) VALUES ('optimize')")
+
+    # --------------------------------------------------
+    # Queries
+    # --------------------------------------------------
+    def search(self, query: str, merchant_id=None, limit: int = 20) -> list:
+        """
+        FTS5 query (bare words, phrase("..."), AND / OR / NOT, prefix*),
+        best matches first. `merchant_id` may be one id or a list.
+        Returns [{"merchant_id", "page", "snippet", "score"}].
+        """
+
+        sql = (
+            "SELECT merchant_id, sha256, page, "
+            f"snippet(pages, 0, '[', ']', ' ... ', {SNIPPET_TOKENS}), bm25(pages) "
+            "FROM pages WHERE pages MATCH ?"
+        )
+        params = [query]
+
+        if merchant_id is not None:
+            ids = [merchant_id] if isinstance(merchant_id, str) else [str(m) for m in merchant_id]
+            sql += f" AND merchant_id IN ({','.join('?' * len(ids))})"
+            params += ids
+
+        sql += " ORDER BY bm25(pages) LIMIT ?"
+        params.append(limit)
+
+        return [
+            {"merchant_id": m, "sha256": sha, "page": page, "snippet": snippet, "score": round(-score, 4)}
+            for m, sha, page, snippet, score in self.conn.execute(sql, params)
+        ]
+
+    def evidence(self, merchant_ids: list, terms: list = EVIDENCE_TERMS, per_merchant: int = EVIDENCE_PER_MERCHANT) -> list:
+        """Best-matching passages for the given merchants, at most `per_merchant` each (one query)."""
+
+        merchant_ids = [str(m) for m in merchant_ids]
+        if not merchant_ids:
+            return []
+
+        hits = self.search(any_of(terms), merchant_id=merchant_ids, limit=per_merchant * len(merchant_ids) * 5)
+
+        kept, counts = [], {}
+        for hit in hits:
+            if counts.get(hit["merchant_id"], 0) < per_merchant:
+                counts[hit["merchant_id"]] = counts.get(hit["merchant_id"], 0) + 1
+                kept.append(hit)
+
+        return kept
+
+    def stats(self) -> dict:
+        documents, = self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+        merchants, = self.conn.execute("SELECT COUNT(DISTINCT merchant_id) FROM documents").fetchone()
+        pages, = self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()
+        return {"documents": documents, "merchants": merchants, "pages": pages}
+
+
+# ------------------------------------------------------
+# Pipeline step
+# ------------------------------------------------------
+def index_documents(output_dir: str, records: list = None) -> str:
+    """Index the ingested documents of a run (records, or documents.csv) into <output_dir>/document_index.sqlite."""
+
+    if records is None:
+        with open(os.path.join(output_dir, INDEX_FILE), newline="") as f:
+            records = list(csv.DictReader(f))
+
+    index_path = os.path.join(output_dir, INDEX_PATH)
+
+    start = time.perf_counter()
+    with DocumentIndex(index_path) as index:
+        added = index.add_documents(records)
+        if added:
+            index.optimize()
+        stats = index.stats()
+
+    print(f"Indexed {added} new pages in {time.perf_counter() - start:.2f}s "
+          f"({stats['documents']} documents, {stats['merchants']} merchants, {stats['pages']} pages total)")
+
+    return index_path
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Search the merchant document index")
+    parser.add_argument("query", help='FTS5 query, e.g. chargeback or "refund policy"')
+    parser.add_argument("--index", default=os.path.join("output", INDEX_PATH))
+    parser.add_argument("--merchant", default=None, help="Restrict to one merchant_id")
+    parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+
+    with DocumentIndex(args.index) as index:
+        start = time.perf_counter()
+        hits = index.search(args.query, merchant_id=args.merchant, limit=args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+
+    for hit in hits:
+        print(f"{hit['merchant_id']} p.{hit['page']} ({hit['score']:.2f}): {hit['snippet']}")
+    print(f"{len(hits)} hits in {elapsed:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python -m ingestion.document_index chargeback
+# python -m ingestion.document_index '"refund policy"' --merchant M001
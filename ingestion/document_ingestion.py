@@ -0,0 +1,306 @@
+import os
+import csv
+import json
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+
+from model.model_registry import file_sha256
+
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+PAGES_PER_TASK = 25
+
+# page-range tasks in flight per worker; bounds the text held in memory
+PENDING_PER_WORKER = 4
+
+# pages are separated by form feeds in the extracted text files
+PAGE_SEPARATOR = "\f"
+
+DOCUMENTS_DIR = "documents"
+INDEX_FILE = "documents.csv"
+
+
+# ------------------------------------------------------
+# Document discovery
+# ------------------------------------------------------
+def discover_documents(source: str) -> list:
+    """
+    Documents to ingest as [{"merchant_id", "path"}].
+
+    `source` is either a manifest (.csv with merchant_id,path columns or
+    .json list of the same objects; relative paths resolve against the
+    manifest's folder) or a directory of PDFs. In a directory, files in a
+    sub-folder belong to the merchant named by that folder; top-level
+    files use the part of the name before the first "_".
+    """
+
+    if os.path.isdir(source):
+        documents = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if not name.lower().endswith(".pdf"):
+                    continue
+                if os.path.samefile(root, source):
+                    merchant_id = os.path.splitext(name)[0].split("_")[0]
+                else:
+                    merchant_id = os.path.relpath(root, source).split(os.sep)[0]
+                documents.append({"merchant_id": merchant_id, "path": os.path.join(root, name)})
+        return sorted(documents, key=lambda d: d["path"])
+
+    base = os.path.dirname(source)
+
+    if source.lower().endswith(".json"):
+        with open(source) as f:
+            entries = json.load(f)
+    else:
+        with open(source, newline="") as f:
+            entries = list(csv.DictReader(f))
+
+    return [
+        {"merchant_id": str(e["merchant_id"]), "path": os.path.join(base, e["path"])}
+        for e in entries
+    ]
+
+
+# ------------------------------------------------------
+# Worker process
+# ------------------------------------------------------
+def _extract_pages(path: str, start: int, stop: int) -> list:
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _meta_path(text_path: str) -> str:
+    return os.path.splitext(text_path)[0] + ".json"
+
+
+class _DocumentOutput:
+    """
+    Streams one document's pages to <sha>.txt.part; when the last range
+    arrives it is renamed to <sha>.txt next to a <sha>.json with the counts.
+    """
+
+    def __init__(self, text_path: str, tasks: int):
+        self.text_path = text_path
+        self.remaining = tasks
+        self.pages = 0
+        self.chars = 0
+        self.started = None
+        self.failed = False
+        self._file = None
+
+    def abort(self):
+        # a range failed: drop the partial text, later ranges are ignored
+        self.failed = True
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.text_path + ".part")
+
+    def write(self, pages: list) -> bool:
+        # opened on first arrival: ranges drain in order, so only a few files are open at once
+        if self._file is None:
+            self._file = open(self.text_path + ".part", "w", encoding="utf-8")
+
+        for page in pages:
+            if self.pages:
+                self._file.write(PAGE_SEPARATOR)
+            self._file.write(page.replace(PAGE_SEPARATOR, ""))
+            self.pages += 1
+            self.chars += len(page)
+
+        self.remaining -= 1
+        if self.remaining:
+            return False
+
+        self._file.close()
+        os.replace(self.text_path + ".part", self.text_path)
+        with open(_meta_path(self.text_path), "w") as f:
+            json.dump({"pages": self.pages, "chars": self.chars}, f)
+        return True
+
+
+# ------------------------------------------------------
+# Ingestion entry point
+# ------------------------------------------------------
+def ingest_documents(
+    source: str,
+    output_dir: str,
+    n_workers: int = DEFAULT_WORKERS,
+    pages_per_task: int = PAGES_PER_TASK
+) -> list:
+    """
+    Extract the text of every document into <output_dir>/documents/<sha256>.txt.
+
+    Pages are split into ranges of `pages_per_task` and extracted across a
+    process pool; results are drained in submission order, so each
+    document streams to disk page by page without holding it in memory.
+    Documents whose hash already has a text file are not parsed again.
+    A document that cannot be read or parsed is skipped with its `error`
+    recorded. Returns one record per document, also written to documents.csv.
+    """
+
+    documents_dir = os.path.join(output_dir, DOCUMENTS_DIR)
+    os.makedirs(documents_dir, exist_ok=True)
+
+    documents = discover_documents(source)
+    print(f"Ingesting {len(documents)} documents from {source} ({n_workers} workers, {pages_per_task} pages per task)")
+
+    started = time.perf_counter()
+    records = []
+    to_parse = []
+
+    def failed(record, error, since):
+        record.update(text_path="", pages=0, chars=0, seconds=round(time.perf_counter() - since, 3), cached=False,
+                      error=f"{type(error).__name__}: {error}")
+        print(f"  {record['merchant_id']} {os.path.basename(record['path'])}: skipped ({record['error']})")
+
+    for doc in documents:
+        hash_start = time.perf_counter()
+        record = {**doc, "sha256": "", "text_path": "", "error": ""}
+        records.append(record)
+
+        try:
+            record["sha256"] = file_sha256(doc["path"])
+        except OSError as e:
+            failed(record, e, hash_start)
+            continue
+
+        text_path = os.path.join(documents_dir, f"{record['sha256']}.txt")
+        record["text_path"] = text_path
+
+        if os.path.exists(text_path) and os.path.exists(_meta_path(text_path)):
+            with open(_meta_path(text_path)) as f:
+                record.update(json.load(f))
+            record.update(cached=True, seconds=round(time.perf_counter() - hash_start, 3))
+        else:
+            try:
+                with fitz.open(doc["path"]) as pdf:
+                    record["page_count"] = pdf.page_count
+            except Exception as e:
+                # corrupt or not a PDF: one bad upload must not stop the others
+                failed(record, e, hash_start)
+                continue
+            to_parse.append(record)
+
+    # identical files listed twice are parsed once
+    unique = {}
+    for record in to_parse:
+        unique.setdefault(record["sha256"], record)
+
+    tasks = [
+        (record, start, min(start + pages_per_task, record["page_count"]))
+        for record in unique.values()
+        # an empty PDF still gets one (empty) task so its output is written
+        for start in range(0, max(record["page_count"], 1), pages_per_task)
+    ]
+
+    outputs = {
+        record["sha256"]: _DocumentOutput(record["text_path"], max(-(-record["page_count"] // pages_per_task), 1))
+        for record in unique.values()
+    }
+
+    def submitted(record):
+        output = outputs[record["sha256"]]
+        if output.started is None:
+            output.started = time.perf_counter()
+
+    def finish(record, extract):
+        output = outputs[record["sha256"]]
+        if output.failed:
+            return
+
+        try:
+            pages = extract()
+        except Exception as e:
+            output.abort()
+            failed(record, e, output.started)
+            return
+
+        if output.write(pages):
+            record.update(pages=output.pages, chars=output.chars, seconds=round(time.perf_counter() - output.started, 3))
+            print(f"  {record['merchant_id']} {os.path.basename(record['path'])}: "
+                  f"{output.pages} pages in {record['seconds']:.2f}s")
+
+    if n_workers <= 1 or len(tasks) <= 1:
+        for record, start, stop in tasks:
+            submitted(record)
+            finish(record, lambda: _extract_pages(record["path"], start, stop))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # drained from the left, so each document's pages arrive in order
+            pending = deque()
+            max_pending = n_workers * PENDING_PER_WORKER
+
+            for record, start, stop in tasks:
+                submitted(record)
+                pending.append((record, executor.submit(_extract_pages, record["path"], start, stop)))
+                if len(pending) >= max_pending:
+                    done_record, future = pending.popleft()
+                    finish(done_record, future.result)
+
+            while pending:
+                done_record, future = pending.popleft()
+                finish(done_record, future.result)
+
+    # duplicates share the text (and cost, or error) of the first copy
+    for record in to_parse:
+        first = unique[record["sha256"]]
+        record.update(
+            text_path=first["text_path"],
+            pages=first["pages"],
+            chars=first["chars"],
+            seconds=first["seconds"],
+            cached=record is not first and not first["error"],
+            error=first["error"]
+        )
+        record.pop("page_count", None)
+
+    write_document_index(records, os.path.join(output_dir, INDEX_FILE))
+
+    elapsed = time.perf_counter() - started
+    errors = sum(bool(r["error"]) for r in records)
+    cached = sum(r["cached"] for r in records)
+    pages = sum(r["pages"] for r in records if not r["cached"])
+    print(f"Ingested {len(records)} documents ({len(records) - cached - errors} parsed, {cached} cached, "
+          f"{errors} failed, {pages} pages) in {elapsed:.2f}s")
+
+    return records
+
+
+def write_document_index(records: list, path: str):
+    columns = ["merchant_id", "path", "sha256", "text_path", "pages", "chars", "seconds", "cached", "error"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def read_document_pages(text_path: str) -> list:
+    with open(text_path, encoding="utf-8") as f:
+        return f.read().split(PAGE_SEPARATOR)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Parallel page-level PDF text extraction")
+    parser.add_argument("--source", required=True, help="Directory of PDFs or manifest (.csv / .json with merchant_id,path)")
+    parser.add_argument("--output", default="output", help="Output directory")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--pages-per-task", type=int, default=PAGES_PER_TASK)
+
+    args = parser.parse_args()
+
+    ingest_documents(args.source, args.output, args.workers, args.pages_per_task)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python -m ingestion.document_ingestion --source data/documents/ --output output
+# python -m ingestion.document_ingestion --source data/documents.csv --workers 8 --pages-per-task 50
@@ -0,0 +1,344 @@
+import re
+import time
+import argparse
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from common.logger_config import setup_logger
+
+logger = setup_logger()
+
+
+# trailing words dropped before names are compared ("GreenLeaf Retail Ltd" == "Greenleaf Retail")
+LEGAL_SUFFIXES = {
+    "ltd", "limited", "co", "company", "corp", "corporation", "inc", "incorporated",
+    "llc", "llp", "lp", "plc", "gmbh", "ag", "sa", "sas", "sarl", "srl", "spa", "bv", "nv", "ab", "oy"
+}
+
+SHINGLE_SIZE = 3
+
+# MinHash LSH: NUM_PERM hashes split into BANDS bands of NUM_PERM / BANDS rows.
+# Two names share a bucket with probability 1 - (1 - J^rows)^bands, i.e. a
+# candidate threshold around Jaccard (1 / BANDS) ** (1 / rows) ~ 0.59
+NUM_PERM = 32
+BANDS = 8
+PRIME = (1 << 31) - 1
+SEED = 7
+
+# candidates are kept only when their shingle Jaccard similarity reaches this
+NAME_SIMILARITY = 0.6
+
+# buckets larger than this (very generic names) are not expanded into pairs
+MAX_BLOCK_SIZE = 500
+
+CLUSTERS_FILE = "entity_clusters.csv"
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+# ------------------------------------------------------
+# Normalisation
+# ------------------------------------------------------
+def normalize_name(name) -> str:
+    """Lower-case ASCII words without punctuation or trailing legal suffixes."""
+
+    if not isinstance(name, str):
+        return ""
+
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode().lower()
+    tokens = _NON_ALNUM.sub(" ", name.replace("&", " and ")).split()
+
+    while len(tokens) > 1 and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+
+    return " ".join(tokens)
+
+
+def normalize_registration(value) -> str:
+    """Upper-case alphanumerics; numeric numbers lose leading zeros (CSV readers drop them anyway)."""
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    value = re.sub(r"[^0-9A-Z]", "", str(value).upper())
+    return (value.lstrip("0") or value) if value.isdigit() else value
+
+
+def shingles(name: str) -> set:
+    padded = f" {name} "
+    if len(padded) <= SHINGLE_SIZE:
+        return {padded}
+    return {padded[i:i + SHINGLE_SIZE] for i in range(len(padded) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+# ------------------------------------------------------
+# MinHash
+# ------------------------------------------------------
+def minhash_signatures(names: list) -> np.ndarray:
+    """
+    (len(names), NUM_PERM) uint32 MinHash signatures of the names' character
+    shingles. Names must be normalised (ASCII, non-empty); each shingle is
+    packed into one integer straight from the concatenated name bytes.
+    """
+
+    padded = [f" {name} " for name in names]
+    lengths = np.fromiter(map(len, padded), dtype=np.int64, count=len(padded))
+    data = np.frombuffer("".join(padded).encode("ascii"), dtype=np.uint8).astype(np.uint64)
+
+    ends = np.cumsum(lengths)
+    owner = np.repeat(np.arange(len(padded)), lengths)
+    shingle_start = np.flatnonzero(np.arange(len(data)) + SHINGLE_SIZE <= ends[owner])
+
+    values = np.zeros(len(shingle_start), dtype=np.uint64)
+    for k in range(SHINGLE_SIZE):
+        values = (values << np.uint64(8)) | data[shingle_start + k]
+
+    # padded names are at least SHINGLE_SIZE long, so every name owns a
+    # contiguous, non-empty run of shingles beginning at `starts`
+    rows = owner[shingle_start]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+
+    rng = np.random.default_rng(SEED)
+    a = rng.integers(1, PRIME, NUM_PERM, dtype=np.uint64)
+    b = rng.integers(0, PRIME, NUM_PERM, dtype=np.uint64)
+
+    signatures = np.empty((len(names), NUM_PERM), dtype=np.uint32)
+    for k in range(NUM_PERM):
+        signatures[:, k] = np.minimum.reduceat((a[k] * values + b[k]) % PRIME, starts)
+
+    return signatures
+
+
+def _star_edges(keys: np.ndarray, positions: np.ndarray):
+    """Edges linking every position to the first position with the same key."""
+
+    first = pd.Series(positions).groupby(keys).transform("first").to_numpy()
+    keep = first != positions
+    return positions[keep], first[keep]
+
+
+def _block_keys(*parts) -> np.ndarray:
+    """Factorised "a|b|..." keys, built from object arrays so that empty inputs work too."""
+
+    key = pd.Series(np.asarray(parts[0], dtype=object), dtype=object)
+    for part in parts[1:]:
+        key = key + "|" + pd.Series(np.asarray(part, dtype=object), dtype=object)
+    return pd.factorize(key)[0]
+
+
+def _components(n: int, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """Connected-component label of every row for the undirected edges src - dst."""
+
+    graph = coo_matrix((np.ones(len(src), dtype=np.int8), (src, dst)), shape=(n, n))
+    return connected_components(graph, directed=False)[1]
+
+
+def _drop_ambiguous_links(src: np.ndarray, dst: np.ndarray, registration: np.ndarray, stats: dict):
+    """
+    Keeps every component to a single registration number.
+
+    Rows without a registration number are grouped into islands (the rows they
+    are linked to by name). An island linked to exactly one registration number
+    joins that company; one linked to several ("Acme Ltd" next to "Acme Limited"
+    A1 and "Acme" A2) would bridge two registered companies, so its links to
+    registered rows are dropped and it stays an entity of its own.
+    """
+
+    registered = registration != ""
+    unregistered = ~registered[src] & ~registered[dst]
+    island = _components(len(registration), src[unregistered], dst[unregistered])
+
+    mixed = registered[src] != registered[dst]
+    loose = np.where(registered[src], dst, src)[mixed]
+    anchor = np.where(registered[src], src, dst)[mixed]
+
+    companies = pd.Series(registration[anchor]).groupby(island[loose]).nunique()
+    ambiguous = companies.index[companies > 1].to_numpy()
+    stats["ambiguous"] = len(ambiguous)
+
+    keep = np.ones(len(src), dtype=bool)
+    keep[np.flatnonzero(mixed)[np.isin(island[loose], ambiguous)]] = False
+    return src[keep], dst[keep]
+
+
+def _bucket_pairs(keys: pd.DataFrame, stats: dict) -> np.ndarray:
+    """Index pairs (i < j) of rows sharing all columns of `keys`."""
+
+    bucket = keys.groupby(list(keys.columns), sort=False).ngroup().to_numpy()
+    order = np.argsort(bucket, kind="stable")
+    sizes = np.bincount(bucket)
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+
+    pairs = []
+    for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+        if size > MAX_BLOCK_SIZE:
+            stats["oversized_blocks"] += 1
+            continue
+        members = order[start:start + size]
+        i, j = np.triu_indices(size, 1)
+        pairs.append(np.column_stack([members[i], members[j]]))
+
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+
+    pairs = np.concatenate(pairs)
+    return np.sort(pairs, axis=1)
+
+
+# ------------------------------------------------------
+# Resolution
+# ------------------------------------------------------
+def resolve_entities(df: pd.DataFrame, similarity: float = NAME_SIMILARITY) -> pd.DataFrame:
+    """
+    Adds `entity_id`: merchants judged to be the same business share one id
+    (the smallest merchant_id of the cluster).
+
+    Candidates are only compared inside blocks, never all pairs:
+      - same country and same registration number -> same entity
+      - same country and same normalised name -> same entity
+      - same country and a shared MinHash LSH bucket of name shingles ->
+        same entity when the shingle Jaccard similarity >= `similarity`
+    Name matches are rejected when both merchants carry different
+    registration numbers, and an unregistered merchant whose name matches
+    several registered companies is not used to join them. Matches are joined
+    transitively (connected components), so the cost grows with the number of
+    rows, not its square.
+    """
+
+    started = time.perf_counter()
+    stats = {"registration_links": 0, "name_links": 0, "fuzzy_links": 0, "rejected": 0, "ambiguous": 0,
+             "oversized_blocks": 0}
+
+    n = len(df)
+    country = df["country"].astype(str).str.strip().str.lower().to_numpy()
+    registration = np.array([normalize_registration(v) for v in df["registration_number"]], dtype=object)
+    name = np.array([normalize_name(v) for v in df["name"]], dtype=object)
+
+    resolved = df.copy()
+    if not (registration != "").any() and not (name != "").any():
+        # nothing to match on (no rows, or no usable name / registration): every merchant_id stands alone
+        resolved["entity_id"] = df["merchant_id"].astype(str)
+        logger.info(f"Resolved {n} merchants into {resolved['entity_id'].nunique()} entities "
+                    f"(no names or registration numbers to match on)")
+        return resolved
+
+    country_code = pd.factorize(country)[0]
+    src, dst = [], []
+
+    # 1. exact registration number within a country
+    positions = np.flatnonzero(registration != "")
+    reg_code = _block_keys(country[positions], registration[positions])
+    s, d = _star_edges(reg_code, positions)
+    src.append(s)
+    dst.append(d)
+    stats["registration_links"] = len(s)
+
+    def compatible(a, b):
+        # a name match never merges two different registered companies
+        ra, rb = registration[a], registration[b]
+        ok = (ra == "") | (rb == "") | (ra == rb)
+        stats["rejected"] += int((~ok).sum())
+        return a[ok], b[ok]
+
+    # 2. identical normalised name within a country
+    positions = np.flatnonzero(name != "")
+    name_key = _block_keys(country_code[positions].astype(str), name[positions])
+    s, d = compatible(*_star_edges(name_key, positions))
+    src.append(s)
+    dst.append(d)
+    stats["name_links"] = len(s)
+
+    # 3. similar names: LSH buckets over one representative row per (country, name)
+    representative = positions[np.unique(name_key, return_index=True)[1]]
+
+    if len(representative) > 1:
+        unique_names, name_index = pd.factorize(name[representative])
+        signatures = minhash_signatures(list(name_index))[unique_names]
+
+        rows_per_band = NUM_PERM // BANDS
+        candidates = []
+        for band in range(BANDS):
+            keys = pd.DataFrame(signatures[:, band * rows_per_band:(band + 1) * rows_per_band])
+            keys.columns = [f"h{i}" for i in range(rows_per_band)]
+            keys["country"] = country_code[representative]
+            candidates.append(_bucket_pairs(keys, stats))
+
+        candidates = np.unique(np.concatenate(candidates), axis=0)
+
+        if len(candidates):
+            cache = {}
+
+            def shingle_set(text):
+                if text not in cache:
+                    cache[text] = shingles(text)
+                return cache[text]
+
+            a = representative[candidates[:, 0]]
+            b = representative[candidates[:, 1]]
+            similar = np.fromiter(
+                (jaccard(shingle_set(name[i]), shingle_set(name[j])) >= similarity for i, j in zip(a, b)),
+                dtype=bool,
+                count=len(a)
+            )
+            s, d = compatible(a[similar], b[similar])
+            src.append(s)
+            dst.append(d)
+            stats["fuzzy_links"] = len(s)
+
+    src, dst = _drop_ambiguous_links(np.concatenate(src), np.concatenate(dst), registration, stats)
+    labels = _components(n, src, dst)
+
+    # codes of the sorted unique ids, so the smallest code is the smallest merchant_id
+    codes, ids = pd.factorize(df["merchant_id"].astype(str), sort=True)
+    resolved["entity_id"] = np.asarray(ids)[pd.Series(codes).groupby(labels).transform("min").to_numpy()]
+
+    entities = resolved["entity_id"].nunique()
+    logger.info(f"Resolved {n} merchants into {entities} entities in {time.perf_counter() - started:.2f}s "
+                f"({stats['registration_links']} registration, {stats['name_links']} exact-name, "
+                f"{stats['fuzzy_links']} similar-name links; {stats['rejected']} rejected on registration; "
+                f"{stats['ambiguous']} unregistered groups matching several registrations kept apart; "
+                f"{stats['oversized_blocks']} oversized blocks skipped)")
+
+    return resolved
+
+
+def entity_clusters(resolved: pd.DataFrame) -> pd.DataFrame:
+    """Members of every entity with more than one merchant_id, largest clusters first."""
+
+    sizes = resolved.groupby("entity_id")["merchant_id"].transform("size")
+    clusters = resolved.loc[sizes > 1, ["entity_id", "merchant_id", "name", "country", "registration_number"]]
+    clusters = clusters.assign(cluster_size=sizes[sizes > 1])
+    return clusters.sort_values(["cluster_size", "entity_id", "merchant_id"], ascending=[False, True, True])
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Cluster merchant_ids that belong to the same business")
+    parser.add_argument("--input", default="data/merchants.csv")
+    parser.add_argument("--output", default=CLUSTERS_FILE)
+    parser.add_argument("--similarity", type=float, default=NAME_SIMILARITY)
+
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input, dtype={"registration_number": str})
+    clusters = entity_clusters(resolve_entities(df, args.similarity))
+    clusters.to_csv(args.output, index=False)
+    print(f"{clusters['entity_id'].nunique()} multi-id entities saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python -m ingestion.entity_resolution --input data/merchants.csv --output output/entity_clusters.csv
@@ -2,6 +2,8 @@ import requests
 from urllib.parse import quote
 from time import sleep
 
+from common.instrumentation import span
+
 BASE_URL = "https://restcountries.com/v3.1/name"
 TIMEOUT = 5
 RETRIES = 3
@@ -10,11 +12,12 @@ RETRIES = 3
 _country_cache = {}
 
 
-def get_country_details(country_name: str):
+def get_country_details(country_name: str, session=None):
     """
     Fetch region & subregion from REST Countries API
     Uses caching to prevent repeated API calls
     Returns dict or None
+    A shared requests.Session reuses pooled connections across calls
     """
 
     if not isinstance(country_name, str) or not country_name.strip():
@@ -27,10 +30,12 @@ def get_country_details(country_name: str):
         return _country_cache[country_name]
 
     url = f"{BASE_URL}/{quote(country_name)}"
+    http = session or requests
 
     for attempt in range(RETRIES):
         try:
-            response = requests.get(url, timeout=TIMEOUT)
+            with span("restcountries.name"):
+                response = http.get(url, timeout=TIMEOUT)
 
             if response.status_code == 404:
                 _country_cache[country_name] = None
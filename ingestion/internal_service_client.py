@@ -1,22 +1,27 @@
 import requests
 from time import sleep
 
+from common.instrumentation import span
+
 BASE_URL = "http://127.0.0.1:8000"
 TIMEOUT = 3
 RETRIES = 3
 
 
-def get_internal_risk(merchant_id: str):
+def get_internal_risk(merchant_id: str, session=None):
     """
     Fetch merchant internal risk data from simulated internal API
     Returns JSON dict or None if failed
+    A shared requests.Session reuses pooled connections across calls
     """
 
     url = f"{BASE_URL}/merchant/{merchant_id}"
+    http = session or requests
 
     for attempt in range(RETRIES):
         try:
-            response = requests.get(url, timeout=TIMEOUT)
+            with span("internal_api.merchant"):
+                response = http.get(url, timeout=TIMEOUT)
 
             if response.status_code == 404:
                 return None
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+from common.instrumentation import span
+
+
+USER_AGENT = "MLE-Assignment-Bot/1.0 (Educational Project; Respectful Scraping)"
+HEADERS = {"User-Agent": USER_AGENT}
+
+TIMEOUT = 10
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_PAGES = 25
+DEFAULT_MAX_DEPTH = 2
+
+# minimum gap between two requests to the same host (robots.txt Crawl-delay wins if larger)
+HOST_DELAY_SECONDS = 1.0
+
+# cached pages younger than this are reused without a request
+CACHE_TTL_SECONDS = 6 * 3600
+
+# pages worth crawling first; everything else on the site comes after
+PRIORITY_KEYWORDS = ["partner", "pricing", "price", "fees", "legal", "terms", "privacy", "merchant"]
+
+TRACKING_PARAMS = ("utm_", "gclid", "fbclid")
+
+
+# ------------------------------------------------------
+# URL normalisation
+# ------------------------------------------------------
+def normalize_url(url: str, base: str = None):
+    """
+    Canonical form used for dedup: absolute, no fragment, lower-case
+    scheme/host, no default port, sorted query without tracking params,
+    no trailing slash (except the root). Returns None for non-http links.
+    """
+
+    if base:
+        url = urljoin(base, url)
+
+    parts = urlsplit(url.strip())
+    if parts.scheme not in ("http", "https"):
+        return None
+
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not (parts.scheme == "http" and port == 80 or parts.scheme == "https" and port == 443):
+        host = f"{host}:{port}"
+
+    path = parts.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAMS)
+    ))
+
+    return urlunsplit((parts.scheme, host, path, query, ""))
+
+
+def url_priority(url: str) -> int:
+    path = urlsplit(url).path.lower()
+    return 0 if any(k in path for k in PRIORITY_KEYWORDS) else 1
+
+
+# ------------------------------------------------------
+# Cache (ETag / Last-Modified per URL)
+# ------------------------------------------------------
+def read_cache(cache_path: str) -> dict:
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_cache(cache_path: str, cache: dict):
+    if not cache_path:
+        return
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, cache_path)
+
+
+def validators(entry: dict) -> dict:
+    """If-None-Match / If-Modified-Since headers for a cached entry."""
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def fetch_conditional(url: str, extract, entry: dict = None, session=None, timeout: float = TIMEOUT):
+    """
+    Conditional GET of `url`. Returns the updated cache entry with
+    "status": 304 when the cached copy is still valid; otherwise the body
+    is hashed and handed to extract(chunks, encoding) -> (data, links)
+    while it streams in.
+    """
+
+    entry = dict(entry or {})
+    http = session or requests
+
+    with span("crawler.fetch"):
+        response = http.get(url, headers={**HEADERS, **validators(entry)}, timeout=timeout, stream=True)
+
+    with response:
+        entry["fetched_at"] = time.time()
+
+        if response.status_code == 304:
+            entry["status"] = 304
+            return entry
+
+        response.raise_for_status()
+
+        # requests falls back to ISO-8859-1 without a declared charset; pages are utf-8 in practice
+        declared = "charset" in response.headers.get("Content-Type", "").lower()
+        encoding = response.encoding if declared else "utf-8"
+
+        digest = hashlib.sha256()
+
+        def hashed_chunks():
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                digest.update(chunk)
+                yield chunk
+
+        data, links = extract(hashed_chunks(), encoding)
+
+    entry.update(
+        status=response.status_code,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        content_hash=digest.hexdigest(),
+        data=data,
+        links=links
+    )
+    return entry
+
+
+# ------------------------------------------------------
+# Crawler
+# ------------------------------------------------------
+class _HostGate:
+    """Spaces requests to one host by `delay` seconds without blocking the event loop."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.lock = asyncio.Lock()
+        self.next_slot = 0.0
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_slot > now:
+                await asyncio.sleep(self.next_slot - now)
+            self.next_slot = max(now, self.next_slot) + self.delay
+
+
+class SiteCrawler:
+    """
+    Bounded asyncio crawler for one site.
+
+    A priority frontier (priority pages first, then breadth-first) feeds
+    `concurrency` workers. Blocking HTTP runs in threads via
+    asyncio.to_thread, robots.txt is honoured, and each host gets its own
+    politeness gate so waiting on one host never stalls the others.
+    URLs are deduplicated after normalisation and pages by content hash.
+    With a cache, pages inside the TTL are reused without a request and
+    older ones are revalidated; only changed pages are downloaded and parsed.
+    """
+
+    def __init__(
+        self,
+        start_url: str,
+        extract,
+        max_pages: int = DEFAULT_MAX_PAGES,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        host_delay: float = HOST_DELAY_SECONDS,
+        cache: dict = None,
+        ttl: float = CACHE_TTL_SECONDS,
+        log=print
+    ):
+        self.start_url = normalize_url(start_url)
+        self.host = urlsplit(self.start_url).netloc
+        self.extract = extract
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.host_delay = host_delay
+        self.cache = cache if cache is not None else {}
+        self.ttl = ttl
+        self.log = log
+
+        self.session = requests.Session()
+        self.seen_urls = set()
+        self.seen_hashes = {}
+        self.pages = {}
+        self.stats = {"fetched": 0, "not_modified": 0, "cached": 0, "duplicates": 0, "disallowed": 0, "failed": 0}
+
+        self._robots = {}
+        self._gates = {}
+        self._sequence = 0
+
+    # --------------------------------------------------
+    # Politeness
+    # --------------------------------------------------
+    def _fetch_robots(self, host_url: str) -> RobotFileParser:
+        parser = RobotFileParser(urljoin(host_url, "/robots.txt"))
+        try:
+            response = self.session.get(parser.url, headers=HEADERS, timeout=TIMEOUT)
+        except requests.RequestException:
+            parser.allow_all = True
+            return parser
+
+        if response.status_code >= 500:
+            parser.disallow_all = True
+        elif response.status_code >= 400:
+            parser.allow_all = True
+        else:
+            parser.parse(response.text.splitlines())
+        return parser
+
+    async def _robots_for(self, url: str) -> RobotFileParser:
+        parts = urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        if key not in self._robots:
+            # set before awaiting so concurrent workers share one fetch
+            self._robots[key] = asyncio.ensure_future(asyncio.to_thread(self._fetch_robots, key))
+        return await self._robots[key]
+
+    async def _gate_for(self, url: str) -> _HostGate:
+        netloc = urlsplit(url).netloc
+        if netloc not in self._gates:
+            robots = await self._robots_for(url)
+            delay = max(self.host_delay, robots.crawl_delay(USER_AGENT) or 0)
+            self._gates.setdefault(netloc, _HostGate(delay))
+        return self._gates[netloc]
+
+    # --------------------------------------------------
+    # Frontier
+    # --------------------------------------------------
+    def _schedule(self, queue, url: str, depth: int):
+        if url is None or url in self.seen_urls:
+            return
+        if urlsplit(url).netloc != self.host or depth > self.max_depth:
+            return
+        if len(self.seen_urls) >= self.max_pages:
+            return
+
+        self.seen_urls.add(url)
+        self._sequence += 1
+        priority = -1 if depth == 0 else url_priority(url)
+        queue.put_nowait((priority, depth, self._sequence, url))
+
+    async def _visit(self, queue, url: str, depth: int):
+        entry = self.cache.get(url, {})
+
+        if entry.get("data") is not None and time.time() - entry.get("fetched_at", 0) < self.ttl:
+            self.stats["cached"] += 1
+        else:
+            robots = await self._robots_for(url)
+            if not robots.can_fetch(USER_AGENT, url):
+                self.stats["disallowed"] += 1
+                return
+
+            await (await self._gate_for(url)).wait()
+
+            try:
+                entry = await asyncio.to_thread(fetch_conditional, url, self.extract, entry, self.session)
+            except Exception as e:
+                self.stats["failed"] += 1
+                self.log(f"Failed {url}: {e}")
+                if entry.get("data") is None:
+                    self.cache.pop(url, None)
+                    return
+                # keep serving the last good copy
+            else:
+                self.stats["not_modified" if entry.get("status") == 304 else "fetched"] += 1
+                self.cache[url] = entry
+
+        # the same content under another URL is only counted once
+        content_hash = entry.get("content_hash")
+        if content_hash is not None:
+            first_url = self.seen_hashes.setdefault(content_hash, url)
+            if first_url != url:
+                self.stats["duplicates"] += 1
+                return
+
+        self.pages[url] = entry
+        for link in entry.get("links", []):
+            self._schedule(queue, normalize_url(link, url), depth + 1)
+
+    async def _worker(self, queue):
+        while True:
+            _, depth, _, url = await queue.get()
+            try:
+                await self._visit(queue, url, depth)
+            finally:
+                queue.task_done()
+
+    async def run(self) -> dict:
+        queue = asyncio.PriorityQueue()
+        self._schedule(queue, self.start_url, 0)
+
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.session.close()
+
+        return self.pages
+
+
+def crawl_site(start_url: str, extract, cache_path: str = None, **options):
+    """
+    Crawl a site and return (pages, stats). `pages` maps normalised URL to
+    its cache entry (data, links, content_hash, ...). The cache file is
+    rewritten with every page seen, so the next crawl only re-downloads
+    pages that changed.
+    """
+
+    cache = read_cache(cache_path)
+    crawler = SiteCrawler(start_url, extract, cache=cache, **options)
+
+    pages = asyncio.run(crawler.run())
+
+    # pages no longer reachable from the start URL drop out of the cache
+    write_cache(cache_path, {url: entry for url, entry in crawler.cache.items() if url in crawler.seen_urls})
+    return pages, crawler.stats
@@ -0,0 +1,194 @@
+import os
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from model.train_risk_model import load_model, predict_risk
+from model.explain import DEFAULT_TOP_K
+from model.portfolio_aggregation import PortfolioAccumulator, REQUIRED_COLUMNS
+
+
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# chunks in flight per worker; bounds memory to roughly
+# workers * PENDING_PER_WORKER * chunksize rows
+PENDING_PER_WORKER = 2
+
+
+# ------------------------------------------------------
+# Chunked readers / writers (CSV or Parquet)
+# ------------------------------------------------------
+def _is_parquet(path: str) -> bool:
+    return path.lower().endswith((".parquet", ".pq"))
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        return pa, pq
+    except ImportError:
+        raise RuntimeError("pyarrow package not installed (required for Parquet input/output)")
+
+
+def iter_chunks(path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+
+    if _is_parquet(path):
+        _, pq = _require_pyarrow()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+class ChunkWriter:
+    """Appends scored chunks to a CSV or Parquet file in arrival order."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self._schema = None
+        self._parquet_writer = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def write(self, chunk: pd.DataFrame):
+
+        if _is_parquet(self.path):
+            pa, pq = _require_pyarrow()
+
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self._parquet_writer is None:
+                # the first chunk fixes the file schema; a column that is all
+                # null there has no type yet, so it is pinned to string
+                self._schema = pa.schema(
+                    [f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema],
+                    metadata=table.schema.metadata
+                )
+                self._parquet_writer = pq.ParquetWriter(self.path, self._schema)
+
+            # later chunks may infer other dtypes (int -> float once a NaN appears)
+            self._parquet_writer.write_table(table.cast(self._schema))
+        else:
+            chunk.to_csv(self.path, mode="a", header=self.rows == 0, index=False)
+
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+# ------------------------------------------------------
+# Worker process
+# ------------------------------------------------------
+_worker_model = None
+_worker_explain_top_k = 0
+
+
+def _init_worker(model_path, explain_top_k):
+    # loaded once per worker; registry models are memory-mapped so the
+    # workers share the coefficient pages instead of each holding a copy
+    global _worker_model, _worker_explain_top_k
+    _worker_model = load_model(model_path)
+    _worker_explain_top_k = explain_top_k
+
+
+def _score_chunk(chunk: pd.DataFrame):
+    scored = predict_risk(_worker_model, chunk, copy=False, explain_top_k=_worker_explain_top_k)
+
+    # partial portfolio rollups travel back with the chunk and are merged in the parent
+    if set(REQUIRED_COLUMNS) <= set(scored.columns):
+        return scored, PortfolioAccumulator().update(scored)
+
+    return scored, None
+
+
+# ------------------------------------------------------
+# Batch scoring entry point
+# ------------------------------------------------------
+def score_file(
+    features_path: str,
+    output_path: str,
+    model_path: str = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    n_workers: int = DEFAULT_WORKERS,
+    explain_top_k: int = DEFAULT_TOP_K,
+    segments_path: str = None
+) -> int:
+
+    print(f"Batch scoring {features_path} -> {output_path} ({n_workers} workers, chunks of {chunksize})")
+
+    start = time.perf_counter()
+    writer = ChunkWriter(output_path)
+    portfolio = PortfolioAccumulator()
+    max_pending = max(1, n_workers * PENDING_PER_WORKER)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(model_path, explain_top_k)
+        ) as executor:
+
+            # futures are drained from the left, so output keeps input order
+            pending = deque()
+
+            def drain_one():
+                scored, partial = pending.popleft().result()
+                writer.write(scored)
+                if partial is not None:
+                    portfolio.merge(partial)
+
+            for chunk in iter_chunks(features_path, chunksize):
+                pending.append(executor.submit(_score_chunk, chunk))
+
+                if len(pending) >= max_pending:
+                    drain_one()
+
+            while pending:
+                drain_one()
+    finally:
+        writer.close()
+
+    if segments_path and portfolio.totals["merchants"]:
+        portfolio.segment_metrics().to_csv(segments_path, index=False)
+        print(f"Portfolio segment rollups saved {segments_path}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {writer.rows} rows in {elapsed:.2f}s ({writer.rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    if portfolio.totals["merchants"]:
+        print(f"Portfolio metrics: {portfolio.metrics()}")
+
+    return writer.rows
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Chunked multi-process batch scoring")
+    parser.add_argument("--input", required=True, help="Features file (.csv or .parquet)")
+    parser.add_argument("--output", required=True, help="Predictions file (.csv or .parquet)")
+    parser.add_argument("--model", default=None, help="Model file (default: promoted registry version)")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--explain", type=int, default=DEFAULT_TOP_K, help="Top-k risk drivers per merchant (0 = off)")
+    parser.add_argument("--segments", default=None, help="Write per-segment portfolio rollups to this CSV")
+
+    args = parser.parse_args()
+
+    score_file(args.input, args.output, args.model, args.chunksize, args.workers, args.explain, args.segments)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python -m model.batch_scoring --input output/underwriting_features.csv --output output/merchant_predictions.csv
+# python -m model.batch_scoring --input features.parquet --output predictions.parquet --workers 8
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_TOP_K = 3
+
+
+# ------------------------------------------------------
+# Map transformed columns back to input features
+# ------------------------------------------------------
+def feature_groups(model):
+    """
+    Returns (group_names, column_group) where column_group[j] is the index
+    of the input feature that produced column j of the preprocessed matrix
+    (all one-hot columns of a categorical feature share one group).
+    """
+
+    preprocessor = model.named_steps["preprocess"]
+
+    group_names = []
+    column_group = []
+
+    for name, transformer, columns in preprocessor.transformers_:
+        if name == "remainder" or transformer == "drop":
+            continue
+
+        for i, col in enumerate(columns):
+            group_names.append(col)
+
+            # one output column per category for encoders, one per feature otherwise
+            width = len(transformer.categories_[i]) if hasattr(transformer, "categories_") else 1
+            column_group.extend([len(group_names) - 1] * width)
+
+    return group_names, np.asarray(column_group)
+
+
+# ------------------------------------------------------
+# Additive contributions (logit space)
+# ------------------------------------------------------
+def contribution_matrix(model, X_transformed) -> tuple:
+    """
+    Per-merchant contribution of every input feature to the logit:
+    scaled value x coefficient, summed over one-hot columns.
+    Computed as one (n x columns) @ (columns x groups) product.
+    """
+
+    coef = model.named_steps["clf"].coef_[0]
+    group_names, column_group = feature_groups(model)
+
+    weights = np.zeros((len(coef), len(group_names)))
+    weights[np.arange(len(coef)), column_group] = coef
+
+    contributions = np.asarray(X_transformed @ weights)
+
+    return group_names, contributions
+
+
+def top_drivers(group_names, contributions: np.ndarray, top_k: int = DEFAULT_TOP_K) -> pd.DataFrame:
+    """Top-k features pushing each merchant towards high risk."""
+
+    top_k = min(top_k, contributions.shape[1])
+    remaining = contributions.copy()
+    rows = np.arange(len(remaining))
+
+    drivers = {}
+    for k in range(top_k):
+        # k argmax passes over a handful of groups beat a full row-wise sort
+        best = remaining.argmax(axis=1)
+
+        drivers[f"risk_driver_{k + 1}"] = pd.Categorical.from_codes(best, categories=group_names)
+        drivers[f"risk_driver_{k + 1}_contribution"] = remaining[rows, best]
+
+        remaining[rows, best] = -np.inf
+
+    return pd.DataFrame(drivers)
+
+
+def explain_risk(model, X_transformed, top_k: int = DEFAULT_TOP_K) -> pd.DataFrame:
+    group_names, contributions = contribution_matrix(model, X_transformed)
+    return top_drivers(group_names, contributions, top_k)
@@ -0,0 +1,258 @@
+import numpy as np
+import pandas as pd
+
+from sklearn.preprocessing import OneHotEncoder, StandardScaler, FunctionTransformer
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.linear_model import SGDClassifier
+
+from model.train_risk_model import (
+    MODEL_PATH,
+    CATEGORICAL_FEATURES,
+    NUMERIC_FEATURES,
+    TARGET_QUANTILE,
+    print_feature_importance,
+    build_manifest,
+    save_model
+)
+from model.model_registry import REGISTRY_DIR
+
+
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_EPOCHS = 5
+
+
+# ------------------------------------------------------
+# Mergeable quantile sketch
+# ------------------------------------------------------
+class QuantileSketch:
+    """
+    Compactor-based quantile sketch (KLL style).
+
+    Each level holds at most `k` values; an item on level i stands for 2**i
+    original values. When a level overflows it is sorted and every other
+    item is promoted to the next level, so memory stays O(k log n).
+    Two sketches built on different chunks (or processes) can be merged
+    level by level, which makes the threshold computation shardable.
+    """
+
+    def __init__(self, k: int = 2000, seed: int = 42):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+
+        for level, values in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], values])
+
+        self.count += other.count
+        self._compress()
+        return self
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+
+            if len(values) > self.k:
+                values = np.sort(values)
+
+                # an odd leftover stays on this level so no weight is lost
+                keep = values[len(values) - len(values) % 2:]
+                values = values[:len(values) - len(values) % 2]
+
+                offset = self._rng.integers(2)
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], values[offset::2]])
+
+            level += 1
+
+    def _weighted_items(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)
+        ])
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            raise ValueError("Cannot compute a quantile of an empty sketch")
+
+        values, weights = self._weighted_items()
+        cumulative = np.cumsum(weights)
+        idx = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return float(values[min(idx, len(values) - 1)])
+
+    def fraction_at_least(self, x: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        values, weights = self._weighted_items()
+        return float(weights[values >= x].sum() / weights.sum())
+
+
+# ------------------------------------------------------
+# Chunk reader
+# ------------------------------------------------------
+def iter_feature_chunks(features_path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+
+    columns = CATEGORICAL_FEATURES + NUMERIC_FEATURES
+
+    for chunk in pd.read_csv(features_path, usecols=columns, chunksize=chunksize):
+        yield chunk
+
+
+# ------------------------------------------------------
+# Pass 1: scaler statistics, categories, target threshold
+# ------------------------------------------------------
+def accumulate_statistics(features_path: str, chunksize: int = DEFAULT_CHUNKSIZE):
+
+    scaler = StandardScaler()
+    sketch = QuantileSketch()
+    categories = {col: set() for col in CATEGORICAL_FEATURES}
+    rows = 0
+
+    for chunk in iter_feature_chunks(features_path, chunksize):
+        scaler.partial_fit(chunk[NUMERIC_FEATURES])
+        sketch.update(chunk["dispute_rate"].to_numpy())
+
+        for col in CATEGORICAL_FEATURES:
+            categories[col].update(chunk[col].dropna().unique())
+
+        rows += len(chunk)
+
+    return scaler, sketch, categories, rows
+
+
+def standardize(X, mean, scale):
+    """StandardScaler.transform with fixed statistics (module level so fitted models pickle)."""
+    return (np.asarray(X, dtype=float) - mean) / scale
+
+
+def build_incremental_preprocessor(scaler, categories, sample: pd.DataFrame) -> ColumnTransformer:
+    """
+    ColumnTransformer equivalent to the one used by train_model, but with
+    the one-hot categories and scaler statistics coming from pass 1 rather
+    than from a single in-memory fit.
+
+    Both transformers are fixed up front (explicit categories, the pass-1
+    mean / scale in a FunctionTransformer), so fitting on a sample only
+    records the input columns and changes no statistic.
+    """
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            (
+                "cat",
+                OneHotEncoder(
+                    categories=[sorted(categories[col]) for col in CATEGORICAL_FEATURES],
+                    handle_unknown="ignore"
+                ),
+                CATEGORICAL_FEATURES
+            ),
+            (
+                "num",
+                FunctionTransformer(
+                    standardize,
+                    kw_args={"mean": scaler.mean_, "scale": scaler.scale_},
+                    feature_names_out="one-to-one"
+                ),
+                NUMERIC_FEATURES
+            ),
+        ]
+    )
+
+    return preprocessor.fit(sample[CATEGORICAL_FEATURES + NUMERIC_FEATURES])
+
+
+# ------------------------------------------------------
+# Main out-of-core training function
+# ------------------------------------------------------
+def train_model_incremental(
+    features_path: str,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    epochs: int = DEFAULT_EPOCHS,
+    model_path: str = MODEL_PATH,
+    registry_dir: str = REGISTRY_DIR
+):
+
+    print(f"\nStreaming feature dataset in chunks of {chunksize} rows...")
+
+    scaler, sketch, categories, rows = accumulate_statistics(features_path, chunksize)
+
+    if rows == 0:
+        raise ValueError(f"No rows found in {features_path}")
+
+    # same target definition as prepare_target: top 20% dispute rate
+    threshold = sketch.quantile(TARGET_QUANTILE)
+    positive_rate = sketch.fraction_at_least(threshold)
+
+    print(f"Rows streamed: {rows}")
+    print(f"High risk threshold (dispute_rate, sketch): {threshold:.5f}")
+    print(f"Estimated positive rate: {positive_rate:.3f}")
+
+    # "balanced" class weights from the sketch estimate (partial_fit cannot
+    # compute them itself because it never sees the whole target)
+    positive_rate = min(max(positive_rate, 1e-6), 1 - 1e-6)
+    class_weights = {0: 0.5 / (1 - positive_rate), 1: 0.5 / positive_rate}
+
+    clf = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=42)
+    preprocessor = None
+    rng = np.random.default_rng(42)
+
+    print("Training model with partial_fit...")
+    for epoch in range(epochs):
+        for chunk in iter_feature_chunks(features_path, chunksize):
+            chunk = chunk.iloc[rng.permutation(len(chunk))]
+
+            if preprocessor is None:
+                preprocessor = build_incremental_preprocessor(scaler, categories, chunk)
+
+            X = preprocessor.transform(chunk[CATEGORICAL_FEATURES + NUMERIC_FEATURES])
+            y = (chunk["dispute_rate"].to_numpy() >= threshold).astype(int)
+            sample_weight = np.where(y == 1, class_weights[1], class_weights[0])
+
+            clf.partial_fit(X, y, classes=[0, 1], sample_weight=sample_weight)
+
+        print(f"  epoch {epoch + 1}/{epochs} complete")
+
+    # same step names as train_model so load_model / predict_risk work unchanged
+    model = Pipeline(
+        steps=[
+            ("preprocess", preprocessor),
+            ("clf", clf)
+        ]
+    )
+
+    print_feature_importance(model, CATEGORICAL_FEATURES, NUMERIC_FEATURES)
+
+    manifest = build_manifest(
+        features_path,
+        training_mode="incremental",
+        params=clf.get_params(),
+        metrics={
+            "rows": rows,
+            "epochs": epochs,
+            "estimated_positive_rate": round(positive_rate, 4),
+            "target_dispute_rate_threshold": threshold
+        }
+    )
+    save_model(model, manifest, model_path=model_path, registry_dir=registry_dir)
+
+    return model
@@ -0,0 +1,246 @@
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import joblib
+
+
+REGISTRY_DIR = "models/registry"
+CURRENT_FILE = "CURRENT.json"
+MANIFEST_FILE = "manifest.json"
+
+# stored uncompressed so joblib can memory-map the numpy arrays on load
+ARTIFACT_FILE = "model.joblib"
+
+VERSION_PATTERN = re.compile(r"^v(\d+)$")
+
+
+# ------------------------------------------------------
+# Helpers
+# ------------------------------------------------------
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path: str, payload: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _version_dir(version: str, registry_dir: str = REGISTRY_DIR) -> str:
+    return os.path.join(registry_dir, version)
+
+
+# ------------------------------------------------------
+# Registry state
+# ------------------------------------------------------
+def list_versions(registry_dir: str = REGISTRY_DIR) -> list:
+    if not os.path.isdir(registry_dir):
+        return []
+
+    return sorted(
+        name for name in os.listdir(registry_dir)
+        if os.path.exists(os.path.join(registry_dir, name, MANIFEST_FILE))
+    )
+
+
+def read_state(registry_dir: str = REGISTRY_DIR) -> dict:
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return {"current": None, "history": []}
+    return _read_json(path)
+
+
+def current_version(registry_dir: str = REGISTRY_DIR):
+    return read_state(registry_dir)["current"]
+
+
+def read_manifest(version: str, registry_dir: str = REGISTRY_DIR) -> dict:
+    return _read_json(os.path.join(_version_dir(version, registry_dir), MANIFEST_FILE))
+
+
+def write_manifest(version: str, manifest: dict, registry_dir: str = REGISTRY_DIR):
+    _write_json_atomic(os.path.join(_version_dir(version, registry_dir), MANIFEST_FILE), manifest)
+
+
+# ------------------------------------------------------
+# Register / promote / rollback
+# ------------------------------------------------------
+def register_model(model, manifest: dict, registry_dir: str = REGISTRY_DIR) -> str:
+
+    # numeric maximum: "v10000" sorts before "v9999", and other folders are ignored
+    numbers = [int(match.group(1)) for match in map(VERSION_PATTERN.match, list_versions(registry_dir)) if match]
+    next_number = max(numbers) + 1 if numbers else 1
+    version = f"v{next_number:04d}"
+
+    version_dir = _version_dir(version, registry_dir)
+    os.makedirs(version_dir, exist_ok=True)
+
+    joblib.dump(model, os.path.join(version_dir, ARTIFACT_FILE))
+
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        **manifest
+    }
+    write_manifest(version, manifest, registry_dir)
+
+    print(f"Model registered as {version} in {registry_dir}")
+    return version
+
+
+def promote(version: str, registry_dir: str = REGISTRY_DIR):
+
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"Unknown model version: {version}")
+
+    state = read_state(registry_dir)
+
+    if state["current"] == version:
+        print(f"{version} is already the promoted model")
+        return
+
+    if state["current"]:
+        state["history"].append(state["current"])
+    state["current"] = version
+
+    _write_json_atomic(os.path.join(registry_dir, CURRENT_FILE), state)
+    print(f"Promoted {version}")
+
+
+def rollback(registry_dir: str = REGISTRY_DIR) -> str:
+
+    state = read_state(registry_dir)
+
+    if not state["history"]:
+        raise ValueError("No previous model version to roll back to")
+
+    previous = state["history"].pop()
+    print(f"Rolling back {state['current']} -> {previous}")
+    state["current"] = previous
+
+    _write_json_atomic(os.path.join(registry_dir, CURRENT_FILE), state)
+    return previous
+
+
+# ------------------------------------------------------
+# Loading
+# ------------------------------------------------------
+def load_version(version: str = None, registry_dir: str = REGISTRY_DIR, mmap_mode: str = "r"):
+    """
+    Load a registered model. With mmap_mode the coefficient/scaler arrays
+    are memory-mapped from disk instead of copied onto the heap, so several
+    scorer processes (or an old and a new version during hot reload) share
+    the same pages.
+    """
+
+    version = version or current_version(registry_dir)
+    if version is None:
+        raise FileNotFoundError(f"No promoted model in {registry_dir}")
+
+    model = joblib.load(os.path.join(_version_dir(version, registry_dir), ARTIFACT_FILE), mmap_mode=mmap_mode)
+    model.metadata_ = read_manifest(version, registry_dir)
+
+    return model
+
+
+class ModelHandle:
+    """
+    Hot-reloading reference to the promoted model for long-running scorers.
+
+    get() re-reads the registry pointer at most every `check_interval`
+    seconds and swaps in the newly promoted version when it changes.
+    Callers holding the previous model keep using it until they call get()
+    again; its memory-mapped arrays are released once nothing references it.
+    """
+
+    def __init__(self, registry_dir: str = REGISTRY_DIR, check_interval: float = 5.0):
+        self.registry_dir = registry_dir
+        self.check_interval = check_interval
+        self.version = None
+        self._model = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+
+        if self._model is not None and now - self._last_check < self.check_interval:
+            return self._model
+
+        with self._lock:
+            self._last_check = now
+            version = current_version(self.registry_dir)
+
+            if version != self.version:
+                print(f"Loading model version {version}")
+                self._model = load_version(version, self.registry_dir)
+                self.version = version
+
+            return self._model
+
+
+# ------------------------------------------------------
+# CLI
+# ------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(description="Risk model registry")
+    parser.add_argument("--registry", default=REGISTRY_DIR, help="Registry directory")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List registered versions")
+
+    promote_parser = commands.add_parser("promote", help="Promote a version to current")
+    promote_parser.add_argument("version")
+
+    commands.add_parser("rollback", help="Return to the previously promoted version")
+
+    show_parser = commands.add_parser("show", help="Print a version manifest")
+    show_parser.add_argument("version", nargs="?")
+
+    args = parser.parse_args()
+
+    if args.command == "list":
+        current = current_version(args.registry)
+        for version in list_versions(args.registry):
+            manifest = read_manifest(version, args.registry)
+            marker = "*" if version == current else " "
+            print(f"{marker} {version}  {manifest['created_at']}  {manifest.get('metrics', {})}")
+
+    elif args.command == "promote":
+        promote(args.version, args.registry)
+
+    elif args.command == "rollback":
+        rollback(args.registry)
+
+    elif args.command == "show":
+        version = args.version or current_version(args.registry)
+        print(json.dumps(read_manifest(version, args.registry), indent=2))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python -m model.model_registry list
+# python -m model.model_registry promote v0002
+# python -m model.model_registry rollback
+# python -m model.model_registry show
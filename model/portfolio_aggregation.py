@@ -0,0 +1,167 @@
+import pandas as pd
+
+from features.underwriting_features import classify_volume, classify_geo_risk
+
+
+SEGMENT_DIMENSIONS = ["region", "country", "geo_risk", "internal_risk", "volume_tier"]
+
+# scored columns the accumulator needs on top of the segment columns
+REQUIRED_COLUMNS = ["risk_probability", "predicted_high_risk", "monthly_volume", "transaction_count"]
+
+# additive per-merchant quantities; every metric is derived from their sums
+ACCUMULATOR_COLUMNS = [
+    "merchants",
+    "high_risk_merchants",
+    "high_risk_volume",
+    "expected_disputes",
+    "risk_probability_sum",
+    "monthly_volume"
+]
+
+
+# ------------------------------------------------------
+# Segment columns (same rules as the feature view)
+# ------------------------------------------------------
+def with_segment_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Derive geo_risk / volume_tier / internal_risk when the frame lacks them (e.g. portfolio_view)."""
+
+    missing = {}
+
+    if "geo_risk" not in df.columns:
+        region = df["region"] if "region" in df.columns else pd.Series(None, index=df.index)
+        missing["geo_risk"] = classify_geo_risk(region)
+
+    if "volume_tier" not in df.columns:
+        missing["volume_tier"] = classify_volume(df["monthly_volume"])
+
+    if "internal_risk" not in df.columns and "internal_risk_flag" in df.columns:
+        missing["internal_risk"] = df["internal_risk_flag"]
+
+    return df.assign(**missing) if missing else df
+
+
+def segment_labels(values: pd.Series) -> pd.Series:
+    """Segment label per row: the value as text, "unknown" when missing."""
+    return values.astype(object).where(values.notna(), "unknown").astype(str)
+
+
+# ------------------------------------------------------
+# Mergeable accumulator
+# ------------------------------------------------------
+class PortfolioAccumulator:
+    """
+    Portfolio totals plus per-segment rollups, updated chunk by chunk.
+
+    Only sums are stored, so accumulators built on different chunks or
+    shards combine with merge() into the same result as a single pass over
+    the whole portfolio.
+    """
+
+    def __init__(self, dimensions: list = SEGMENT_DIMENSIONS):
+        self.dimensions = list(dimensions)
+        self.totals = pd.Series(0.0, index=ACCUMULATOR_COLUMNS)
+        self.segments = {
+            dim: pd.DataFrame(columns=ACCUMULATOR_COLUMNS, dtype=float) for dim in self.dimensions
+        }
+
+    @staticmethod
+    def _row_values(chunk: pd.DataFrame) -> pd.DataFrame:
+        probability = chunk["risk_probability"].astype(float)
+        high_risk = (chunk["predicted_high_risk"] == 1).astype(float)
+        volume = chunk["monthly_volume"].astype(float)
+
+        return pd.DataFrame({
+            "merchants": 1.0,
+            "high_risk_merchants": high_risk,
+            "high_risk_volume": high_risk * volume,
+            "expected_disputes": probability * chunk["transaction_count"].astype(float),
+            "risk_probability_sum": probability,
+            "monthly_volume": volume
+        }, index=chunk.index)
+
+    def update(self, chunk: pd.DataFrame, sign: float = 1.0) -> "PortfolioAccumulator":
+
+        if len(chunk) == 0:
+            return self
+
+        chunk = with_segment_columns(chunk)
+        values = self._row_values(chunk) * sign
+
+        self.totals = self.totals + values.sum()
+
+        for dim in self.dimensions:
+            if dim not in chunk.columns:
+                continue
+
+            keys = segment_labels(chunk[dim])
+            grouped = values.groupby(keys.to_numpy(), sort=False).sum()
+            self.segments[dim] = self.segments[dim].add(grouped, fill_value=0)
+
+        return self
+
+    def retract(self, chunk: pd.DataFrame) -> "PortfolioAccumulator":
+        """Take rows added earlier back out (e.g. before re-adding updated versions of them)."""
+        return self.update(chunk, sign=-1.0)
+
+    def merge(self, other: "PortfolioAccumulator") -> "PortfolioAccumulator":
+
+        self.totals = self.totals + other.totals
+
+        for dim, frame in other.segments.items():
+            current = self.segments.get(dim, pd.DataFrame(columns=ACCUMULATOR_COLUMNS, dtype=float))
+            self.segments[dim] = current.add(frame, fill_value=0)
+            if dim not in self.dimensions:
+                self.dimensions.append(dim)
+
+        return self
+
+    # --------------------------------------------------
+    # Results
+    # --------------------------------------------------
+    @staticmethod
+    def _derive(sums: pd.DataFrame) -> pd.DataFrame:
+        merchants = sums["merchants"]
+        return pd.DataFrame({
+            "total_merchants": merchants.astype(int),
+            "high_risk_merchants": sums["high_risk_merchants"].astype(int),
+            "high_risk_ratio": (sums["high_risk_merchants"] / merchants.where(merchants > 0)).fillna(0).round(3),
+            "high_risk_volume": sums["high_risk_volume"].round(2),
+            "expected_disputes": sums["expected_disputes"].round(2),
+            "avg_risk_probability": (sums["risk_probability_sum"] / merchants.where(merchants > 0)).round(3),
+            "monthly_volume": sums["monthly_volume"].round(2)
+        })
+
+    def metrics(self) -> dict:
+        """Portfolio-wide metrics (same keys as compute_portfolio_metrics)."""
+
+        derived = self._derive(self.totals.to_frame().T).iloc[0]
+
+        return {
+            "total_merchants": int(derived["total_merchants"]),
+            "high_risk_merchants": int(derived["high_risk_merchants"]),
+            "high_risk_ratio": float(derived["high_risk_ratio"]),
+            "high_risk_volume": float(derived["high_risk_volume"]),
+            "expected_disputes": float(derived["expected_disputes"]),
+            "avg_risk_probability": float(derived["avg_risk_probability"])
+        }
+
+    def segment_metrics(self) -> pd.DataFrame:
+        """Long table: one row per (dimension, segment)."""
+
+        frames = []
+        for dim in self.dimensions:
+            sums = self.segments[dim]
+            # segments whose merchants were all retracted
+            sums = sums[sums["merchants"].round(6) > 0]
+            if sums.empty:
+                continue
+
+            derived = self._derive(sums).sort_index()
+            derived.insert(0, "segment", derived.index.astype(str))
+            derived.insert(0, "dimension", dim)
+            frames.append(derived.reset_index(drop=True))
+
+        if not frames:
+            return pd.DataFrame(columns=["dimension", "segment"])
+
+        return pd.concat(frames, ignore_index=True)
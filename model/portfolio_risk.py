@@ -1,6 +1,9 @@
 from fastapi import logger
+import os
 import pandas as pd
 
+from model.portfolio_aggregation import PortfolioAccumulator, SEGMENT_DIMENSIONS
+
 
 # ------------------------------------------------------
 # Merge predictions with merchant data
@@ -21,32 +24,15 @@ def merge_predictions(final_df: pd.DataFrame, scored_df: pd.DataFrame) -> pd.Dat
 # ------------------------------------------------------
 def compute_portfolio_metrics(merged: pd.DataFrame) -> dict:
 
-    total_merchants = len(merged)
-
-    high_risk = merged[merged["predicted_high_risk"] == 1]
-    low_risk = merged[merged["predicted_high_risk"] == 0]
-
-    high_risk_merchants = len(high_risk)
-    high_risk_ratio = high_risk_merchants / total_merchants if total_merchants else 0
+    # single pass through the same accumulator used by the streaming / sharded paths
+    return PortfolioAccumulator(dimensions=[]).update(merged).metrics()
 
-    # exposure based on volume
-    high_risk_volume = high_risk["monthly_volume"].sum()
 
-    # expected disputes approximation
-    expected_disputes = (merged["risk_probability"] * merged["transaction_count"]).sum()
+def compute_segment_metrics(merged: pd.DataFrame, dimensions: list = SEGMENT_DIMENSIONS):
 
-    avg_risk_probability = merged["risk_probability"].mean()
+    accumulator = PortfolioAccumulator(dimensions).update(merged)
 
-    metrics = {
-        "total_merchants": total_merchants,
-        "high_risk_merchants": high_risk_merchants,
-        "high_risk_ratio": round(high_risk_ratio, 3),
-        "high_risk_volume": round(high_risk_volume, 2),
-        "expected_disputes": round(expected_disputes, 2),
-        "avg_risk_probability": round(avg_risk_probability, 3)
-    }
-
-    return metrics
+    return accumulator.metrics(), accumulator.segment_metrics()
 
 
 # ------------------------------------------------------
@@ -74,12 +60,17 @@ def print_portfolio_summary(metrics: dict, logger):
 # ------------------------------------------------------
 # Full pipeline function
 # ------------------------------------------------------
-def generate_portfolio_risk(final_df: pd.DataFrame, scored_df: pd.DataFrame, logger):
+def generate_portfolio_risk(final_df: pd.DataFrame, scored_df: pd.DataFrame, logger, output_dir: str = None):
 
     merged = merge_predictions(final_df, scored_df)
 
-    metrics = compute_portfolio_metrics(merged)
+    metrics, segments = compute_segment_metrics(merged)
 
     print_portfolio_summary(metrics, logger)
 
+    if output_dir:
+        segments_path = os.path.join(output_dir, "portfolio_segments.csv")
+        segments.to_csv(segments_path, index=False)
+        logger.info(f"Portfolio segment rollups saved {segments_path}")
+
     return metrics, merged
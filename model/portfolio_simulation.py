@@ -0,0 +1,189 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_SCENARIOS = 10_000
+DEFAULT_SEED = 42
+
+# std-dev of the per-scenario region shock, in logit space (0 = independent merchants)
+DEFAULT_SHOCK_SIGMA = 0.5
+
+# block sizes bound memory to SCENARIO_BLOCK x MERCHANT_BLOCK float32 values per worker
+SCENARIO_BLOCK = 250
+MERCHANT_BLOCK = 20_000
+
+CONFIDENCE_LEVELS = (0.95, 0.99)
+
+
+# ------------------------------------------------------
+# Worker state (set once per process)
+# ------------------------------------------------------
+_state = {}
+
+
+def _init_worker(logits, volumes, region_codes, n_regions, shock_sigma):
+    _state.update(
+        logits=logits,
+        volumes=volumes,
+        region_codes=region_codes,
+        n_regions=n_regions,
+        shock_sigma=shock_sigma
+    )
+
+
+def _simulate_block(n_scenarios: int, seed_sequence) -> np.ndarray:
+    """
+    Disputed volume for a block of scenarios.
+
+    Every scenario draws one shock per region; each merchant then disputes
+    with probability sigmoid(logit(p) + shock[region]). Merchants are
+    processed in blocks so only a scenarios x block matrix is ever held.
+    """
+
+    rng = np.random.default_rng(seed_sequence)
+
+    logits = _state["logits"]
+    volumes = _state["volumes"]
+    region_codes = _state["region_codes"]
+    shock_sigma = _state["shock_sigma"]
+
+    shocks = rng.normal(0.0, shock_sigma, (n_scenarios, _state["n_regions"])).astype(np.float32)
+    losses = np.zeros(n_scenarios)
+
+    for start in range(0, len(logits), MERCHANT_BLOCK):
+        stop = start + MERCHANT_BLOCK
+
+        # scenario x merchant dispute probabilities
+        p = logits[start:stop] + shocks[:, region_codes[start:stop]]
+        np.negative(p, out=p)
+        np.exp(p, out=p)
+        p += 1.0
+        np.reciprocal(p, out=p)
+
+        hits = rng.random(p.shape, dtype=np.float32) < p
+        losses += hits.astype(np.float32) @ volumes[start:stop]
+
+    return losses
+
+
+# ------------------------------------------------------
+# Simulation driver
+# ------------------------------------------------------
+def simulate_portfolio_losses(
+    risk_probability,
+    monthly_volume,
+    region=None,
+    n_scenarios: int = DEFAULT_SCENARIOS,
+    shock_sigma: float = DEFAULT_SHOCK_SIGMA,
+    seed: int = DEFAULT_SEED,
+    n_workers: int = None
+) -> np.ndarray:
+    """
+    Returns one simulated disputed-volume total per scenario.
+    Seeds are spawned per scenario block, so results depend on the seed
+    only, not on the number of workers.
+    """
+
+    p = np.clip(np.asarray(risk_probability, dtype=float), 1e-6, 1 - 1e-6)
+    logits = np.log(p / (1 - p)).astype(np.float32)
+    volumes = np.asarray(monthly_volume, dtype=np.float32)
+
+    if region is None:
+        region_codes, n_regions = np.zeros(len(p), dtype=np.int64), 1
+    else:
+        # object first: a categorical region has no "unknown" category to fill with
+        region = pd.Series(region).astype(object)
+        codes, uniques = pd.factorize(region.where(region.notna(), "unknown"))
+        region_codes, n_regions = codes.astype(np.int64), max(len(uniques), 1)
+
+    blocks = [min(SCENARIO_BLOCK, n_scenarios - start) for start in range(0, n_scenarios, SCENARIO_BLOCK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(blocks))
+
+    init_args = (logits, volumes, region_codes, n_regions, shock_sigma)
+    n_workers = n_workers or os.cpu_count() or 1
+
+    if n_workers == 1 or len(blocks) == 1:
+        _init_worker(*init_args)
+        results = [_simulate_block(size, s) for size, s in zip(blocks, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=init_args) as executor:
+            results = list(executor.map(_simulate_block, blocks, seeds))
+
+    return np.concatenate(results)
+
+
+def loss_statistics(losses: np.ndarray, levels=CONFIDENCE_LEVELS) -> dict:
+
+    stats = {
+        "scenarios": int(len(losses)),
+        "expected_disputed_volume": round(float(losses.mean()), 2),
+        "std_disputed_volume": round(float(losses.std()), 2),
+        "max_disputed_volume": round(float(losses.max()), 2)
+    }
+
+    for level in levels:
+        var = float(np.quantile(losses, level))
+        tail = losses[losses >= var]
+        pct = f"{level * 100:g}"
+        stats[f"var_{pct}"] = round(var, 2)
+        stats[f"expected_shortfall_{pct}"] = round(float(tail.mean()), 2)
+
+    return stats
+
+
+# ------------------------------------------------------
+# Pipeline step
+# ------------------------------------------------------
+def print_simulation_summary(stats: dict, logger):
+
+    lines = [
+        "",
+        "========== PORTFOLIO LOSS SIMULATION ==========",
+        f"Scenarios:                     {stats['scenarios']}",
+        f"Expected disputed volume:      {stats['expected_disputed_volume']}",
+    ]
+    for key, value in stats.items():
+        if key.startswith(("var_", "expected_shortfall_")):
+            lines.append(f"{key.replace('_', ' ').upper() + ':':31s}{value}")
+    lines.append("=" * 47)
+
+    block = "\n".join(lines)
+    print(block)
+    logger.info(block)
+
+
+def run_portfolio_simulation(
+    merged_df: pd.DataFrame,
+    output_dir: str,
+    logger,
+    n_scenarios: int = DEFAULT_SCENARIOS,
+    shock_sigma: float = DEFAULT_SHOCK_SIGMA,
+    seed: int = DEFAULT_SEED,
+    n_workers: int = None
+) -> dict:
+
+    losses = simulate_portfolio_losses(
+        merged_df["risk_probability"],
+        merged_df["monthly_volume"],
+        region=merged_df["region"] if "region" in merged_df.columns else None,
+        n_scenarios=n_scenarios,
+        shock_sigma=shock_sigma,
+        seed=seed,
+        n_workers=n_workers
+    )
+
+    stats = loss_statistics(losses)
+    stats.update(shock_sigma=shock_sigma, seed=seed)
+
+    output_path = os.path.join(output_dir, "portfolio_simulation.json")
+    with open(output_path, "w") as f:
+        json.dump(stats, f, indent=2)
+
+    print_simulation_summary(stats, logger)
+    logger.info(f"Simulation results saved {output_path}")
+
+    return stats
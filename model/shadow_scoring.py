@@ -0,0 +1,150 @@
+import os
+import json
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from model.model_registry import REGISTRY_DIR, list_versions, current_version, load_version
+from model.train_risk_model import CATEGORICAL_FEATURES, NUMERIC_FEATURES, get_threshold
+
+
+# ------------------------------------------------------
+# Challenger loading
+# ------------------------------------------------------
+def resolve_model(name: str, registry_dir: str = REGISTRY_DIR):
+    """Registry version (v0003), model file path, or file name under models/."""
+
+    if name in list_versions(registry_dir):
+        return load_version(name, registry_dir)
+
+    for path in (name, os.path.join("models", name)):
+        if os.path.isfile(path):
+            return joblib.load(path)
+
+    raise FileNotFoundError(f"Challenger model not found: {name}")
+
+
+def load_challengers(names: list, registry_dir: str = REGISTRY_DIR) -> dict:
+    """`all` expands to every registered version except the promoted champion."""
+
+    if names == ["all"]:
+        champion = current_version(registry_dir)
+        names = [v for v in list_versions(registry_dir) if v != champion]
+
+    challengers = {}
+    for name in names:
+        print(f"Loading challenger {name}")
+        label = os.path.splitext(os.path.basename(name))[0]
+        challengers[label] = resolve_model(name, registry_dir)
+
+    return challengers
+
+
+def _model_features(model) -> list:
+    metadata = getattr(model, "metadata_", None) or {}
+    return (
+        metadata.get("categorical_features", CATEGORICAL_FEATURES)
+        + metadata.get("numeric_features", NUMERIC_FEATURES)
+    )
+
+
+# ------------------------------------------------------
+# Shadow scoring
+# ------------------------------------------------------
+def compare_scores(champion_prob, champion_pred, challenger_prob, challenger_pred) -> dict:
+
+    shift = challenger_prob - champion_prob
+    abs_shift = np.abs(shift)
+
+    return {
+        "mean_champion_probability": round(float(champion_prob.mean()), 4),
+        "mean_challenger_probability": round(float(challenger_prob.mean()), 4),
+        "mean_score_shift": round(float(shift.mean()), 4),
+        "mean_abs_score_shift": round(float(abs_shift.mean()), 4),
+        "p95_abs_score_shift": round(float(np.quantile(abs_shift, 0.95)), 4),
+        "max_abs_score_shift": round(float(abs_shift.max()), 4),
+        "rank_correlation": round(float(pd.Series(champion_prob).corr(pd.Series(challenger_prob), method="spearman")), 4),
+        "champion_high_risk": int(champion_pred.sum()),
+        "challenger_high_risk": int(challenger_pred.sum()),
+        "disagreement_rate": round(float((champion_pred != challenger_pred).mean()), 4),
+        "newly_flagged": int(((challenger_pred == 1) & (champion_pred == 0)).sum()),
+        "no_longer_flagged": int(((challenger_pred == 0) & (champion_pred == 1)).sum())
+    }
+
+
+def shadow_score(scored_df: pd.DataFrame, challengers: dict):
+    """
+    Score every challenger against the champion's already-scored frame.
+
+    The champion probabilities are reused from predict_risk and the input
+    matrix is extracted once, so each challenger costs one predict_proba.
+    """
+
+    champion_prob = scored_df["risk_probability"].to_numpy()
+    champion_pred = scored_df["predicted_high_risk"].to_numpy()
+
+    columns = list(dict.fromkeys(
+        col for model in challengers.values() for col in _model_features(model)
+    ))
+    X = scored_df[columns]
+
+    side_by_side = pd.DataFrame({
+        "merchant_id": scored_df["merchant_id"].to_numpy(),
+        "champion_probability": champion_prob,
+        "champion_high_risk": champion_pred
+    })
+
+    summary = {}
+
+    for name, model in challengers.items():
+        prob = model.predict_proba(X[_model_features(model)])[:, 1]
+        pred = (prob >= get_threshold(model)).astype(int)
+
+        side_by_side[f"{name}_probability"] = prob
+        side_by_side[f"{name}_high_risk"] = pred
+        side_by_side[f"{name}_score_shift"] = prob - champion_prob
+
+        summary[name] = compare_scores(champion_prob, champion_pred, prob, pred)
+
+    return side_by_side, summary
+
+
+def print_shadow_summary(summary: dict, logger):
+
+    lines = ["", "========== CHAMPION / CHALLENGER =========="]
+    for name, stats in summary.items():
+        lines.append(
+            f"{name:12s} mean shift={stats['mean_score_shift']:+.4f} "
+            f"| abs shift p95={stats['p95_abs_score_shift']:.4f} "
+            f"| disagreement={stats['disagreement_rate'] * 100:.1f}% "
+            f"| rank corr={stats['rank_correlation']:.3f}"
+        )
+    lines.append("=" * 43)
+
+    block = "\n".join(lines)
+    print(block)
+    logger.info(block)
+
+
+def run_shadow_scoring(scored_df: pd.DataFrame, challenger_names: list, output_dir: str, logger):
+
+    challengers = load_challengers(challenger_names)
+
+    if not challengers:
+        logger.warning("No challenger models found -> skipping shadow scoring")
+        return None
+
+    side_by_side, summary = shadow_score(scored_df, challengers)
+
+    scores_path = os.path.join(output_dir, "shadow_scores.csv")
+    summary_path = os.path.join(output_dir, "shadow_summary.json")
+
+    side_by_side.to_csv(scores_path, index=False)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print_shadow_summary(summary, logger)
+    logger.info(f"Shadow scores saved {scores_path}")
+
+    return summary
@@ -0,0 +1,162 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from model.model_registry import REGISTRY_DIR, current_version, read_manifest, write_manifest
+
+
+# recall-first triage: the cheapest threshold that still catches 90% of
+# high-risk merchants; F-beta (beta > 1 favours recall) is the fallback
+DEFAULT_TARGET_RECALL = 0.90
+DEFAULT_BETA = 2.0
+
+# keeps the curve stored in the model metadata small for very large validation sets
+MAX_CURVE_POINTS = 2000
+
+
+# ------------------------------------------------------
+# Threshold sweep (one sort + cumulative sums)
+# ------------------------------------------------------
+def threshold_sweep(y_true, scores, volumes=None, beta: float = DEFAULT_BETA) -> pd.DataFrame:
+    """
+    Metrics for every distinct score used as a threshold (predict 1 when
+    score >= threshold). Scores are sorted once in descending order, so the
+    counts at each cut are prefix sums: O(n log n) overall.
+    """
+
+    y_true = np.asarray(y_true, dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    volumes = np.ones_like(scores) if volumes is None else np.asarray(volumes, dtype=float)
+
+    order = np.argsort(-scores, kind="mergesort")
+    scores, y_true, volumes = scores[order], y_true[order], volumes[order]
+
+    tp = np.cumsum(y_true)
+    alerts = np.arange(1, len(scores) + 1)
+    alert_volume = np.cumsum(volumes)
+    captured_volume = np.cumsum(volumes * y_true)
+
+    # last position of each run of equal scores = one row per distinct threshold
+    cut = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+
+    total_positive = max(tp[-1], 1.0)
+    total_positive_volume = max(captured_volume[-1], 1e-12)
+
+    tp, alerts = tp[cut], alerts[cut]
+    precision = tp / alerts
+    recall = tp / total_positive
+
+    curve = pd.DataFrame({
+        "threshold": scores[cut],
+        "alerts": alerts,
+        "alert_rate": alerts / len(scores),
+        "precision": precision,
+        "recall": recall,
+        "f_beta": f_beta(precision, recall, beta),
+        "alert_volume": alert_volume[cut],
+        "captured_high_risk_volume": captured_volume[cut],
+        "captured_volume_share": captured_volume[cut] / total_positive_volume
+    })
+
+    return curve
+
+
+def f_beta(precision, recall, beta: float):
+    b2 = beta ** 2
+    denominator = b2 * precision + recall
+    return np.divide((1 + b2) * precision * recall, denominator,
+                     out=np.zeros_like(denominator, dtype=float), where=denominator > 0)
+
+
+def select_operating_point(curve: pd.DataFrame, target_recall: float = DEFAULT_TARGET_RECALL,
+                           beta: float = DEFAULT_BETA) -> dict:
+
+    scores = f_beta(curve["precision"].to_numpy(), curve["recall"].to_numpy(), beta)
+
+    eligible = curve.index[curve["recall"] >= target_recall] if target_recall is not None else []
+
+    if len(eligible):
+        # highest threshold meeting the recall target = fewest alerts
+        row = curve.loc[curve.loc[eligible, "threshold"].idxmax()]
+        rule = f"recall>={target_recall}"
+    else:
+        row = curve.iloc[int(np.argmax(scores))]
+        rule = f"max_f{beta:g}"
+
+    point = {k: float(v) for k, v in row.items()}
+    point["f_beta"] = float(f_beta(np.array([row["precision"]]), np.array([row["recall"]]), beta)[0])
+    point["beta"] = beta
+    point["rule"] = rule
+
+    return point
+
+
+def compact_curve(curve: pd.DataFrame, max_points: int = MAX_CURVE_POINTS) -> dict:
+
+    if len(curve) > max_points:
+        idx = np.unique(np.linspace(0, len(curve) - 1, max_points).round().astype(int))
+        curve = curve.iloc[idx]
+
+    # thresholds keep full precision so a stored cut never rounds above a real score
+    rounded = curve.drop(columns="threshold").round(6)
+    rounded.insert(0, "threshold", curve["threshold"])
+
+    return rounded.to_dict(orient="list")
+
+
+def print_operating_point(point: dict):
+    print("\n=== Operating Point ===")
+    print(f"Rule:                      {point['rule']}")
+    print(f"Threshold:                 {point['threshold']:.4f}")
+    print(f"Precision / Recall:        {point['precision']:.3f} / {point['recall']:.3f}")
+    print(f"F{point['beta']:g}:                        {point['f_beta']:.3f}")
+    print(f"Alert rate:                {point['alert_rate'] * 100:.1f}%")
+    print(f"Captured high-risk volume: {point['captured_volume_share'] * 100:.1f}%")
+
+
+# ------------------------------------------------------
+# Offline re-tuning from the stored curve (no re-scoring)
+# ------------------------------------------------------
+def retune_threshold(version: str = None, target_recall: float = DEFAULT_TARGET_RECALL,
+                     beta: float = DEFAULT_BETA, registry_dir: str = REGISTRY_DIR) -> dict:
+
+    version = version or current_version(registry_dir)
+    manifest = read_manifest(version, registry_dir)
+
+    if not manifest.get("threshold_curve"):
+        raise ValueError(f"Model {version} has no stored threshold curve")
+
+    curve = pd.DataFrame(manifest["threshold_curve"])
+    point = select_operating_point(curve, target_recall, beta)
+
+    manifest["threshold"] = point["threshold"]
+    manifest["operating_point"] = point
+    write_manifest(version, manifest, registry_dir)
+
+    print(f"Model {version} re-tuned")
+    print_operating_point(point)
+
+    return point
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Re-select the operating threshold of a registered model")
+    parser.add_argument("--version", default=None, help="Registry version (default: promoted)")
+    parser.add_argument("--target-recall", type=float, default=DEFAULT_TARGET_RECALL)
+    parser.add_argument("--beta", type=float, default=DEFAULT_BETA)
+    parser.add_argument("--registry", default=REGISTRY_DIR)
+
+    args = parser.parse_args()
+
+    retune_threshold(args.version, args.target_recall, args.beta, args.registry)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python -m model.threshold_tuning --target-recall 0.95
+# python -m model.threshold_tuning --version v0003 --target-recall 0.8 --beta 1
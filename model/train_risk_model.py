@@ -1,10 +1,12 @@
 import os
+import hashlib
 import joblib
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
-from sklearn.model_selection import train_test_split, learning_curve
+from joblib import Parallel, delayed
+from sklearn.model_selection import train_test_split, learning_curve, StratifiedKFold
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
@@ -15,8 +17,56 @@ from sklearn.metrics import (
     confusion_matrix
 )
 
+from model.model_registry import (
+    REGISTRY_DIR,
+    register_model,
+    promote,
+    current_version,
+    load_version,
+    file_sha256
+)
+from model.threshold_tuning import (
+    DEFAULT_TARGET_RECALL,
+    threshold_sweep,
+    select_operating_point,
+    compact_curve,
+    print_operating_point
+)
+from model.explain import explain_risk
+
 
 MODEL_PATH = "models/risk_model.pkl"
+LEARNING_CURVE_CACHE = "output/learning_curve_cache.npz"
+
+# Default operating threshold, used when a model carries no tuned threshold.
+# Note:
+# The threshold is intentionally lowered to prioritise recall and minimise undetected high-risk merchants.
+# The model is used as a triage tool for manual underwriting rather than an automatic rejection system.
+THRESHOLD = 0.30
+
+# high risk = top 20% dispute rate
+TARGET_QUANTILE = 0.80
+
+CATEGORICAL_FEATURES = [
+    "geo_risk",
+    "internal_risk"
+]
+
+NUMERIC_FEATURES = [
+    "dispute_rate",
+    "monthly_volume",
+    "internal_last_30d_volume",
+    "internal_last_30d_txn_count",
+    "internal_avg_ticket_size"
+]
+
+# -1 -> one worker process per core
+DEFAULT_N_JOBS = -1
+CV_FOLDS = 3
+
+# hyperparameter search space (C path is warm-started inside each fold)
+C_GRID = [0.01, 0.1, 1.0, 10.0]
+CLASS_WEIGHT_GRID = [None, "balanced"]
 
 
 # ------------------------------------------------------
@@ -26,7 +76,7 @@ def prepare_target(df: pd.DataFrame):
     df = df.copy()
 
     # define high risk as top 20% dispute rate
-    threshold = df["dispute_rate"].quantile(0.80)
+    threshold = df["dispute_rate"].quantile(TARGET_QUANTILE)
 
     df["target_high_risk"] = (df["dispute_rate"] >= threshold).astype(int)
 
@@ -74,20 +124,64 @@ def print_feature_importance(model, categorical_features, numeric_features):
 # ------------------------------------------------------
 # Learning curve
 # ------------------------------------------------------
-def plot_learning_curve(model, X, y):
+def _learning_curve_key(model, X, y) -> str:
+    """Fingerprint of the training data and model params for the curve cache"""
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    digest.update(pd.util.hash_pandas_object(y, index=False).values.tobytes())
+    digest.update(repr(sorted(model.named_steps["clf"].get_params().items())).encode())
+    return digest.hexdigest()
 
-    print("\nGenerating learning curve...")
 
-    train_sizes, train_scores, val_scores, *_  = learning_curve(
+def _compute_learning_curve(model, X, y, n_jobs, mode):
+
+    key = _learning_curve_key(model, X, y)
+
+    if mode == "cache" and os.path.exists(LEARNING_CURVE_CACHE):
+        cached = np.load(LEARNING_CURVE_CACHE)
+        if str(cached["key"]) == key:
+            print(f"Using cached learning curve from {LEARNING_CURVE_CACHE}")
+            return cached["train_sizes"], cached["train_scores"], cached["val_scores"]
+
+    train_sizes, train_scores, val_scores, *_ = learning_curve(
         model,
         X,
         y,
-        cv=3,
+        cv=CV_FOLDS,
         scoring="roc_auc",
         train_sizes=np.linspace(0.2, 1.0, 5),
-        n_jobs=None
+        n_jobs=n_jobs
     )
 
+    if mode == "cache":
+        os.makedirs(os.path.dirname(LEARNING_CURVE_CACHE), exist_ok=True)
+        np.savez(
+            LEARNING_CURVE_CACHE,
+            key=key,
+            train_sizes=train_sizes,
+            train_scores=train_scores,
+            val_scores=val_scores
+        )
+
+    return train_sizes, train_scores, val_scores
+
+
+def plot_learning_curve(model, X, y, n_jobs=DEFAULT_N_JOBS, mode="run"):
+    """
+    mode:
+        run   -> always recompute
+        cache -> reuse the cached curve while data and params are unchanged
+        skip  -> do not compute the curve
+    """
+
+    if mode == "skip":
+        print("\nSkipping learning curve")
+        return
+
+    print("\nGenerating learning curve...")
+
+    train_sizes, train_scores, val_scores = _compute_learning_curve(model, X, y, n_jobs, mode)
+
     plt.figure()
     plt.plot(train_sizes, train_scores.mean(axis=1), label="Train AUC")
     plt.plot(train_sizes, val_scores.mean(axis=1), label="Validation AUC")
@@ -104,50 +198,109 @@ def plot_learning_curve(model, X, y):
 
 
 # ------------------------------------------------------
-# Main training function
+# Model definition
 # ------------------------------------------------------
-def train_model(features_path: str):
-
-    print("\nLoading feature dataset...")
-    df = pd.read_csv(features_path)
-
-    df = prepare_target(df)
-
-    y = df["target_high_risk"]
-
-    categorical_features = [
-        "geo_risk",
-        "internal_risk"
-    ]
-
-    numeric_features = [
-        "dispute_rate",
-        "monthly_volume",
-        "internal_last_30d_volume",
-        "internal_last_30d_txn_count",
-        "internal_avg_ticket_size"
-    ]
-
-    X = df[categorical_features + numeric_features]
-
+def build_model(C: float = 1.0, class_weight="balanced") -> Pipeline:
 
     # preprocessing
     preprocessor = ColumnTransformer(
         transformers=[
-            ("cat", OneHotEncoder(handle_unknown="ignore"), categorical_features),
-            ("num", StandardScaler(), numeric_features),
+            ("cat", OneHotEncoder(handle_unknown="ignore"), CATEGORICAL_FEATURES),
+            ("num", StandardScaler(), NUMERIC_FEATURES),
         ]
     )
 
-
     # simple interpretable model
-    model = Pipeline(
+    return Pipeline(
         steps=[
             ("preprocess", preprocessor),
-            ("clf", LogisticRegression(max_iter=1000, class_weight="balanced"))
+            ("clf", LogisticRegression(max_iter=1000, C=C, class_weight=class_weight))
         ]
     )
 
+
+# ------------------------------------------------------
+# Hyperparameter search (parallel CV folds)
+# ------------------------------------------------------
+def _score_fold_path(X, y, train_idx, val_idx, class_weight, c_grid):
+    """
+    Fit one CV fold along the whole C path.
+    The preprocessor is fitted once per fold and the classifier is
+    warm-started from the previous C, so each step only refines the
+    previous solution instead of solving from scratch.
+    """
+
+    preprocessor = build_model().named_steps["preprocess"]
+    X_train = preprocessor.fit_transform(X.iloc[train_idx])
+    X_val = preprocessor.transform(X.iloc[val_idx])
+    y_train, y_val = y.iloc[train_idx], y.iloc[val_idx]
+
+    clf = LogisticRegression(max_iter=1000, class_weight=class_weight, warm_start=True)
+
+    scores = []
+    for C in c_grid:
+        clf.set_params(C=C)
+        clf.fit(X_train, y_train)
+        scores.append(roc_auc_score(y_val, clf.predict_proba(X_val)[:, 1]))
+
+    return class_weight, scores
+
+
+def search_hyperparameters(X, y, n_jobs=DEFAULT_N_JOBS, c_grid=C_GRID, class_weight_grid=CLASS_WEIGHT_GRID):
+
+    c_grid = sorted(c_grid)
+    folds = StratifiedKFold(n_splits=CV_FOLDS, shuffle=True, random_state=42).split(X, y)
+
+    # one task per (fold, class_weight); each task walks the C path
+    tasks = [
+        (train_idx, val_idx, class_weight)
+        for train_idx, val_idx in folds
+        for class_weight in class_weight_grid
+    ]
+
+    print(f"Hyperparameter search: {len(tasks)} fold paths x {len(c_grid)} C values (n_jobs={n_jobs})")
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_score_fold_path)(X, y, train_idx, val_idx, class_weight, c_grid)
+        for train_idx, val_idx, class_weight in tasks
+    )
+
+    fold_scores = {}
+    for class_weight, scores in results:
+        fold_scores.setdefault(class_weight, []).append(scores)
+
+    best_params, best_score = None, -np.inf
+    for class_weight, scores in fold_scores.items():
+        mean_scores = np.mean(scores, axis=0)
+        for C, score in zip(c_grid, mean_scores):
+            print(f"  C={C:<6} class_weight={str(class_weight):9s} cv_auc={score:.4f}")
+            if score > best_score:
+                best_params, best_score = {"C": C, "class_weight": class_weight}, score
+
+    print(f"Best params: {best_params} (cv_auc={best_score:.4f})")
+    return best_params
+
+
+# ------------------------------------------------------
+# Main training function
+# ------------------------------------------------------
+def train_model(
+    features_path: str,
+    n_jobs: int = DEFAULT_N_JOBS,
+    search: bool = False,
+    learning_curve_mode: str = "cache",
+    target_recall: float = DEFAULT_TARGET_RECALL
+):
+
+    print("\nLoading feature dataset...")
+    df = pd.read_csv(features_path)
+
+    df = prepare_target(df)
+
+    y = df["target_high_risk"]
+
+    X = df[CATEGORICAL_FEATURES + NUMERIC_FEATURES]
+
     # --------------------------------------------------
     # Train / test split
     # --------------------------------------------------
@@ -155,6 +308,12 @@ def train_model(features_path: str):
         X, y, test_size=0.25, random_state=42, stratify=y
     )
 
+    params = {}
+    if search:
+        params = search_hyperparameters(X_train, y_train, n_jobs=n_jobs)
+
+    model = build_model(**params)
+
     print("Training model...")
     model.fit(X_train, y_train)
 
@@ -173,27 +332,94 @@ def train_model(features_path: str):
     print("\n=== Confusion Matrix ===")
     print(confusion_matrix(y_test, preds))
 
+    # --------------------------------------------------
+    # Operating point (threshold sweep on the validation split)
+    # --------------------------------------------------
+    curve = threshold_sweep(y_test, probs, volumes=X_test["monthly_volume"])
+    operating_point = select_operating_point(curve, target_recall=target_recall)
+    print_operating_point(operating_point)
+
     # --------------------------------------------------
     # Interpretability
     # --------------------------------------------------
-    print_feature_importance(model, categorical_features, numeric_features)
+    print_feature_importance(model, CATEGORICAL_FEATURES, NUMERIC_FEATURES)
 
     # --------------------------------------------------
     # Learning curve
     # --------------------------------------------------
-    plot_learning_curve(model, X, y)
+    plot_learning_curve(model, X, y, n_jobs=n_jobs, mode=learning_curve_mode)
 
     # --------------------------------------------------
     # Save model
     # --------------------------------------------------
-    os.makedirs("models", exist_ok=True)
-    joblib.dump(model, MODEL_PATH)
-    print(f"\nModel saved {MODEL_PATH}")
+    manifest = build_manifest(
+        features_path,
+        training_mode="full",
+        params=model.named_steps["clf"].get_params(),
+        metrics={
+            "roc_auc": round(float(roc_auc_score(y_test, probs)), 4),
+            "train_rows": len(X_train),
+            "test_rows": len(X_test),
+            "target_dispute_rate_threshold": float(df["dispute_rate"].quantile(TARGET_QUANTILE))
+        },
+        threshold=operating_point["threshold"],
+        operating_point=operating_point,
+        threshold_curve=compact_curve(curve)
+    )
+    save_model(model, manifest)
+
+
+# ------------------------------------------------------
+# Save trained model (+ registry version)
+# ------------------------------------------------------
+def build_manifest(
+    features_path: str,
+    training_mode: str,
+    params: dict,
+    metrics: dict,
+    threshold: float = THRESHOLD,
+    operating_point: dict = None,
+    threshold_curve: dict = None
+) -> dict:
+    return {
+        "training_mode": training_mode,
+        "categorical_features": CATEGORICAL_FEATURES,
+        "numeric_features": NUMERIC_FEATURES,
+        "threshold": threshold,
+        "operating_point": operating_point,
+        "threshold_curve": threshold_curve,
+        "training_data": features_path,
+        "training_data_sha256": file_sha256(features_path),
+        "params": {k: v for k, v in params.items() if isinstance(v, (str, int, float, bool, type(None)))},
+        "metrics": metrics
+    }
+
+
+def save_model(model, manifest: dict, model_path: str = MODEL_PATH, registry_dir: str = REGISTRY_DIR):
+
+    model.metadata_ = manifest
+
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    joblib.dump(model, model_path)
+    print(f"\nModel saved {model_path}")
+
+    version = register_model(model, manifest, registry_dir)
+    promote(version, registry_dir)
+
+    return version
 
 # ------------------------------------------------------
 # Load trained model (inference mode)
 # ------------------------------------------------------
-def load_model(model_path: str = MODEL_PATH):
+def load_model(model_path: str = None):
+
+    # default: the promoted registry version, falling back to the legacy single file
+    if model_path is None:
+        version = current_version()
+        if version is not None:
+            print(f"Loading promoted model {version} from {REGISTRY_DIR}")
+            return load_version(version)
+        model_path = MODEL_PATH
 
     if not os.path.exists(model_path):
         raise FileNotFoundError(
@@ -203,34 +429,41 @@ def load_model(model_path: str = MODEL_PATH):
     print(f"Loading trained model from {model_path}")
     return joblib.load(model_path)
 
+# ------------------------------------------------------
+# Operating threshold stored with the model
+# ------------------------------------------------------
+def get_threshold(model) -> float:
+    metadata = getattr(model, "metadata_", None) or {}
+    return float(metadata.get("threshold", THRESHOLD))
+
 # ------------------------------------------------------
 # Predict risk using trained model
 # ------------------------------------------------------
-def predict_risk(model, features_df: pd.DataFrame):
+def predict_risk(model, features_df: pd.DataFrame, copy: bool = True, explain_top_k: int = 0):
+    """
+    copy=False scores the frame in place, for callers that own the frame
+    (e.g. a chunk read by the batch scorer) and do not need the original.
 
-    categorical_features = [
-        "geo_risk",
-        "internal_risk"
-    ]
+    explain_top_k > 0 adds the top-k per-merchant risk drivers; the
+    preprocessed matrix is shared between scoring and explanations.
+    """
 
-    numeric_features = [
-        "dispute_rate",
-        "monthly_volume",
-        "internal_last_30d_volume",
-        "internal_last_30d_txn_count",
-        "internal_avg_ticket_size"
-    ]
+    X = features_df[CATEGORICAL_FEATURES + NUMERIC_FEATURES]
 
-    X = features_df[categorical_features + numeric_features]
+    scored_df = features_df.copy() if copy else features_df
 
-    scored_df = features_df.copy()
+    if explain_top_k:
+        X_transformed = model.named_steps["preprocess"].transform(X)
+        scored_df["risk_probability"] = model.named_steps["clf"].predict_proba(X_transformed)[:, 1]
+    else:
+        scored_df["risk_probability"] = model.predict_proba(X)[:, 1]
 
-    scored_df["risk_probability"] = model.predict_proba(X)[:, 1]
+    scored_df["predicted_high_risk"] = (scored_df["risk_probability"] >= get_threshold(model)).astype(int)
 
-    # Note:
-    # The threshold is intentionally lowered to prioritise recall and minimise undetected high-risk merchants. 
-    # The model is used as a triage tool for manual underwriting rather than an automatic rejection system.
-    THRESHOLD = 0.30
-    scored_df["predicted_high_risk"] = (scored_df["risk_probability"] >= THRESHOLD).astype(int)
+    if explain_top_k:
+        drivers = explain_risk(model, X_transformed, explain_top_k)
+        drivers.index = scored_df.index
+        for col in drivers.columns:
+            scored_df[col] = drivers[col]
 
     return scored_df
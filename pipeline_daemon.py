@@ -0,0 +1,535 @@
+import os
+import io
+import json
+import time
+import glob
+import queue
+import hashlib
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+
+import pandas as pd
+import requests
+
+from features.build_features_pipeline import fetch_all_country_metadata, fetch_all_internal_risk, enrich_merchants
+from features.underwriting_features import build_underwriting_features
+from ingestion.schema_validator import validate_schema_columns, validate_rows
+from ingestion.service_bootstrap import ensure_internal_api_running
+from model.train_risk_model import load_model, predict_risk
+from model.model_registry import ModelHandle, current_version
+from model.portfolio_risk import merge_predictions
+from model.portfolio_aggregation import PortfolioAccumulator
+from reporting.generate_report import generate_underwriting_report
+from common.dtype_policy import compact_frame
+from common.logger_config import configure_logger
+
+
+logger = configure_logger("pipeline_daemon")
+
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 8765
+POLL_SECONDS = 5.0
+
+# a file whose last line has no newline is taken as complete once untouched this long
+SETTLE_SECONDS = 10.0
+
+STATE_FILE = ".watch_state.json"
+COMMAND_TIMEOUT = 600
+
+# read back as text so identifiers keep their leading zeros
+RESTORE_DTYPES = {"merchant_id": str, "entity_id": str, "registration_number": str}
+
+# bytes before the resume offset that must be unchanged for a file to count as appended to
+TAIL_BYTES = 256
+
+# scans in a row a file may fail before it is moved out of the watch folder
+MAX_ATTEMPTS = 3
+QUARANTINE_DIR = "failed"
+
+
+# ------------------------------------------------------
+# Watch folder
+# ------------------------------------------------------
+def _tail_hash(f, offset: int) -> str:
+    start = max(offset - TAIL_BYTES, 0)
+    f.seek(start)
+    return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+
+class WatchFolder:
+    """
+    Finds merchant CSVs in `watch_dir` that are new or have grown.
+
+    Per file the state keeps the byte offset already consumed, the header
+    line and a hash of the bytes just before the offset. A file that grew
+    with the same inode and the same bytes before the offset is read from
+    the offset (appended rows only); a replaced or rewritten file is read
+    again from the start. Only complete lines are consumed.
+
+    A file that fails `max_attempts` scans in a row is moved to
+    <watch_dir>/failed/ with the last error next to it, so one bad file is
+    not retried forever. Put it back once fixed.
+    """
+
+    def __init__(
+        self,
+        watch_dir: str,
+        state_path: str,
+        pattern: str = "*.csv",
+        settle_seconds: float = SETTLE_SECONDS,
+        max_attempts: int = MAX_ATTEMPTS
+    ):
+        self.watch_dir = watch_dir
+        self.state_path = state_path
+        self.pattern = pattern
+        self.settle_seconds = settle_seconds
+        self.max_attempts = max_attempts
+        self.attempts = {}
+        self.state = {}
+
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def files(self) -> list:
+        return sorted(glob.glob(os.path.join(self.watch_dir, self.pattern)))
+
+    def pending(self) -> list:
+        """[(name, frame, new state entry)] for every file with unconsumed rows."""
+
+        deltas = []
+        for path in self.files():
+            delta = self.read_delta(path)
+            if delta is not None:
+                deltas.append(delta)
+        return deltas
+
+    def read_delta(self, path: str):
+        name = os.path.basename(path)
+        entry = self.state.get(name)
+        st = os.stat(path)
+
+        # fully consumed and untouched since
+        if entry and entry["inode"] == st.st_ino and entry["offset"] == st.st_size and entry["mtime"] == st.st_mtime:
+            return None
+
+        with open(path, "rb") as f:
+            resume = (
+                entry is not None
+                and entry["inode"] == st.st_ino
+                and st.st_size >= entry["offset"]
+                and _tail_hash(f, entry["offset"]) == entry["tail"]
+            )
+            start = entry["offset"] if resume else 0
+
+            f.seek(start)
+            data = f.read(st.st_size - start)
+
+            # an unfinished last line waits for its newline (or for the file to settle)
+            if not data.endswith(b"\n") and time.time() - st.st_mtime < self.settle_seconds:
+                data = data[:data.rfind(b"\n") + 1]
+
+            offset = start + len(data)
+            tail = _tail_hash(f, offset)
+
+        if start == 0:
+            header, _, body = data.partition(b"\n")
+            header += b"\n"
+        else:
+            header, body = entry["header"].encode(), data
+
+        new_entry = {
+            "inode": st.st_ino,
+            "mtime": st.st_mtime,
+            "offset": offset,
+            "tail": tail,
+            "header": header.decode("utf-8")
+        }
+
+        if not body.strip():
+            return None
+
+        frame = pd.read_csv(io.BytesIO(header + body))
+        return name, frame, new_entry
+
+    def commit(self, name: str, entry: dict):
+        """Mark rows as consumed; called only after they were processed."""
+
+        self.attempts.pop(name, None)
+        self.state[name] = entry
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def fail(self, name: str, error: str) -> bool:
+        """Count a failed attempt; returns True when the file was moved to the quarantine folder."""
+
+        self.attempts[name] = self.attempts.get(name, 0) + 1
+        if self.attempts[name] < self.max_attempts:
+            return False
+
+        folder = os.path.join(self.watch_dir, QUARANTINE_DIR)
+        os.makedirs(folder, exist_ok=True)
+        os.replace(os.path.join(self.watch_dir, name), os.path.join(folder, name))
+        with open(os.path.join(folder, name + ".error.txt"), "w") as f:
+            f.write(f"{error}\n")
+
+        del self.attempts[name]
+        return True
+
+
+# ------------------------------------------------------
+# Output helpers
+# ------------------------------------------------------
+def _append_csv(path: str, frame: pd.DataFrame):
+    """Append in the existing file's column order (missing columns left empty)."""
+
+    if not os.path.exists(path):
+        frame.to_csv(path, index=False)
+        return
+
+    with open(path) as f:
+        columns = f.readline().strip().split(",")
+
+    frame.reindex(columns=columns).to_csv(path, mode="a", header=False, index=False)
+
+
+def _upsert(current, new: pd.DataFrame) -> pd.DataFrame:
+    if current is None or len(current) == 0:
+        return new
+    kept = current[~current["merchant_id"].isin(new["merchant_id"])]
+    return compact_frame(pd.concat([kept, new], ignore_index=True))
+
+
+# ------------------------------------------------------
+# Daemon
+# ------------------------------------------------------
+class PipelineDaemon:
+    """
+    Warm pipeline process: the model, the country cache, the HTTP session
+    and the portfolio state stay loaded between batches.
+
+    Every poll (or on a "run" command) new files and appended rows in the
+    watch folder are validated, enriched, scored and merged into the
+    outputs. A merchant_id seen before is an update: its old row is taken
+    out of the portfolio totals and replaced. Outputs are appended to when
+    a batch only adds merchants and rewritten when it updates any.
+
+    Commands arrive as one JSON line on a local TCP socket (see send_command):
+    status, run, process {"path"}, report, stop.
+    """
+
+    def __init__(
+        self,
+        watch_dir: str,
+        output_dir: str,
+        poll_seconds: float = POLL_SECONDS,
+        control_port: int = CONTROL_PORT,
+        explain_top_k: int = 0,
+        model=None,
+        ensure_api: bool = True
+    ):
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.poll_seconds = poll_seconds
+        self.control_port = control_port
+        self.explain_top_k = explain_top_k
+        self.ensure_api = ensure_api
+
+        os.makedirs(watch_dir, exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.paths = {
+            "enriched": os.path.join(output_dir, "enriched_merchants.csv"),
+            "predictions": os.path.join(output_dir, "merchant_predictions.csv"),
+            "portfolio": os.path.join(output_dir, "portfolio_view.csv"),
+            "segments": os.path.join(output_dir, "portfolio_segments.csv"),
+            "metrics": os.path.join(output_dir, "portfolio_metrics.json"),
+            "invalid": os.path.join(output_dir, "invalid_rows.csv"),
+            "report": os.path.join(output_dir, "underwriting_report.txt")
+        }
+
+        self.watcher = WatchFolder(watch_dir, os.path.join(output_dir, STATE_FILE))
+        self.session = requests.Session()
+        self.country_map = {}
+
+        self._fixed_model = model
+        self._model_handle = ModelHandle()
+        self._legacy_model = None
+
+        self.frames = {"enriched": None, "predictions": None, "portfolio": None}
+        self.accumulator = PortfolioAccumulator()
+
+        self.jobs = queue.Queue()
+        self.server = None
+        self._stop = threading.Event()
+        self.stats = {"started_at": time.time(), "batches": 0, "rows": 0, "files": 0, "quarantined": 0, "last_batch": None}
+
+        self._restore()
+
+    # --------------------------------------------------
+    # Warm state
+    # --------------------------------------------------
+    def model(self):
+        if self._fixed_model is not None:
+            return self._fixed_model
+        # promoted registry version (hot-reloaded when a new one is promoted), else the legacy file
+        if current_version() is not None:
+            return self._model_handle.get()
+        if self._legacy_model is None:
+            self._legacy_model = load_model()
+        return self._legacy_model
+
+    def _restore(self):
+        """Pick up the outputs of an earlier run or daemon, so new batches extend them."""
+
+        for key in self.frames:
+            if os.path.exists(self.paths[key]):
+                self.frames[key] = compact_frame(pd.read_csv(self.paths[key], dtype=RESTORE_DTYPES))
+
+        if self.frames["portfolio"] is not None:
+            self.accumulator.update(self.frames["portfolio"])
+            logger.info(f"Restored {len(self.frames['portfolio'])} merchants from {self.paths['portfolio']}")
+
+    # --------------------------------------------------
+    # Batch processing
+    # --------------------------------------------------
+    def process_frame(self, df: pd.DataFrame, source: str) -> dict:
+        started = time.perf_counter()
+
+        validate_schema_columns(df)
+        valid_df, invalid_df = validate_rows(df)
+        if len(invalid_df):
+            _append_csv(self.paths["invalid"], invalid_df)
+
+        # the last row of a merchant in the batch wins
+        df = compact_frame(valid_df.drop_duplicates("merchant_id", keep="last").reset_index(drop=True))
+
+        new_countries = [c for c in df["country"].dropna().unique() if c not in self.country_map]
+        if new_countries:
+            self.country_map.update(fetch_all_country_metadata(new_countries))
+
+        internal_map = fetch_all_internal_risk(df["merchant_id"].unique(), session=self.session)
+        enriched = enrich_merchants(df, internal_map, self.country_map)
+
+        result = {"source": source, "rows": len(valid_df), "invalid": len(invalid_df), "scored": len(enriched), "updated": 0}
+
+        if len(enriched):
+            features = compact_frame(build_underwriting_features(enriched))
+            predictions = compact_frame(predict_risk(self.model(), features, explain_top_k=self.explain_top_k))
+            portfolio = compact_frame(merge_predictions(enriched, predictions))
+
+            previous = self.frames["portfolio"]
+            if previous is not None:
+                replaced = previous[previous["merchant_id"].isin(portfolio["merchant_id"])]
+                self.accumulator.retract(replaced)
+                result["updated"] = len(replaced)
+
+            self.accumulator.update(portfolio)
+
+            batch = {"enriched": enriched, "predictions": predictions, "portfolio": portfolio}
+            for key, frame in batch.items():
+                self.frames[key] = _upsert(self.frames[key], frame)
+
+                # appends are cheap; an update changes earlier rows, so the file is rewritten
+                if result["updated"]:
+                    self.frames[key].to_csv(self.paths[key], index=False)
+                else:
+                    _append_csv(self.paths[key], frame)
+
+            self.accumulator.segment_metrics().to_csv(self.paths["segments"], index=False)
+            with open(self.paths["metrics"], "w") as f:
+                json.dump(self.accumulator.metrics(), f, indent=2)
+
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        result["metrics"] = self.accumulator.metrics() if self.accumulator.totals["merchants"] else None
+
+        self.stats["batches"] += 1
+        self.stats["rows"] += result["rows"]
+        self.stats["last_batch"] = result
+
+        logger.info(
+            f"Processed {source}: {result['rows']} rows ({result['scored']} scored, {result['updated']} updated, "
+            f"{result['invalid']} invalid) in {result['seconds']:.2f}s"
+        )
+        return result
+
+    def scan(self) -> list:
+        """Process every new file / appended rows in the watch folder."""
+
+        results = []
+        for path in self.watcher.files():
+            name = os.path.basename(path)
+            try:
+                delta = self.watcher.read_delta(path)
+                if delta is None:
+                    continue
+                _, frame, entry = delta
+                results.append(self.process_frame(frame, name))
+            except Exception as e:
+                # not committed: the same rows are retried on the next scan, up to MAX_ATTEMPTS times
+                attempts = self.watcher.attempts.get(name, 0) + 1
+                quarantined = self.watcher.fail(name, str(e))
+                logger.exception(f"Failed to process {name} (attempt {attempts}): {e}")
+                if quarantined:
+                    logger.error(f"Moved {name} to {os.path.join(self.watch_dir, QUARANTINE_DIR)} after {attempts} failed attempts")
+                    self.stats["quarantined"] += 1
+                results.append({"source": name, "error": str(e), "attempts": attempts, "quarantined": quarantined})
+                continue
+
+            self.watcher.commit(name, entry)
+            self.stats["files"] += 1
+
+        return results
+
+    def report(self) -> dict:
+        if self.frames["portfolio"] is None or not self.accumulator.totals["merchants"]:
+            return {"error": "no merchants scored yet"}
+
+        _, provider = generate_underwriting_report(self.accumulator.metrics(), self.frames["portfolio"], self.paths["report"])
+        return {"report": self.paths["report"], "provider": provider}
+
+    # --------------------------------------------------
+    # Control socket
+    # --------------------------------------------------
+    def status(self) -> dict:
+        merchants = int(self.accumulator.totals["merchants"])
+        return {
+            **self.stats,
+            "merchants": merchants,
+            "metrics": self.accumulator.metrics() if merchants else None,
+            "queued": self.jobs.qsize(),
+            "watch_dir": self.watch_dir
+        }
+
+    def submit(self, command: str, **params) -> Future:
+        future = Future()
+        self.jobs.put((command, params, future))
+        return future
+
+    def handle_command(self, request: dict) -> dict:
+        command = request.get("command")
+
+        if command == "status":
+            return self.status()
+        if command == "stop":
+            self._stop.set()
+            return {"stopping": True}
+        if command not in ("run", "process", "report"):
+            return {"error": f"unknown command {command!r}"}
+
+        # processing stays on the daemon's main loop, one batch at a time
+        params = {k: v for k, v in request.items() if k != "command"}
+        future = self.submit(command, **params)
+        try:
+            return future.result(timeout=request.get("timeout", COMMAND_TIMEOUT))
+        except Exception as e:
+            return {"error": str(e)}
+
+    def _run_job(self, command: str, params: dict):
+        if command == "run":
+            return {"processed": self.scan()}
+        if command == "process":
+            return self.process_frame(pd.read_csv(params["path"]), params["path"])
+        if command == "report":
+            return self.report()
+
+    def start_control(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline() or b"{}")
+                    reply = daemon.handle_command(request)
+                except ValueError as e:
+                    reply = {"error": f"bad request: {e}"}
+                self.wfile.write((json.dumps(reply, default=str) + "\n").encode())
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((CONTROL_HOST, self.control_port), Handler)
+        self.server.daemon_threads = True
+        self.control_port = self.server.server_address[1]
+
+        threading.Thread(target=self.server.serve_forever, name="control", daemon=True).start()
+        logger.info(f"Control socket listening on {CONTROL_HOST}:{self.control_port}")
+
+    # --------------------------------------------------
+    # Main loop
+    # --------------------------------------------------
+    def serve_forever(self):
+        if self.ensure_api:
+            ensure_internal_api_running()
+
+        self.start_control()
+        logger.info(f"Watching {self.watch_dir} every {self.poll_seconds:.0f}s -> {self.output_dir}")
+
+        next_poll = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                try:
+                    command, params, future = self.jobs.get(timeout=max(0.0, min(next_poll - time.monotonic(), 1.0)))
+                except queue.Empty:
+                    if time.monotonic() >= next_poll:
+                        self.scan()
+                        next_poll = time.monotonic() + self.poll_seconds
+                    continue
+
+                try:
+                    future.set_result(self._run_job(command, params))
+                except Exception as e:
+                    logger.exception(f"Command {command} failed")
+                    future.set_exception(e)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.session.close()
+        logger.info("Pipeline daemon stopped")
+
+
+# ------------------------------------------------------
+# Client
+# ------------------------------------------------------
+def send_command(command: str, host: str = CONTROL_HOST, port: int = CONTROL_PORT, timeout: float = COMMAND_TIMEOUT, **params) -> dict:
+    import socket
+
+    with socket.create_connection((host, port), timeout=timeout) as conn:
+        conn.sendall((json.dumps({"command": command, **params}) + "\n").encode())
+        with conn.makefile("rb") as reply:
+            return json.loads(reply.readline())
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Send a command to a running pipeline daemon")
+    parser.add_argument("command", choices=["status", "run", "process", "report", "stop"])
+    parser.add_argument("--path", default=None, help="Merchant CSV for the process command")
+    parser.add_argument("--port", type=int, default=CONTROL_PORT)
+
+    args = parser.parse_args()
+
+    params = {"path": os.path.abspath(args.path)} if args.path else {}
+    print(json.dumps(send_command(args.command, port=args.port, **params), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python run_pipeline.py --serve --watch-dir incoming
+# python -m pipeline_daemon status
+# python -m pipeline_daemon run
+# python -m pipeline_daemon process --path data/merchants.csv
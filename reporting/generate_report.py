@@ -1,9 +1,15 @@
 import os
+import json
+import hashlib
 import requests
 import pandas as pd
 import shutil
 import subprocess
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from common.instrumentation import span
 
 
 # ======================================================
@@ -12,6 +18,12 @@ import time
 OLLAMA_URL = "http://localhost:11434/api/generate"
 OLLAMA_HEALTH = "http://localhost:11434/api/tags"
 MODEL_NAME = "llama3"
+OPENAI_MODEL = "gpt-4o-mini"
+
+# overall budget for provider probing + generation; past it the
+# rule-based report is used immediately
+REPORT_DEADLINE_SECONDS = 120
+PROBE_TIMEOUT = 2
 
 
 # ======================================================
@@ -34,15 +46,18 @@ def has_ollama_installed():
     return shutil.which("ollama") is not None
 
 
-def ensure_ollama_running():
+def ensure_ollama_running(deadline: float = None):
     """Start Ollama automatically if installed but not running"""
     try:
-        requests.get(OLLAMA_HEALTH, timeout=2)
+        requests.get(OLLAMA_HEALTH, timeout=PROBE_TIMEOUT)
         print("Local LLM already running")
         return True
     except:
         print("Local LLM not running -> attempting auto start")
 
+    if not has_ollama_installed():
+        return False
+
     try:
         subprocess.Popen(
             ["ollama", "serve"],
@@ -52,10 +67,12 @@ def ensure_ollama_running():
     except Exception:
         return False
 
-    # wait for startup
+    # wait for startup (bounded by the report deadline)
     for _ in range(10):
+        if deadline is not None and time.monotonic() >= deadline:
+            break
         try:
-            requests.get(OLLAMA_HEALTH, timeout=2)
+            requests.get(OLLAMA_HEALTH, timeout=PROBE_TIMEOUT)
             print("Local LLM started")
             return True
         except:
@@ -64,14 +81,105 @@ def ensure_ollama_running():
     return False
 
 
+# ======================================================
+# CONCURRENT PROVIDER PROBING
+# ======================================================
+def probe_providers(deadline: float, latency: dict) -> dict:
+    """
+    Check every provider at the same time instead of one after another.
+    Returns {provider: available} for the providers that answered before
+    the deadline.
+    """
+
+    def timed(name, probe):
+        start = time.monotonic()
+        try:
+            return probe()
+        finally:
+            latency.setdefault(name, {})["probe_seconds"] = round(time.monotonic() - start, 3)
+
+    probes = {
+        "OpenAI": lambda: has_openai_key() and has_openai_package(),
+        "Local LLM": lambda: ensure_ollama_running(deadline),
+    }
+
+    executor = ThreadPoolExecutor(max_workers=len(probes))
+    futures = {name: executor.submit(timed, name, probe) for name, probe in probes.items()}
+
+    available = {}
+    for name, future in futures.items():
+        try:
+            available[name] = bool(future.result(timeout=max(0.0, deadline - time.monotonic())))
+        except FutureTimeout:
+            latency.setdefault(name, {})["status"] = "probe timeout"
+            available[name] = False
+        except Exception:
+            available[name] = False
+
+        if not available[name]:
+            latency.setdefault(name, {}).setdefault("status", "unavailable")
+
+    executor.shutdown(wait=False)
+    return available
+
+
+# ======================================================
+# REPORT CACHE (keyed by prompt hash)
+# ======================================================
+def prompt_cache_key(prompt: str) -> str:
+    payload = json.dumps({"prompt": prompt, "models": [OPENAI_MODEL, MODEL_NAME]})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_cached_report(cache_dir: str, key: str):
+    path = os.path.join(cache_dir, f"{key}.json")
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_cached_report(cache_dir: str, key: str, report_text: str, provider: str):
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{key}.json"), "w", encoding="utf-8") as f:
+        json.dump({"provider": provider, "report": report_text}, f)
+
+
 # ======================================================
 # PROMPT BUILDER
 # ======================================================
-def build_prompt(metrics: dict, merged_df: pd.DataFrame) -> str:
+TOP_RISKY_COUNT = 5
+
+
+def top_risky_merchants(merged_df: pd.DataFrame, k: int = TOP_RISKY_COUNT) -> pd.DataFrame:
+    # partial selection instead of a full sort of the portfolio
+    return merged_df.nlargest(k, "risk_probability")[["merchant_id", "monthly_volume", "risk_probability", "country"]]
+
 
-    top_risky = (
-        merged_df.sort_values("risk_probability", ascending=False)
-        .head(5)[["merchant_id", "monthly_volume", "risk_probability", "country"]]
+def format_evidence(evidence: list) -> str:
+    """Document passages (DocumentIndex.evidence hits) as prompt lines."""
+    return "\n".join(
+        f"- {hit['merchant_id']} (page {hit['page']}): {' '.join(hit['snippet'].split())}"
+        for hit in evidence
+    )
+
+
+def build_prompt(
+    metrics: dict,
+    merged_df: pd.DataFrame,
+    top_risky: pd.DataFrame = None,
+    scope: str = "PORTFOLIO",
+    evidence: list = None
+) -> str:
+
+    if top_risky is None:
+        top_risky = top_risky_merchants(merged_df)
+
+    # passages from merchant documents, only when a document index was available
+    evidence_block = (
+        f"\nDOCUMENT EVIDENCE (excerpts from merchant statements)\n{format_evidence(evidence)}\n"
+        if evidence else ""
     )
 
     risky_lines = "\n".join(
@@ -94,7 +202,7 @@ STRICT REQUIREMENTS:
 - Must justify the decision using the data provided
 - No speculation beyond the dataset
 
-PORTFOLIO DATA
+{scope} DATA
 Total merchants: {metrics['total_merchants']}
 High risk merchants: {metrics['high_risk_merchants']} ({metrics['high_risk_ratio']*100:.1f}%)
 High risk exposure volume: {metrics['high_risk_volume']}
@@ -103,7 +211,7 @@ Average risk score: {metrics['avg_risk_probability']}
 
 TOP RISKY MERCHANTS
 {risky_lines}
-
+{evidence_block}
 ANALYSIS INSTRUCTIONS
 1. Classify overall portfolio risk: low / moderate / elevated
 2. Identify dominant risk drivers using ONLY:
@@ -119,43 +227,218 @@ Write in professional underwriting tone.
 """
 
 
+# ======================================================
+# STREAMING OUTPUT
+# ======================================================
+class StreamInterrupted(RuntimeError):
+    """The provider stream broke after some text had already arrived."""
+
+    def __init__(self, message, partial_text):
+        super().__init__(message)
+        self.partial_text = partial_text
+
+
+class StreamTruncated(StreamInterrupted):
+    """The report deadline passed while the reply was still streaming."""
+
+
+class StreamAbandoned(RuntimeError):
+    """Raised into a provider stream once the report has moved on without it."""
+
+
+class StreamingReportWriter:
+    """
+    Receives tokens as they arrive, appends them to the report file and the
+    console, and records time-to-first-token and tokens/second.
+    """
+
+    def __init__(self, output_path: str, echo: bool = True):
+        self.output_path = output_path
+        self.echo = echo
+        self.first_token = threading.Event()
+        self._lock = threading.Lock()
+        self._file = None
+        self._abandoned = False
+        self.reset()
+
+    def reset(self):
+        """Start over for the next provider."""
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
+            self.first_token.clear()
+            self.started = time.monotonic()
+            self.first_token_at = None
+            self.last_token_at = None
+            self.tokens = 0
+            self.parts = []
+
+    def write(self, token: str):
+        with self._lock:
+            if self._abandoned:
+                raise StreamAbandoned("report no longer waiting for this stream")
+            if not token:
+                return
+
+            now = time.monotonic()
+            if self._file is None:
+                self._file = open(self.output_path, "w", encoding="utf-8")
+                self.first_token_at = now
+                self.first_token.set()
+                if self.echo:
+                    print("\n=== STREAMING UNDERWRITING REPORT ===\n")
+
+            self._file.write(token)
+            self._file.flush()
+            self.last_token_at = now
+            self.tokens += 1
+            self.parts.append(token)
+
+        if self.echo:
+            print(token, end="", flush=True)
+
+    def abandon(self):
+        """Stop accepting tokens; a late stream thread fails on its next write."""
+        with self._lock:
+            self._abandoned = True
+            if self._file:
+                self._file.close()
+            self._file = None
+
+    def text(self) -> str:
+        with self._lock:
+            return "".join(self.parts)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
+        if self.echo and self.tokens:
+            print()
+
+    def stats(self) -> dict:
+        if self.first_token_at is None:
+            return {"tokens": 0}
+
+        stream_seconds = self.last_token_at - self.first_token_at
+        return {
+            "time_to_first_token": round(self.first_token_at - self.started, 3),
+            "tokens": self.tokens,
+            "tokens_per_second": round(self.tokens / stream_seconds, 2) if stream_seconds > 0 else None
+        }
+
+
 # ======================================================
 # OPENAI CALL
 # ======================================================
-def call_openai(prompt: str) -> str:
+def call_openai(prompt: str, timeout: float = 600, on_token=None) -> str:
     try:
         from openai import OpenAI
     except ImportError:
         raise RuntimeError("OpenAI package not installed")
 
     print("Using OpenAI API")
-    client = OpenAI()
-
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.2
-    )
+    client = OpenAI(timeout=timeout)
+
+    if on_token is None:
+        with span("llm.openai"):
+            response = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2
+            )
+        return response.choices[0].message.content
+
+    # streamed: the span covers the request up to the first chunk
+    with span("llm.openai"):
+        stream = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            stream=True
+        )
 
-    return response.choices[0].message.content
+    parts = []
+    finished = False
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            token = choice.delta.content or ""
+            if token:
+                on_token(token)
+                parts.append(token)
+            if choice.finish_reason is not None:
+                finished = True
+    except StreamAbandoned:
+        raise
+    except Exception as e:
+        if parts:
+            raise StreamInterrupted(f"OpenAI stream broke: {e}", "".join(parts))
+        raise
+
+    if not finished and parts:
+        raise StreamInterrupted("OpenAI stream ended without a finish reason", "".join(parts))
+
+    return "".join(parts)
 
 
 # ======================================================
 # LOCAL LLM CALL
 # ======================================================
-def call_local_llm(prompt: str) -> str:
+def call_local_llm(prompt: str, timeout: float = 600, on_token=None) -> str:
     print("Using local LLM via Ollama")
 
-    response = requests.post(
-        OLLAMA_URL,
-        json={"model": MODEL_NAME, "prompt": prompt, "stream": False},
-        timeout=600
-    )
+    stream = on_token is not None
+
+    # with stream=True the timeout bounds the gap between chunks, not the whole reply
+    with span("llm.ollama"):
+        response = requests.post(
+            OLLAMA_URL,
+            json={"model": MODEL_NAME, "prompt": prompt, "stream": stream},
+            timeout=timeout,
+            stream=stream
+        )
 
     if response.status_code != 200:
         raise RuntimeError("Local LLM call failed")
 
-    return response.json()["response"]
+    if not stream:
+        return response.json()["response"]
+
+    # newline-delimited JSON: {"response": "<token>", "done": false} ... {"done": true}
+    parts = []
+    done = False
+    try:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            token = chunk.get("response", "")
+            if token:
+                on_token(token)
+                parts.append(token)
+            if chunk.get("done"):
+                done = True
+                break
+    except StreamAbandoned:
+        raise
+    except Exception as e:
+        if parts:
+            raise StreamInterrupted(f"Local LLM stream broke: {e}", "".join(parts))
+        raise
+    finally:
+        response.close()
+
+    if not done:
+        if parts:
+            raise StreamInterrupted("Local LLM stream ended before completion", "".join(parts))
+        raise RuntimeError("Local LLM returned an empty stream")
+
+    return "".join(parts)
 
 
 # ======================================================
@@ -183,30 +466,135 @@ Portfolio risk is classified as {level}. The portfolio contains {metrics['high_r
 # ======================================================
 # MAIN REPORT GENERATOR
 # ======================================================
-def generate_underwriting_report(metrics, merged_df, output_path="output/underwriting_report.txt"):
+PROVIDER_CALLS = {
+    "OpenAI": call_openai,
+    "Local LLM": call_local_llm,
+}
 
-    print("\n=== GENERATING UNDERWRITING REPORT ===")
 
-    prompt = build_prompt(metrics, merged_df)
+def _await_provider(future, remaining: float, writer):
+    """
+    Wait for a provider call until the deadline. A reply that is already
+    streaming is cut off there: the writer is abandoned, so the stream
+    thread stops on its next token, and the text received so far is kept.
+    """
 
-    report_text = None
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeout:
+        if writer is None or not writer.first_token.is_set():
+            raise
+
+    writer.abandon()
+    raise StreamTruncated("report deadline passed mid-stream", writer.text())
+
+
+def generate_with_deadline(prompt: str, deadline: float, latency: dict, writer: StreamingReportWriter = None):
+    """
+    Probe providers concurrently, then try them in priority order until one
+    succeeds or the deadline passes. With a writer, replies are streamed
+    token by token into it. Returns (report_text, provider) or (None, None);
+    a stream that breaks mid-way returns its partial text as "<provider> (partial)",
+    one still running at the deadline as "<provider> (truncated)".
+    """
+
+    available = probe_providers(deadline, latency)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        for provider, call in PROVIDER_CALLS.items():
+            if not available.get(provider):
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            start = time.monotonic()
+            if writer is not None:
+                writer.reset()
+            future = executor.submit(call, prompt, remaining, writer.write if writer else None)
+
+            def record(status):
+                latency[provider].update(status=status, generate_seconds=round(time.monotonic() - start, 3))
+                if writer is not None:
+                    latency[provider].update(writer.stats())
 
-    # 1️⃣ OpenAI
-    if has_openai_key() and has_openai_package():
-        try:
-            report_text = call_openai(prompt)
-            provider_used = "OpenAI"
-        except Exception as e:
-            print("OpenAI failed:", e)
-
-    # 2️⃣ Local LLM
-    if report_text is None and has_ollama_installed():
-        if ensure_ollama_running():
             try:
-                report_text = call_local_llm(prompt)
-                provider_used = "Local LLM"
+                report_text = _await_provider(future, remaining, writer)
+                record("ok")
+                return report_text, provider
+            except StreamTruncated as e:
+                print(f"\n{provider} {e} -> keeping truncated output")
+                record("truncated")
+                return e.partial_text, f"{provider} (truncated)"
+            except StreamInterrupted as e:
+                print(f"\n{provider} stream broke mid-way ({e}) -> keeping partial output")
+                record("partial")
+                return e.partial_text, f"{provider} (partial)"
+            except FutureTimeout:
+                print(f"{provider} exceeded the report deadline")
+                record("timeout")
+                break
             except Exception as e:
-                print("Local LLM failed:", e)
+                print(f"{provider} failed:", e)
+                record("failed")
+    finally:
+        # never wait on a provider call that overran the deadline
+        if writer is not None:
+            writer.abandon()
+        executor.shutdown(wait=False)
+
+    return None, None
+
+
+def generate_underwriting_report(
+    metrics,
+    merged_df,
+    output_path="output/underwriting_report.txt",
+    deadline_seconds: float = REPORT_DEADLINE_SECONDS,
+    cache_dir: str = None,
+    stream: bool = True,
+    evidence: list = None
+):
+
+    print("\n=== GENERATING UNDERWRITING REPORT ===")
+
+    output_dir = os.path.dirname(output_path) or "."
+    cache_dir = cache_dir or os.path.join(output_dir, ".report_cache")
+    os.makedirs(output_dir, exist_ok=True)
+
+    started = time.monotonic()
+    deadline = started + deadline_seconds
+
+    prompt = build_prompt(metrics, merged_df, evidence=evidence)
+    cache_key = prompt_cache_key(prompt)
+
+    latency = {}
+    report_text, provider_used = None, None
+    writer = StreamingReportWriter(output_path) if stream else None
+
+    # 0️⃣ Same prompt as a previous run -> reuse the stored report
+    cached = read_cached_report(cache_dir, cache_key)
+    if cached:
+        print("Using cached report for unchanged portfolio metrics")
+        report_text = cached["report"]
+        provider_used = f"{cached['provider']} (cached)"
+        latency["cache"] = {"status": "hit"}
+
+    # 1️⃣ OpenAI / 2️⃣ Local LLM (probed in parallel, bounded by the deadline)
+    if report_text is None:
+        report_text, provider_used = generate_with_deadline(prompt, deadline, latency, writer)
+        if writer is not None:
+            writer.close()
+
+        if provider_used is not None and provider_used.endswith("(partial)"):
+            # keep what arrived, but never cache an incomplete report
+            report_text = report_text.rstrip() + "\n\n[Report incomplete: the provider stream was interrupted]"
+        elif provider_used is not None and provider_used.endswith("(truncated)"):
+            report_text = report_text.rstrip() + "\n\n[Report truncated: the report deadline passed mid-stream]"
+        elif report_text is not None:
+            write_cached_report(cache_dir, cache_key, report_text, provider_used)
 
     # 3️⃣ Deterministic fallback
     if report_text is None:
@@ -214,11 +602,22 @@ def generate_underwriting_report(metrics, merged_df, output_path="output/underwr
         report_text = rule_based_report(metrics)
         provider_used = "Rule-based fallback"
 
-    os.makedirs("output", exist_ok=True)
+    total_seconds = round(time.monotonic() - started, 3)
+
     with open(output_path, "w", encoding="utf-8") as f:
         f.write(report_text)
 
+    latency_path = os.path.join(output_dir, "report_latency.json")
+    with open(latency_path, "w") as f:
+        json.dump({"provider_used": provider_used, "total_seconds": total_seconds, "providers": latency}, f, indent=2)
+
     print("\n=== UNDERWRITING REPORT GENERATED ===\n")
-    print(report_text)
+
+    # a streamed report is already on the console
+    streamed = writer is not None and writer.tokens > 0 and provider_used in PROVIDER_CALLS
+    if streamed:
+        print(f"Report saved {output_path}")
+    else:
+        print(report_text)
 
     return report_text, provider_used
@@ -0,0 +1,176 @@
+import os
+import re
+import csv
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from model.portfolio_aggregation import PortfolioAccumulator, segment_labels, with_segment_columns
+from reporting.generate_report import (
+    PROVIDER_CALLS,
+    TOP_RISKY_COUNT,
+    build_prompt,
+    rule_based_report,
+    probe_providers,
+    prompt_cache_key,
+    read_cached_report,
+    write_cached_report
+)
+
+
+DEFAULT_CONCURRENCY = 4
+SEGMENT_TIMEOUT_SECONDS = 60
+PROBE_DEADLINE_SECONDS = 15
+
+
+# ======================================================
+# SEGMENT SELECTION
+# ======================================================
+def segment_top_risky(merged_df: pd.DataFrame, segment_col: str, k: int = TOP_RISKY_COUNT) -> dict:
+    """
+    Top-k merchants per segment via a grouped nlargest (partial selection),
+    instead of sorting the whole portfolio once per segment.
+    """
+
+    # same labels as segment_metrics(), so lookups by segment always line up
+    keys = segment_labels(merged_df[segment_col])
+    top_index = merged_df["risk_probability"].groupby(keys.to_numpy()).nlargest(k)
+
+    columns = ["merchant_id", "monthly_volume", "risk_probability", "country"]
+    return {
+        segment: merged_df.loc[rows.index.get_level_values(-1), columns]
+        for segment, rows in top_index.groupby(level=0)
+    }
+
+
+def segment_metrics(merged_df: pd.DataFrame, segment_col: str) -> dict:
+
+    table = PortfolioAccumulator(dimensions=[segment_col]).update(merged_df).segment_metrics()
+
+    return {
+        row["segment"]: {
+            "total_merchants": int(row["total_merchants"]),
+            "high_risk_merchants": int(row["high_risk_merchants"]),
+            "high_risk_ratio": float(row["high_risk_ratio"]),
+            "high_risk_volume": float(row["high_risk_volume"]),
+            "expected_disputes": float(row["expected_disputes"]),
+            "avg_risk_probability": float(row["avg_risk_probability"])
+        }
+        for _, row in table.iterrows()
+    }
+
+
+def _slug(value) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", str(value)).strip("_").lower() or "unknown"
+
+
+def _file_names(segments) -> dict:
+    """One file name per segment; segments whose slugs collide ("A/B", "A B") get a short hash."""
+
+    slugs = {segment: _slug(segment) for segment in segments}
+    counts = pd.Series(list(slugs.values()), dtype=object).value_counts()
+
+    names = {}
+    for segment, slug in slugs.items():
+        if counts[slug] > 1:
+            slug = f"{slug}_{hashlib.sha1(str(segment).encode()).hexdigest()[:8]}"
+        names[segment] = f"{slug}.txt"
+    return names
+
+
+# ======================================================
+# SINGLE SEGMENT NOTE
+# ======================================================
+def _generate_segment_note(provider, prompt, metrics, cache_dir, timeout):
+
+    start = time.monotonic()
+    cache_key = prompt_cache_key(prompt)
+
+    cached = read_cached_report(cache_dir, cache_key)
+    if cached:
+        return cached["report"], f"{cached['provider']} (cached)", time.monotonic() - start
+
+    if provider is not None:
+        try:
+            text = PROVIDER_CALLS[provider](prompt, timeout)
+            write_cached_report(cache_dir, cache_key, text, provider)
+            return text, provider, time.monotonic() - start
+        except Exception as e:
+            print(f"{provider} failed or timed out for segment -> rule-based fallback ({e})")
+
+    return rule_based_report(metrics), "Rule-based fallback", time.monotonic() - start
+
+
+# ======================================================
+# BATCH SEGMENT REPORTS
+# ======================================================
+def generate_segment_reports(
+    merged_df: pd.DataFrame,
+    segment_col: str,
+    output_dir: str,
+    top_k: int = TOP_RISKY_COUNT,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    segment_timeout: float = SEGMENT_TIMEOUT_SECONDS
+) -> str:
+    """
+    One underwriting note per segment of `segment_col`, generated with at
+    most `max_concurrency` LLM calls in flight. Notes are written to
+    <output_dir>/segment_reports/<segment_col>/ as they finish, with an
+    index.csv listing provider and latency per segment.
+    """
+
+    merged_df = with_segment_columns(merged_df)
+    if segment_col not in merged_df.columns:
+        raise ValueError(f"Unknown segment column: {segment_col}")
+
+    reports_dir = os.path.join(output_dir, "segment_reports", segment_col)
+    cache_dir = os.path.join(output_dir, ".report_cache")
+    os.makedirs(reports_dir, exist_ok=True)
+
+    metrics_by_segment = segment_metrics(merged_df, segment_col)
+    top_by_segment = segment_top_risky(merged_df, segment_col, top_k)
+    file_names = _file_names(metrics_by_segment)
+
+    # one provider decision for the whole batch
+    latency = {}
+    available = probe_providers(time.monotonic() + PROBE_DEADLINE_SECONDS, latency)
+    provider = next((name for name in PROVIDER_CALLS if available.get(name)), None)
+    print(f"Generating {len(metrics_by_segment)} {segment_col} notes with {provider or 'rule-based fallback'} "
+          f"(concurrency={max_concurrency})")
+
+    index_path = os.path.join(reports_dir, "index.csv")
+
+    with open(index_path, "w", newline="") as index_file, \
+            ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+
+        index = csv.writer(index_file)
+        index.writerow(["segment", "provider", "seconds", "path"])
+
+        futures = {}
+        for segment, metrics in metrics_by_segment.items():
+            prompt = build_prompt(
+                metrics,
+                merged_df,
+                top_risky=top_by_segment.get(segment),
+                scope=f"{segment_col.upper()} SEGMENT: {segment}"
+            )
+            future = executor.submit(_generate_segment_note, provider, prompt, metrics, cache_dir, segment_timeout)
+            futures[future] = segment
+
+        # stream each note to disk as soon as it is ready
+        for future in as_completed(futures):
+            segment = futures[future]
+            text, used, seconds = future.result()
+
+            path = os.path.join(reports_dir, file_names[segment])
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+            index.writerow([segment, used, round(seconds, 3), path])
+            index_file.flush()
+            print(f"  {segment_col}={segment} -> {used} ({seconds:.1f}s)")
+
+    print(f"Segment reports saved {reports_dir}")
+    return reports_dir
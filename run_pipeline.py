@@ -1,12 +1,26 @@
 import argparse
 import os
 
-from features.build_features_pipeline import run_pipeline
-from model.train_risk_model import train_model, load_model, predict_risk
+from features.build_features_pipeline import run_pipeline, ENRICH_QUEUE_DEPTH, ENRICH_BATCH_SIZE
+from model.train_risk_model import train_model, load_model, predict_risk, DEFAULT_TARGET_RECALL
+from model.incremental_training import train_model_incremental, DEFAULT_CHUNKSIZE
+from model.explain import DEFAULT_TOP_K
+from model.shadow_scoring import run_shadow_scoring
 from model.portfolio_risk import generate_portfolio_risk
-from reporting.generate_report import generate_underwriting_report
+from model.portfolio_simulation import run_portfolio_simulation, DEFAULT_SHOCK_SIGMA, DEFAULT_SEED
+from reporting.generate_report import generate_underwriting_report, top_risky_merchants
+from ingestion.document_index import DocumentIndex, INDEX_PATH
+from reporting.segment_reports import generate_segment_reports, DEFAULT_CONCURRENCY
 from common.pipeline_summary import print_and_log_summary
 from common.logger_config import setup_logger_run
+from common import instrumentation
+from common.instrumentation import stage
+from common.dtype_policy import compact_frame, log_frame_memory
+from common.profiling import PROFILE_MODES, start_profiling
+from pipeline_daemon import PipelineDaemon, POLL_SECONDS, CONTROL_PORT
+from batch_pipeline import run_batch, DEFAULT_CONCURRENCY as DEFAULT_BATCH_CONCURRENCY
+from sharded_pipeline import run_sharded, run_shard, SHARD_WAIT_SECONDS
+from ingestion.service_bootstrap import ensure_internal_api_running
 
 import sys
 from pathlib import Path
@@ -32,6 +46,207 @@ def main():
     parser.add_argument("--train", action="store_true", help="Train the model")
     parser.add_argument("--predict", action="store_true", help="Run prediction using trained model")
 
+    # ------------------------------
+    # training options
+    # ------------------------------
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=-1,
+        help="Worker processes for CV folds and learning curve (-1 = all cores)"
+    )
+
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help="Run a hyperparameter search over regularization and class weighting"
+    )
+
+    parser.add_argument(
+        "--learning-curve",
+        choices=["run", "cache", "skip"],
+        default="cache",
+        help="Recompute, reuse cached, or skip the learning curve"
+    )
+
+    parser.add_argument(
+        "--target-recall",
+        type=float,
+        default=DEFAULT_TARGET_RECALL,
+        help="Recall target used to pick the operating threshold on the validation split"
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Out-of-core training: stream feature chunks and fit with partial_fit"
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=DEFAULT_CHUNKSIZE,
+        help="Rows per chunk for out-of-core training"
+    )
+
+    parser.add_argument(
+        "--explain",
+        type=int,
+        default=DEFAULT_TOP_K,
+        help="Top-k per-merchant risk drivers written to merchant_predictions (0 = off)"
+    )
+
+    parser.add_argument(
+        "--challengers",
+        nargs="+",
+        default=None,
+        help="Shadow-score challenger models (registry versions, files under models/, or 'all')"
+    )
+
+    # ------------------------------
+    # portfolio simulation
+    # ------------------------------
+    parser.add_argument(
+        "--simulate",
+        type=int,
+        default=0,
+        help="Monte Carlo scenarios for disputed-volume VaR / expected shortfall (0 = off)"
+    )
+
+    parser.add_argument(
+        "--shock-sigma",
+        type=float,
+        default=DEFAULT_SHOCK_SIGMA,
+        help="Std-dev of the per-scenario region shock in logit space"
+    )
+
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Simulation seed")
+
+    # ------------------------------
+    # reporting
+    # ------------------------------
+    parser.add_argument(
+        "--segment-reports",
+        nargs="+",
+        default=None,
+        help="Also write one underwriting note per segment of these columns (e.g. region country)"
+    )
+
+    parser.add_argument(
+        "--report-concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximum concurrent LLM calls for segment reports"
+    )
+
+    # ------------------------------
+    # observability
+    # ------------------------------
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Record per-stage wall/CPU/RSS/rows and outbound call timings (trace JSON + Prometheus textfile)"
+    )
+
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        default=None,
+        help="Per-stage cProfile and/or tracemalloc snapshots into output/profile_<timestamp>/"
+    )
+
+    parser.add_argument(
+        "--flamegraph",
+        action="store_true",
+        help="With --profile, also record a py-spy flame graph of the whole run"
+    )
+
+    # ------------------------------
+    # streaming enrichment
+    # ------------------------------
+    parser.add_argument(
+        "--enrich-queue-depth",
+        type=int,
+        default=ENRICH_QUEUE_DEPTH,
+        help="Merchants fetched ahead of enrichment before internal API fetching pauses"
+    )
+
+    parser.add_argument(
+        "--enrich-batch-size",
+        type=int,
+        default=ENRICH_BATCH_SIZE,
+        help="Merchants per enriched / feature batch written while fetching continues"
+    )
+
+    # ------------------------------
+    # long-running mode
+    # ------------------------------
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep a warm process that scores new files / appended rows in --watch-dir"
+    )
+
+    parser.add_argument("--watch-dir", type=str, default="incoming", help="Folder watched in --serve mode")
+
+    parser.add_argument("--poll-interval", type=float, default=POLL_SECONDS, help="Seconds between watch-folder scans")
+
+    parser.add_argument(
+        "--control-port",
+        type=int,
+        default=CONTROL_PORT,
+        help="Local TCP port for daemon commands (python -m pipeline_daemon status|run|process|report|stop)"
+    )
+
+    # ------------------------------
+    # multi-portfolio batch
+    # ------------------------------
+    parser.add_argument(
+        "--batch",
+        type=str,
+        default=None,
+        metavar="MANIFEST",
+        help="Score every portfolio of a manifest (.csv/.json with input,output[,name]) in one process"
+    )
+
+    parser.add_argument(
+        "--batch-concurrency",
+        type=int,
+        default=DEFAULT_BATCH_CONCURRENCY,
+        help="Portfolios scored at the same time in --batch mode"
+    )
+
+    # ------------------------------
+    # sharded execution
+    # ------------------------------
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="Split the per-merchant stages into N crc32(merchant_id) shards run in separate processes"
+    )
+
+    parser.add_argument(
+        "--shard-workers",
+        type=int,
+        default=None,
+        help="Local processes for --shards (default: min(shards, CPUs)); 0 waits for shards run elsewhere"
+    )
+
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=None,
+        help="Run only this shard of a coordinator's --shards run in the shared --output folder"
+    )
+
+    parser.add_argument(
+        "--run-id",
+        type=str,
+        default=None,
+        help="With --shard-index: only process the coordinator run with this id (logged by the coordinator)"
+    )
+
     # ------------------------------
     # paths
     # ------------------------------
@@ -42,6 +257,13 @@ def main():
         help="Path to merchant CSV"
     )
 
+    parser.add_argument(
+        "--documents",
+        type=str,
+        default=None,
+        help="Directory or manifest (.csv/.json with merchant_id,path) of merchant PDFs to extract"
+    )
+
     parser.add_argument(
         "--output",
         type=str,
@@ -51,82 +273,209 @@ def main():
 
     args = parser.parse_args()
 
-    if not args.train and not args.predict:
-        parser.error("Specify at least one mode: --train or --predict")
-
-    input_path = args.input
-    output_dir = args.output
-
-    os.makedirs(output_dir, exist_ok=True)
-
-    # --------------------------------------------------
-    # BUILD DATASET STEP
-    # --------------------------------------------------
-    log_step(1, TOTAL_STEPS, "Building enriched merchant dataset with features")
-    logger.info("\n=== Building dataset ===")
-    final_df, features_df = run_pipeline(input_path, output_dir)
-
-    features_path = os.path.join(output_dir, "underwriting_features.csv")
-    predictions_path = os.path.join(output_dir, "merchant_predictions.csv")
-
-    # ------------------------------------------------------
-    # MODEL STEP
-    # ------------------------------------------------------
-    log_step(2, TOTAL_STEPS, "Model training and prediction")
-    logger.info("\n=== MODEL STEP ===")
-
-    if args.train:
-        logger.info("Training model...")
-        train_model(features_path)   # only trains & saves model
-
-        logger.info("Loading freshly trained model...")
-        model = load_model()
-
-    elif args.predict:
-        logger.info("Loading existing model...")
-        model = load_model()
-
-    else:
-        logger.warning("No --train or --predict flag provided. Exiting.")
+    if args.serve:
+        PipelineDaemon(
+            args.watch_dir,
+            args.output,
+            poll_seconds=args.poll_interval,
+            control_port=args.control_port,
+            explain_top_k=args.explain
+        ).serve_forever()
         return
 
+    if not args.train and not args.predict:
+        parser.error("Specify at least one mode: --train, --predict or --serve")
 
-    # ------------------------------------------------------
-    # PREDICTION STEP (COMMON PATH)
-    # ------------------------------------------------------
-    log_step(3, TOTAL_STEPS, "Generating predictions with the model")
-    logger.info("\n=== PREDICTION STEP ===")
+    if args.batch:
+        if args.train:
+            parser.error("--batch scores with the existing model; train separately first")
 
-    scored_df = predict_risk(model, features_df)
+        if args.trace:
+            instrumentation.enable()
 
-    predictions_path = os.path.join(output_dir, "merchant_predictions.csv")
-    scored_df.to_csv(predictions_path, index=False)
-    logger.info(f"Predictions saved {predictions_path}")
+        run_batch(args.batch, args.output, max_concurrency=args.batch_concurrency, explain_top_k=args.explain)
 
+        if args.trace:
+            trace_path, prom_path = instrumentation.write_trace(args.output)
+            logger.info(f"Run trace saved {trace_path} (Prometheus textfile {prom_path})")
+        return
 
-    # ------------------------------------------------------
-    # PORTFOLIO RISK STEP
-    # ------------------------------------------------------
-    log_step(4, TOTAL_STEPS, "Generating portfolio risk metrics and dataset")
-    logger.info("\n=== PORTFOLIO RISK ANALYSIS ===")
+    if args.shard_index is not None:
+        if not args.shards:
+            parser.error("--shard-index needs --shards")
 
-    metrics, merged_df = generate_portfolio_risk(final_df, scored_df, logger)
+        # worker for a coordinator started with --shard-workers 0 (possibly on another machine)
+        ensure_internal_api_running()
+        run_shard(args.output, args.shard_index, args.shards, explain_top_k=args.explain, wait_seconds=SHARD_WAIT_SECONDS,
+                  run_id=args.run_id)
+        return
 
-    merged_path = os.path.join(output_dir, "portfolio_view.csv")
-    merged_df.to_csv(merged_path, index=False)
-    logger.info(f"Portfolio dataset saved {merged_path}")
+    if args.shards and args.train:
+        parser.error("--shards scores with the existing model; train separately first")
 
-    # ------------------------------------------------------
-    # LLM UNDERWRITING REPORT
-    # ------------------------------------------------------
-    log_step(5, TOTAL_STEPS, "Generating underwriting report with LLM")
-    logger.info("\n=== GENERATING UNDERWRITING REPORT ===")
+    input_path = args.input
+    output_dir = args.output
 
-    report_path = os.path.join(output_dir, "underwriting_report.txt")
-    report_text, provider = generate_underwriting_report(metrics, merged_df, report_path)
-    print_and_log_summary(metrics, provider, output_dir, logger)
+    os.makedirs(output_dir, exist_ok=True)
 
-    logger.info(f"Underwriting report saved -> {report_path}")
+    if args.trace:
+        instrumentation.enable()
+
+    profiler = start_profiling(args.profile, output_dir, args.flamegraph) if args.profile else None
+
+    # stopped on failure too: tracemalloc and py-spy must not outlive the run
+    try:
+        if args.shards:
+            # per-merchant stages in crc32(merchant_id) shards; loading, entity resolution,
+            # portfolio aggregation and reporting stay in this process
+            log_step(1, TOTAL_STEPS, f"Building, scoring and merging the dataset in {args.shards} shards")
+            logger.info("\n=== SHARDED RUN ===")
+            with stage("sharded") as s:
+                final_df, features_df, scored_df, merged_df, metrics = run_sharded(
+                    input_path,
+                    output_dir,
+                    args.shards,
+                    workers=args.shard_workers,
+                    documents_source=args.documents,
+                    explain_top_k=args.explain
+                )
+                s.set_rows(len(merged_df))
+        else:
+            # --------------------------------------------------
+            # BUILD DATASET STEP
+            # --------------------------------------------------
+            log_step(1, TOTAL_STEPS, "Building enriched merchant dataset with features")
+            logger.info("\n=== Building dataset ===")
+            with stage("dataset") as s:
+                final_df, features_df = run_pipeline(
+                    input_path,
+                    output_dir,
+                    documents_source=args.documents,
+                    queue_depth=args.enrich_queue_depth,
+                    batch_size=args.enrich_batch_size
+                )
+                s.set_rows(len(final_df))
+
+            features_path = os.path.join(output_dir, "underwriting_features.csv")
+            predictions_path = os.path.join(output_dir, "merchant_predictions.csv")
+
+            # ------------------------------------------------------
+            # MODEL STEP
+            # ------------------------------------------------------
+            log_step(2, TOTAL_STEPS, "Model training and prediction")
+            logger.info("\n=== MODEL STEP ===")
+
+            with stage("model"):
+                if args.train and args.incremental:
+                    logger.info("Training model out-of-core...")
+                    train_model_incremental(features_path, chunksize=args.chunksize)
+
+                    logger.info("Loading freshly trained model...")
+                    model = load_model()
+
+                elif args.train:
+                    logger.info("Training model...")
+                    train_model(
+                        features_path,
+                        n_jobs=args.n_jobs,
+                        search=args.search,
+                        learning_curve_mode=args.learning_curve,
+                        target_recall=args.target_recall
+                    )   # only trains & saves model
+
+                    logger.info("Loading freshly trained model...")
+                    model = load_model()
+
+                elif args.predict:
+                    logger.info("Loading existing model...")
+                    model = load_model()
+
+                else:
+                    logger.warning("No --train or --predict flag provided. Exiting.")
+                    return
+
+
+            # ------------------------------------------------------
+            # PREDICTION STEP (COMMON PATH)
+            # ------------------------------------------------------
+            log_step(3, TOTAL_STEPS, "Generating predictions with the model")
+            logger.info("\n=== PREDICTION STEP ===")
+
+            with stage("predict") as s:
+                scored_df = compact_frame(predict_risk(model, features_df, explain_top_k=args.explain))
+                s.set_rows(len(scored_df))
+                log_frame_memory(logger, "Scored frame", scored_df, s)
+
+                predictions_path = os.path.join(output_dir, "merchant_predictions.csv")
+                scored_df.to_csv(predictions_path, index=False)
+                logger.info(f"Predictions saved {predictions_path}")
+
+
+            # ------------------------------------------------------
+            # PORTFOLIO RISK STEP
+            # ------------------------------------------------------
+            log_step(4, TOTAL_STEPS, "Generating portfolio risk metrics and dataset")
+            logger.info("\n=== PORTFOLIO RISK ANALYSIS ===")
+
+            with stage("portfolio") as s:
+                metrics, merged_df = generate_portfolio_risk(final_df, scored_df, logger, output_dir)
+                merged_df = compact_frame(merged_df)
+                s.set_rows(len(merged_df))
+                log_frame_memory(logger, "Portfolio frame", merged_df, s)
+
+                merged_path = os.path.join(output_dir, "portfolio_view.csv")
+                merged_df.to_csv(merged_path, index=False)
+                logger.info(f"Portfolio dataset saved {merged_path}")
+
+        if args.challengers:
+            logger.info("Shadow scoring challenger models...")
+            with stage("shadow_scoring", rows=len(scored_df)):
+                run_shadow_scoring(scored_df, args.challengers, output_dir, logger)
+
+        if args.simulate:
+            logger.info(f"Simulating {args.simulate} portfolio loss scenarios...")
+            with stage("simulation", rows=args.simulate):
+                run_portfolio_simulation(
+                    merged_df,
+                    output_dir,
+                    logger,
+                    n_scenarios=args.simulate,
+                    shock_sigma=args.shock_sigma,
+                    seed=args.seed
+                )
+
+        # ------------------------------------------------------
+        # LLM UNDERWRITING REPORT
+        # ------------------------------------------------------
+        log_step(5, TOTAL_STEPS, "Generating underwriting report with LLM")
+        logger.info("\n=== GENERATING UNDERWRITING REPORT ===")
+
+        report_path = os.path.join(output_dir, "underwriting_report.txt")
+        # passages from the merchants' own documents, looked up in the full-text index
+        evidence = None
+        if args.documents:
+            with DocumentIndex(os.path.join(output_dir, INDEX_PATH)) as index:
+                evidence = index.evidence(top_risky_merchants(merged_df)["merchant_id"])
+            logger.info(f"Pulled {len(evidence)} document passages as report evidence")
+
+        with stage("report"):
+            report_text, provider = generate_underwriting_report(metrics, merged_df, report_path, evidence=evidence)
+            logger.info(f"Underwriting report saved -> {report_path}")
+
+        for segment_col in args.segment_reports or []:
+            logger.info(f"Generating segment reports by {segment_col}...")
+            with stage(f"segment_reports.{segment_col}"):
+                generate_segment_reports(merged_df, segment_col, output_dir, max_concurrency=args.report_concurrency)
+
+        print_and_log_summary(metrics, provider, output_dir, logger)
+
+        if args.trace:
+            trace_path, prom_path = instrumentation.write_trace(output_dir)
+            logger.info(f"Run trace saved {trace_path} (Prometheus textfile {prom_path})")
+    finally:
+        if profiler is not None:
+            summary_path = profiler.stop()
+            logger.info(f"Profile saved {profiler.output_dir} (summary {summary_path})")
 
 
 if __name__ == "__main__":
@@ -146,5 +495,11 @@ if __name__ == "__main__":
 # Custom output folder
 # python run_pipeline.py --predict --output results/
 
+# Several portfolios in one process
+# python run_pipeline.py --predict --batch partners.csv --output output/batch
+
+# Per-merchant stages across 8 processes
+# python run_pipeline.py --predict --shards 8
+
 # Everything
 # python run_pipeline.py --train --input data/dev.csv --output artifacts/
\ No newline at end of file
@@ -0,0 +1,445 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import shutil
+import socket
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+from features.build_features_pipeline import (
+    fetch_all_country_metadata,
+    fetch_all_internal_risk,
+    enrich_merchants,
+    load_merchants,
+    start_document_extraction,
+    finish_document_extraction,
+    scrape_site
+)
+from features.underwriting_features import build_underwriting_features
+from ingestion.service_bootstrap import ensure_internal_api_running
+from model.train_risk_model import load_model, predict_risk
+from model.portfolio_risk import merge_predictions, compute_segment_metrics, print_portfolio_summary
+from common.instrumentation import stage
+from common.dtype_policy import compact_frame, log_frame_memory
+from common.logger_config import configure_logger
+
+
+logger = configure_logger("sharded_pipeline")
+
+
+SHARDS_DIR = "shards"
+MANIFEST_FILE = "shards.json"
+DONE_FILE = "done.json"
+
+# how long a remote worker waits for its input / the coordinator waits for remote shards
+SHARD_WAIT_SECONDS = 3600
+WAIT_POLL_SECONDS = 2.0
+
+# per-merchant outputs written by every shard and concatenated by the coordinator
+SHARD_OUTPUTS = {
+    "enriched": "enriched_merchants.csv",
+    "features": "underwriting_features.csv",
+    "predictions": "merchant_predictions.csv",
+    "portfolio": "portfolio_view.csv"
+}
+
+# read back as text so identifiers keep their leading zeros
+READ_DTYPES = {"merchant_id": str, "entity_id": str, "registration_number": str}
+
+
+def _read_shard_csv(path: str) -> pd.DataFrame:
+    # round_trip: floats come back bit-identical, so merged outputs equal a single-process run
+    return pd.read_csv(path, dtype=READ_DTYPES, float_precision="round_trip")
+
+
+# ------------------------------------------------------
+# Partitioning
+# ------------------------------------------------------
+def shard_of(merchant_ids, n_shards: int) -> np.ndarray:
+    """crc32(merchant_id) mod n: stable across processes, machines and Python versions."""
+
+    hashes = np.fromiter(
+        (zlib.crc32(str(mid).encode("utf-8")) for mid in merchant_ids),
+        dtype=np.uint32,
+        count=len(merchant_ids)
+    )
+    return (hashes % n_shards).astype(np.int64)
+
+
+def shard_dir(output_dir: str, index: int, n_shards: int) -> str:
+    return os.path.join(output_dir, SHARDS_DIR, f"shard-{index:03d}-of-{n_shards:03d}")
+
+
+def _write_json(path: str, payload: dict):
+    # written under a temporary name and renamed, so readers on a shared folder never see half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(output_dir: str, index: int, n_shards: int, run_id: str = None):
+    """
+    The prepared run this shard worker should process, or None while there
+    is none yet.
+
+    With a run_id only that run's manifest is accepted. Without one, a
+    manifest whose shard already has its done marker is left over from an
+    earlier run (finished or abandoned) and is ignored too.
+    """
+
+    try:
+        with open(os.path.join(output_dir, SHARDS_DIR, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        # not prepared yet, or being cleared by a coordinator starting over
+        return None
+
+    if run_id is not None:
+        return manifest if manifest["run_id"] == run_id else None
+
+    try:
+        with open(os.path.join(shard_dir(output_dir, index, n_shards), DONE_FILE)) as f:
+            done = json.load(f)
+    except FileNotFoundError:
+        return manifest
+
+    return None if done["run_id"] == manifest["run_id"] else manifest
+
+
+def clear_shards(output_dir: str):
+    """Remove an earlier run's shards before workers can mistake its manifest for this run's."""
+
+    root = os.path.join(output_dir, SHARDS_DIR)
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+
+
+def prepare_shards(df: pd.DataFrame, output_dir: str, n_shards: int, country_map: dict) -> dict:
+    """
+    Split the resolved merchants into shard inputs under output_dir/shards/.
+
+    The manifest is written last: once it exists every shard input is in
+    place. Outputs of an earlier run are removed first.
+    """
+
+    clear_shards(output_dir)
+
+    root = os.path.join(output_dir, SHARDS_DIR)
+    assignment = shard_of(df["merchant_id"].to_numpy(), n_shards)
+
+    rows = []
+    for index in range(n_shards):
+        folder = shard_dir(output_dir, index, n_shards)
+        os.makedirs(folder)
+        part = df[assignment == index]
+        part.to_csv(os.path.join(folder, "merchants.csv"), index=False)
+        rows.append(len(part))
+
+    manifest = {
+        "run_id": uuid.uuid4().hex,
+        "n_shards": n_shards,
+        "rows": rows,
+        "country_map": country_map,
+        "created_at": time.time()
+    }
+    _write_json(os.path.join(root, MANIFEST_FILE), manifest)
+
+    logger.info(f"Prepared {n_shards} shards under {root} (rows per shard: min {min(rows)}, max {max(rows)})")
+    return manifest
+
+
+# ------------------------------------------------------
+# Shard worker
+# ------------------------------------------------------
+def run_shard(
+    output_dir: str,
+    index: int,
+    n_shards: int,
+    model=None,
+    explain_top_k: int = 0,
+    wait_seconds: float = 0,
+    run_id: str = None
+) -> dict:
+    """
+    Per-merchant stages for one shard: internal risk, enrichment, features,
+    scoring and the portfolio join. Reads the shard input prepared by the
+    coordinator and writes the shard's outputs plus a done marker.
+
+    Waits up to `wait_seconds` for the coordinator's manifest (of `run_id`
+    when given, see _read_manifest).
+    """
+
+    started = time.perf_counter()
+    deadline = time.monotonic() + wait_seconds
+
+    manifest = _read_manifest(output_dir, index, n_shards, run_id)
+    while manifest is None:
+        if time.monotonic() >= deadline:
+            wanted = f"run {run_id}" if run_id else "a new run"
+            raise TimeoutError(f"Timed out after {wait_seconds:.0f}s waiting for the coordinator's shard manifest ({wanted})")
+        time.sleep(WAIT_POLL_SECONDS)
+        manifest = _read_manifest(output_dir, index, n_shards, run_id)
+
+    if manifest["n_shards"] != n_shards or not 0 <= index < n_shards:
+        raise ValueError(f"Shard {index} of {n_shards} does not match the prepared run ({manifest['n_shards']} shards)")
+
+    folder = shard_dir(output_dir, index, n_shards)
+    df = compact_frame(_read_shard_csv(os.path.join(folder, "merchants.csv")))
+
+    if model is None:
+        model = load_model()
+
+    with stage(f"shard.{index}") as s:
+        with requests.Session() as session:
+            internal_map = fetch_all_internal_risk(df["merchant_id"].unique(), session=session)
+
+        enriched = enrich_merchants(df, internal_map, manifest["country_map"])
+
+        frames = {"enriched": enriched}
+        if len(enriched):
+            frames["features"] = compact_frame(build_underwriting_features(enriched))
+            frames["predictions"] = compact_frame(predict_risk(model, frames["features"], explain_top_k=explain_top_k))
+            frames["portfolio"] = compact_frame(merge_predictions(enriched, frames["predictions"]))
+
+        for key, name in SHARD_OUTPUTS.items():
+            if key in frames:
+                frames[key].to_csv(os.path.join(folder, name), index=False)
+
+        s.set_rows(len(enriched))
+
+    done = {
+        "run_id": manifest["run_id"],
+        "index": index,
+        "rows": len(df),
+        "scored": len(enriched),
+        "seconds": round(time.perf_counter() - started, 3),
+        "host": socket.gethostname(),
+        "pid": os.getpid()
+    }
+    _write_json(os.path.join(folder, DONE_FILE), done)
+
+    logger.info(f"Shard {index}/{n_shards}: {done['scored']} of {done['rows']} merchants scored in {done['seconds']:.1f}s")
+    return done
+
+
+_worker_model = None
+_worker_explain_top_k = 0
+
+
+def _init_worker(explain_top_k):
+    # one model load per worker process, however many shards it runs
+    global _worker_model, _worker_explain_top_k
+    _worker_model = load_model()
+    _worker_explain_top_k = explain_top_k
+
+
+def _run_shard_task(output_dir: str, index: int, n_shards: int, run_id: str) -> dict:
+    return run_shard(output_dir, index, n_shards, model=_worker_model, explain_top_k=_worker_explain_top_k, run_id=run_id)
+
+
+def run_local_shards(
+    output_dir: str,
+    n_shards: int,
+    workers: int,
+    explain_top_k: int = 0,
+    model=None,
+    run_id: str = None
+) -> list:
+
+    if workers <= 1:
+        model = model if model is not None else load_model()
+        return [
+            run_shard(output_dir, i, n_shards, model=model, explain_top_k=explain_top_k, run_id=run_id)
+            for i in range(n_shards)
+        ]
+
+    with ProcessPoolExecutor(
+        max_workers=min(workers, n_shards),
+        initializer=_init_worker,
+        initargs=(explain_top_k,)
+    ) as executor:
+        futures = [executor.submit(_run_shard_task, output_dir, i, n_shards, run_id) for i in range(n_shards)]
+        return [future.result() for future in futures]
+
+
+def wait_for_shards(output_dir: str, manifest: dict, timeout: float = SHARD_WAIT_SECONDS) -> list:
+    """Block until every shard of this run has written its done marker (shards run elsewhere)."""
+
+    n_shards = manifest["n_shards"]
+    deadline = time.monotonic() + timeout
+    logger.info(
+        f"Waiting for {n_shards} shards: python run_pipeline.py --predict --shards {n_shards} --shard-index K "
+        f"--run-id {manifest['run_id']} --output {output_dir}"
+    )
+
+    while True:
+        done, missing = [], []
+        for index in range(n_shards):
+            path = os.path.join(shard_dir(output_dir, index, n_shards), DONE_FILE)
+            marker = None
+            if os.path.exists(path):
+                with open(path) as f:
+                    marker = json.load(f)
+            if marker is not None and marker["run_id"] == manifest["run_id"]:
+                done.append(marker)
+            else:
+                missing.append(index)
+
+        if not missing:
+            return done
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Shards {missing} did not finish within {timeout:.0f}s")
+        time.sleep(WAIT_POLL_SECONDS)
+
+
+# ------------------------------------------------------
+# Merge
+# ------------------------------------------------------
+def merge_shards(df: pd.DataFrame, output_dir: str, n_shards: int) -> dict:
+    """
+    Concatenate the shard outputs into the usual top-level files.
+
+    Rows are put back in input order (by each merchant_id's first position
+    in the validated dataset), so the result does not depend on the shard
+    count or on which shard finished first.
+    """
+
+    position = pd.Series(np.arange(len(df)), index=df["merchant_id"].astype(str).to_numpy())
+    position = position[~position.index.duplicated()]
+
+    frames = {}
+    for key, name in SHARD_OUTPUTS.items():
+        parts = []
+        for index in range(n_shards):
+            path = os.path.join(shard_dir(output_dir, index, n_shards), name)
+            if os.path.exists(path):
+                parts.append(_read_shard_csv(path))
+
+        if not parts:
+            frames[key] = pd.DataFrame()
+            continue
+
+        merged = pd.concat(parts, ignore_index=True)
+        order = merged["merchant_id"].map(position).to_numpy()
+        merged = compact_frame(merged.iloc[np.argsort(order, kind="stable")].reset_index(drop=True))
+
+        merged.to_csv(os.path.join(output_dir, name), index=False)
+        frames[key] = merged
+
+    logger.info(f"Merged {n_shards} shards: {len(frames['enriched'])} enriched merchants")
+    return frames
+
+
+# ------------------------------------------------------
+# Coordinator
+# ------------------------------------------------------
+def run_sharded(
+    input_path: str,
+    output_dir: str,
+    n_shards: int,
+    workers: int = None,
+    documents_source: str = None,
+    explain_top_k: int = 0,
+    model=None
+):
+    """
+    Full pipeline with the per-merchant stages split into `n_shards`
+    crc32(merchant_id) shards.
+
+    Loading, validation and entity resolution (which compares merchants
+    across shards), the country lookup, PDF/document extraction and the
+    scrape stay here. Shards run in a local process pool of `workers`
+    processes. With workers=0 they are run elsewhere against the same
+    output folder (run_shard / --shard-index) and this call waits for them.
+    Portfolio metrics and segments are computed here on the merged frame.
+    output_dir/shards/ is removed once the shards are merged.
+
+    Returns (final_df, features_df, scored_df, merged_df, metrics).
+    """
+
+    workers = min(n_shards, os.cpu_count() or 1) if workers is None else workers
+    os.makedirs(output_dir, exist_ok=True)
+    clear_shards(output_dir)
+
+    df = load_merchants(input_path, output_dir)
+
+    with stage("internal_api_bootstrap"):
+        ensure_internal_api_running()
+
+    background_executor, pdf_future, documents_future = start_document_extraction(output_dir, documents_source)
+
+    with stage("country_metadata"):
+        country_map = fetch_all_country_metadata(df["country"].dropna().unique())
+
+    manifest = prepare_shards(df, output_dir, n_shards, country_map)
+
+    with stage("shards", rows=len(df)):
+        if workers > 0:
+            results = run_local_shards(output_dir, n_shards, workers, explain_top_k, model, manifest["run_id"])
+        else:
+            results = wait_for_shards(output_dir, manifest)
+
+    slowest = max(results, key=lambda r: r["seconds"])
+    logger.info(f"{n_shards} shards done (slowest: shard {slowest['index']}, {slowest['seconds']:.1f}s)")
+
+    with stage("merge_shards") as s:
+        frames = merge_shards(df, output_dir, n_shards)
+        s.set_rows(len(frames["portfolio"]))
+        log_frame_memory(logger, "Portfolio frame", frames["portfolio"], s)
+
+    # everything is in the top-level files now; also stops late workers picking the run up again
+    clear_shards(output_dir)
+
+    pdf_text = finish_document_extraction(output_dir, pdf_future, documents_future)
+    background_executor.shutdown(wait=False)
+
+    with open(os.path.join(output_dir, "merchant_summary.txt"), "w", encoding="utf-8") as f:
+        f.write(pdf_text)
+
+    scrape_site(output_dir)
+
+    # portfolio-level aggregation only happens here
+    with stage("portfolio", rows=len(frames["portfolio"])):
+        metrics, segments = compute_segment_metrics(frames["portfolio"])
+        print_portfolio_summary(metrics, logger)
+
+        segments_path = os.path.join(output_dir, "portfolio_segments.csv")
+        segments.to_csv(segments_path, index=False)
+        logger.info(f"Portfolio segment rollups saved {segments_path}")
+
+    return frames["enriched"], frames["features"], frames["predictions"], frames["portfolio"], metrics
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Run one shard of a sharded pipeline run")
+    parser.add_argument("--output", required=True, help="Output folder shared with the coordinator")
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--shard-index", type=int, required=True)
+    parser.add_argument("--run-id", default=None, help="Only process this coordinator run (logged by the coordinator)")
+    parser.add_argument("--explain", type=int, default=0)
+
+    args = parser.parse_args()
+
+    ensure_internal_api_running()
+    run_shard(args.output, args.shard_index, args.shards, explain_top_k=args.explain, wait_seconds=SHARD_WAIT_SECONDS,
+              run_id=args.run_id)
+
+
+if __name__ == "__main__":
+    main()
+
+
+# Usage
+# python run_pipeline.py --predict --shards 8
+#
+# across machines sharing /shared/out:
+# python run_pipeline.py --predict --shards 4 --shard-workers 0 --output /shared/out      (coordinator)
+# python run_pipeline.py --predict --shards 4 --shard-index 2 --output /shared/out        (one per shard)
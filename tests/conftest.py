@@ -0,0 +1,322 @@
+import re
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+# ------------------------------------------------------
+# Log files
+# ------------------------------------------------------
+def pytest_configure(config):
+    # pipeline modules create their loggers on import (during collection),
+    # so the redirect has to happen before any fixture runs
+    import common.logger_config as logger_config
+
+    log_dir = tempfile.mkdtemp(prefix="test-logs-")
+    logger_config.LOG_DIR = log_dir
+    config.add_cleanup(lambda: shutil.rmtree(log_dir, ignore_errors=True))
+
+
+# ------------------------------------------------------
+# Local stand-in for the Ollama HTTP API
+# ------------------------------------------------------
+class OllamaStub:
+
+    def __init__(self, response_text="Stub underwriting note.", delay=0.0, token_delay=0.0, break_after=None):
+        self.response_text = response_text
+        self.delay = delay
+        # streaming: pause between tokens, and drop the connection after N tokens
+        self.token_delay = token_delay
+        self.break_after = break_after
+        self.generate_calls = 0
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json({"models": [{"name": "llama3"}]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+
+                stub.generate_calls += 1
+                time.sleep(stub.delay)
+
+                if request.get("stream", True):
+                    self._send_stream()
+                else:
+                    self._send_json({"response": stub.response_text, "done": True})
+
+            def _send_stream(self):
+                # newline-delimited JSON, one word per chunk; HTTP/1.0 so the
+                # body simply ends when the connection closes
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+
+                tokens = re.findall(r"\S+\s*", stub.response_text)
+                for i, token in enumerate(tokens):
+                    if stub.break_after is not None and i >= stub.break_after:
+                        return
+                    self.wfile.write(json.dumps({"response": token, "done": False}).encode() + b"\n")
+                    self.wfile.flush()
+                    time.sleep(stub.token_delay)
+
+                self.wfile.write(json.dumps({"response": "", "done": True}).encode() + b"\n")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def ollama_stub(monkeypatch):
+    """Points the report generator at a local stub LLM; OpenAI is disabled."""
+
+    import reporting.generate_report as report
+
+    stub = OllamaStub()
+
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(report, "OLLAMA_URL", f"{stub.url}/api/generate")
+    monkeypatch.setattr(report, "OLLAMA_HEALTH", f"{stub.url}/api/tags")
+
+    yield stub
+
+    stub.close()
+
+
+# ------------------------------------------------------
+# Local HTML fixture server (ETag / Last-Modified aware)
+# ------------------------------------------------------
+class HtmlFixtureServer:
+    """
+    Serves `pages` ({path: html}) with ETag and Last-Modified headers and
+    answers conditional requests with 304. Counts full and 304 responses.
+    """
+
+    def __init__(self, pages=None):
+        self.pages = dict(pages or {})
+        self.modified = {}
+        self.requests = []
+        self.full_responses = 0
+        self.not_modified = 0
+
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fixture.requests.append(self.path)
+                page = fixture.pages.get(self.path)
+
+                if page is None:
+                    self.send_error(404)
+                    return
+
+                body = page.encode()
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                last_modified = fixture.modified.setdefault((self.path, etag), formatdate(time.time(), usegmt=True))
+
+                if self.headers.get("If-None-Match") == etag:
+                    fixture.not_modified += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+
+                fixture.full_responses += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def html_server(monkeypatch):
+    """HTML fixture server; the scraper's per-host politeness delay is switched off."""
+
+    import ingestion.claritypay_scraper as scraper
+
+    monkeypatch.setattr(scraper, "REQUEST_DELAY_SECONDS", 0)
+
+    server = HtmlFixtureServer()
+    yield server
+    server.close()
+
+
+# ------------------------------------------------------
+# Report inputs
+# ------------------------------------------------------
+@pytest.fixture
+def report_metrics():
+    return {
+        "total_merchants": 3,
+        "high_risk_merchants": 1,
+        "high_risk_ratio": 0.333,
+        "high_risk_volume": 50000,
+        "expected_disputes": 12.5,
+        "avg_risk_probability": 0.3
+    }
+
+
+@pytest.fixture
+def report_merged():
+    return pd.DataFrame({
+        "merchant_id": ["M1", "M2", "M3"],
+        "monthly_volume": [50000, 20000, 10000],
+        "risk_probability": [0.9, 0.2, 0.1],
+        "country": ["Spain", "France", "Italy"]
+    })
+
+
+# ------------------------------------------------------
+# Model inputs and a fitted model
+# ------------------------------------------------------
+def _feature_frame(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "merchant_id": [f"M{i:05d}" for i in range(n)],
+        "geo_risk": rng.choice(["low", "high"], n),
+        "internal_risk": rng.choice(["low", "medium", "high"], n),
+        "dispute_rate": rng.uniform(0, 0.05, n),
+        "monthly_volume": rng.uniform(1000, 200000, n),
+        "internal_last_30d_volume": rng.uniform(1000, 200000, n),
+        "internal_last_30d_txn_count": rng.integers(50, 4000, n),
+        "internal_avg_ticket_size": rng.uniform(5, 100, n)
+    })
+
+
+@pytest.fixture
+def feature_frame():
+    """Random feature-view rows: feature_frame(n=200, seed=0)."""
+    return _feature_frame
+
+
+@pytest.fixture
+def fitted_model():
+    """Risk model fitted on feature_frame() (high risk: dispute_rate > 0.04)."""
+
+    from model.train_risk_model import build_model, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+    df = _feature_frame()
+    return build_model().fit(df[CATEGORICAL_FEATURES + NUMERIC_FEATURES], df["dispute_rate"] > 0.04)
+
+
+def _scored_frame(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    probability = rng.uniform(0, 1, n)
+
+    return pd.DataFrame({
+        "merchant_id": [f"M{i:04d}" for i in range(n)],
+        "country": rng.choice(["Spain", "Kenya", "Brazil"], n),
+        "region": rng.choice(["Europe", "Africa", "South America", None], n),
+        "internal_risk_flag": rng.choice(["low", "medium", "high"], n),
+        "monthly_volume": rng.integers(1000, 200000, n),
+        "transaction_count": rng.integers(50, 4000, n),
+        "risk_probability": probability,
+        "predicted_high_risk": (probability >= 0.3).astype(int)
+    })
+
+
+@pytest.fixture
+def scored_frame():
+    """Random scored portfolio rows: scored_frame(n=1000, seed=0)."""
+    return _scored_frame
+
+
+# ------------------------------------------------------
+# Internal API / REST Countries stand-ins
+# ------------------------------------------------------
+class LookupStub:
+    """
+    Deterministic fetch_all_internal_risk / fetch_all_country_metadata.
+    Records every batch of lookups; merchant_ids in `unknown` have no
+    internal data.
+    """
+
+    def __init__(self, monkeypatch):
+        self.monkeypatch = monkeypatch
+        self.merchant_ids = []
+        self.countries = []
+        self.unknown = set()
+
+    def install(self, module):
+        self.monkeypatch.setattr(module, "fetch_all_internal_risk", self.internal)
+        if hasattr(module, "fetch_all_country_metadata"):
+            self.monkeypatch.setattr(module, "fetch_all_country_metadata", self.country_metadata)
+        return self
+
+    def looked_up(self) -> list:
+        return [mid for batch in self.merchant_ids for mid in batch]
+
+    def internal(self, merchant_ids, max_workers=10, session=None):
+        self.merchant_ids.append(list(merchant_ids))
+        return {
+            mid: None if mid in self.unknown else {
+                "internal_risk_flag": ["low", "medium", "high"][int(mid[1:]) % 3],
+                "transaction_summary": {"last_30d_volume": 1000.0 * int(mid[1:]), "last_30d_txn_count": 90, "avg_ticket_size": 20.0}
+            }
+            for mid in merchant_ids
+        }
+
+    def country_metadata(self, names, max_workers=5, session=None):
+        self.countries.append(list(names))
+        return {c: {"country_name": c, "region": "Europe", "subregion": "Northern Europe"} for c in names}
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """LookupStub; a test module installs it with lookups.install(module)."""
+    return LookupStub(monkeypatch)
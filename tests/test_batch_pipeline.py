@@ -0,0 +1,84 @@
+import json
+
+import pandas as pd
+import pytest
+
+import batch_pipeline
+from batch_pipeline import run_batch, load_manifest
+
+
+HEADER = "merchant_id,name,country,registration_number,monthly_volume,dispute_count,transaction_count\n"
+
+
+def rows(start, stop, country="United Kingdom"):
+    return "".join(f"M{i:03d},Shop {i},{country},,{1000 * i},1,100\n" for i in range(start, stop))
+
+
+@pytest.fixture
+def lookups(lookups):
+    return lookups.install(batch_pipeline)
+
+
+def write_manifest(tmp_path):
+    (tmp_path / "north.csv").write_text(HEADER + rows(0, 6))
+    (tmp_path / "south.csv").write_text(HEADER + rows(4, 10, country="France"))
+
+    manifest = tmp_path / "partners.json"
+    manifest.write_text(json.dumps([
+        {"input": "north.csv", "output": "out/north"},
+        {"name": "southern", "input": "south.csv", "output": "out/south"},
+        {"input": "missing.csv", "output": "out/missing"}
+    ]))
+    return manifest
+
+
+def test_manifest_paths(tmp_path):
+
+    portfolios = load_manifest(str(write_manifest(tmp_path)))
+
+    assert [p["name"] for p in portfolios] == ["north", "southern", "missing"]
+    assert portfolios[0]["input"] == str(tmp_path / "north.csv")
+    assert portfolios[1]["output"] == str(tmp_path / "out" / "south")
+
+
+def test_batch_shares_lookups_and_summarises(tmp_path, lookups, fitted_model, ollama_stub):
+
+    result = run_batch(str(write_manifest(tmp_path)), str(tmp_path / "summary"), max_concurrency=2,
+                       model=fitted_model, ensure_api=False)
+
+    # one lookup round for all portfolios; M004 and M005 are in both
+    assert len(lookups.merchant_ids) == 1
+    assert sorted(lookups.merchant_ids[0]) == [f"M{i:03d}" for i in range(10)]
+    assert sorted(lookups.countries[0]) == ["France", "United Kingdom"]
+    assert result["lookups"] == {"merchant_ids_requested": 12, "merchant_ids_fetched": 10, "countries_fetched": 2}
+
+    # the bad portfolio is reported, the others still run
+    assert (result["succeeded"], result["failed"]) == (2, 1)
+    summary = pd.read_csv(tmp_path / "summary" / "batch_summary.csv")
+    assert summary["status"].tolist() == ["ok", "ok", "failed"]
+    assert summary["total_merchants"].tolist()[:2] == [6, 6]
+
+    # each portfolio gets the single-run outputs
+    for name in ("north", "south"):
+        folder = tmp_path / "out" / name
+        for output in ("portfolio_view.csv", "merchant_predictions.csv", "portfolio_segments.csv", "underwriting_report.txt"):
+            assert (folder / output).exists()
+
+    # combined metrics are the merge of the portfolios
+    assert result["combined"]["total_merchants"] == 12
+    assert result["combined"]["high_risk_merchants"] == summary["high_risk_merchants"].iloc[:2].sum()
+    assert (tmp_path / "summary" / "batch_segments.csv").exists()
+
+    # resolved frames are only parked on disk while the batch runs
+    assert sorted(p.name for p in (tmp_path / "summary").iterdir()) == [
+        "batch_segments.csv", "batch_summary.csv", "batch_summary.json"
+    ]
+
+
+def test_manifest_rejects_shared_output_folders(tmp_path):
+
+    manifest = tmp_path / "partners.csv"
+    manifest.write_text("input,output\nnorth.csv,out/north\nsouth.csv,out/./north\n")
+
+    with pytest.raises(ValueError, match="output folders"):
+        load_manifest(str(manifest))
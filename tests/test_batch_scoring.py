@@ -0,0 +1,39 @@
+import joblib
+import pandas as pd
+import numpy as np
+from model.batch_scoring import ChunkWriter, score_file
+
+
+def test_batch_scoring_preserves_input_order(tmp_path, feature_frame, fitted_model):
+
+    n = 500
+    df = feature_frame(n)
+
+    model_path = tmp_path / "model.pkl"
+    joblib.dump(fitted_model, model_path)
+
+    df.to_csv(tmp_path / "features.csv", index=False)
+
+    rows = score_file(str(tmp_path / "features.csv"), str(tmp_path / "predictions.csv"),
+                      model_path=str(model_path), chunksize=64, n_workers=2)
+
+    scored = pd.read_csv(tmp_path / "predictions.csv")
+
+    assert rows == n
+    assert scored["merchant_id"].tolist() == df["merchant_id"].tolist()
+    assert {"risk_probability", "predicted_high_risk"} <= set(scored.columns)
+
+
+def test_parquet_chunks_keep_the_first_schema(tmp_path):
+
+    path = str(tmp_path / "predictions.parquet")
+    writer = ChunkWriter(path)
+    writer.write(pd.DataFrame({"merchant_id": ["M1", "M2"], "transaction_count": [10, 20], "note": [None, None]}))
+    writer.write(pd.DataFrame({"merchant_id": ["M3"], "transaction_count": [np.nan], "note": ["manual"]}))
+    writer.close()
+
+    scored = pd.read_parquet(path)
+
+    assert writer.rows == 3
+    assert scored["transaction_count"].tolist()[:2] == [10, 20]
+    assert scored["note"].tolist()[2] == "manual"
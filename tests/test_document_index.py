@@ -0,0 +1,49 @@
+from ingestion.document_index import DocumentIndex, phrase
+from reporting.generate_report import build_prompt
+
+
+def _record(tmp_path, merchant_id, sha, pages, path=None):
+    text_path = tmp_path / f"{sha}.txt"
+    text_path.write_text("\f".join(pages))
+    return {"merchant_id": merchant_id, "sha256": sha, "path": path or f"{merchant_id}.pdf", "text_path": str(text_path)}
+
+
+def test_search_by_keyword_phrase_and_merchant(tmp_path):
+
+    records = [
+        _record(tmp_path, "M1", "a1", ["Monthly statement.", "Chargeback ratio rose to 2%. Refund policy: 30 days."]),
+        _record(tmp_path, "M2", "b2", ["Our policy on refund requests is strict.", "Two chargebacks were reversed."]),
+    ]
+
+    with DocumentIndex(str(tmp_path / "index.sqlite")) as index:
+        assert index.add_documents(records) == 4
+        assert index.add_documents(records) == 0   # already indexed
+
+        hits = index.search("chargeback")
+        assert {(h["merchant_id"], h["page"]) for h in hits} == {("M1", 2), ("M2", 2)}   # porter stemming
+
+        hits = index.search(phrase("refund policy"))
+        assert [(h["merchant_id"], h["page"]) for h in hits] == [("M1", 2)]
+        assert "[Refund policy]" in hits[0]["snippet"]
+
+        assert [h["merchant_id"] for h in index.search("chargeback", merchant_id="M2")] == ["M2"]
+
+        # a changed file at the same path replaces its old pages
+        index.add_documents([_record(tmp_path, "M1", "c3", ["No issues this month."], path="M1.pdf")])
+        assert index.search("chargeback", merchant_id="M1") == []
+        assert index.stats() == {"documents": 2, "merchants": 2, "pages": 3}
+
+
+def test_evidence_feeds_the_prompt(tmp_path, report_metrics, report_merged):
+
+    records = [_record(tmp_path, "M1", "a1", ["Chargeback dispute on page one.", "Fraud alert and chargeback.", "Dispute."])]
+
+    with DocumentIndex(str(tmp_path / "index.sqlite")) as index:
+        index.add_documents(records)
+        evidence = index.evidence(["M1", "M2"], per_merchant=2)
+
+    assert len(evidence) == 2
+    prompt = build_prompt(report_metrics, report_merged, evidence=evidence)
+    assert "DOCUMENT EVIDENCE" in prompt
+    assert "M1 (page" in prompt
+    assert "DOCUMENT EVIDENCE" not in build_prompt(report_metrics, report_merged)
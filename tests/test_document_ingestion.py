@@ -0,0 +1,62 @@
+import csv
+import os
+
+import fitz
+
+from ingestion.document_ingestion import ingest_documents, read_document_pages
+from ingestion.document_index import index_documents
+
+
+def _make_pdf(path, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"{os.path.basename(path)} page {i}")
+    doc.save(path)
+    doc.close()
+
+
+def test_page_ranges_are_reassembled_in_order_and_cached(tmp_path):
+
+    source = tmp_path / "docs"
+    (source / "M002").mkdir(parents=True)
+    _make_pdf(str(source / "M001_statement.pdf"), 7)
+    _make_pdf(str(source / "M002" / "bank.pdf"), 3)
+
+    output = str(tmp_path / "out")
+    records = ingest_documents(str(source), output, n_workers=2, pages_per_task=2)
+
+    by_merchant = {r["merchant_id"]: r for r in records}
+    assert set(by_merchant) == {"M001", "M002"}
+    assert by_merchant["M001"]["pages"] == 7
+    assert not by_merchant["M001"]["cached"]
+
+    pages = read_document_pages(by_merchant["M001"]["text_path"])
+    assert [p.strip() for p in pages] == [f"M001_statement.pdf page {i}" for i in range(7)]
+
+    # unchanged files are not parsed again
+    records = ingest_documents(str(source), output, n_workers=2, pages_per_task=2)
+    assert all(r["cached"] for r in records)
+    assert {r["pages"] for r in records} == {7, 3}
+    assert os.path.exists(os.path.join(output, "documents.csv"))
+
+
+def test_unreadable_documents_are_recorded_and_skipped(tmp_path):
+
+    source = tmp_path / "docs"
+    source.mkdir()
+    _make_pdf(str(source / "M001_statement.pdf"), 3)
+    (source / "M002_scan.pdf").write_bytes(b"not a pdf")
+
+    output = str(tmp_path / "out")
+    records = ingest_documents(str(source), output, n_workers=1)
+
+    by_merchant = {r["merchant_id"]: r for r in records}
+    assert by_merchant["M001"]["pages"] == 3 and not by_merchant["M001"]["error"]
+    assert by_merchant["M002"]["error"] and by_merchant["M002"]["pages"] == 0
+
+    with open(os.path.join(output, "documents.csv")) as f:
+        index = list(csv.DictReader(f))
+    assert [bool(row["error"]) for row in index] == [False, True]
+
+    # the failed document is left out of the full-text index
+    assert os.path.exists(index_documents(output))
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from common.dtype_policy import compact_frame, frame_bytes
+from features.underwriting_features import combine_labels
+
+
+def frame(n=1000):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "merchant_id": [f"M{i:05d}" for i in range(n)],
+        "registration_number": ["09446239" if i % 2 else None for i in range(n)],
+        "country": np.array(["United Kingdom", "France", "Germany"], dtype=object)[rng.integers(0, 3, n)],
+        "monthly_volume": rng.integers(0, 500000, n),
+        "dispute_rate": rng.random(n),
+        "score": np.full(n, 0.5),
+        "big": np.full(n, 2**40),
+    })
+
+
+def test_compact_frame_keeps_values():
+
+    df = frame()
+    before = df.to_csv(index=False)
+    size = frame_bytes(df.astype({"merchant_id": object}))
+
+    compact_frame(df)
+
+    assert isinstance(df["country"].dtype, pd.CategoricalDtype)
+    assert df["monthly_volume"].dtype == np.int32
+    # float64 kept unless float32 represents every value exactly
+    assert df["dispute_rate"].dtype == np.float64
+    assert df["score"].dtype == np.float32
+    assert df["big"].dtype == np.int64
+    assert df["registration_number"].isna().iloc[0]
+    assert frame_bytes(df) < size
+
+    assert df.to_csv(index=False) == before
+
+
+def test_combine_labels_matches_string_join():
+
+    a = pd.Series(["low", "high", "low", None])
+    b = pd.Series(pd.Categorical(["x", "x", "y", "y"]))
+    c = pd.Series(["u", "v", "u", "v"])
+
+    combined = combine_labels(a, b, c)
+
+    assert list(combined[:3]) == ["low_x_u", "high_x_v", "low_y_u"]
+    assert pd.isna(combined[3])
+    assert len(combined.categories) == 3
@@ -0,0 +1,98 @@
+import pandas as pd
+
+from ingestion.entity_resolution import (
+    normalize_name,
+    normalize_registration,
+    resolve_entities,
+    entity_clusters
+)
+
+
+def merchants():
+    return pd.DataFrame({
+        "merchant_id": ["M1", "M2", "M3", "M4", "M5", "M6", "M7", "M8"],
+        "name": [
+            "GreenLeaf Retail Ltd",
+            "Greenleaf Retail Limited",   # same name after normalisation
+            "Green Leaf Retails",         # similar name
+            "GreenLeaf Retail Ltd",       # same name, other country
+            "Acme Ltd",
+            "Acme Limited",               # same name, different registration
+            "Totally Different Shop",
+            "Something Else",             # same registration as M7
+        ],
+        "country": ["United Kingdom"] * 3 + ["France"] + ["United Kingdom"] * 4,
+        "registration_number": [None, None, None, None, "A1", "A2", "09446239", "9446239"],
+    })
+
+
+def test_normalization():
+
+    assert normalize_name("GreenLeaf Retail Ltd.") == "greenleaf retail"
+    assert normalize_name("Café & Co") == "cafe and"
+    assert normalize_registration(" sc-304 267 ") == "SC304267"
+    assert normalize_registration("09446239") == normalize_registration(9446239.0)
+
+
+def test_blocked_resolution():
+
+    resolved = resolve_entities(merchants()).set_index("merchant_id")["entity_id"]
+
+    # exact and similar names within a country
+    assert resolved["M1"] == resolved["M2"] == resolved["M3"] == "M1"
+    # names only match inside the same country
+    assert resolved["M4"] == "M4"
+    # different registration numbers are never merged on name alone
+    assert resolved["M5"] != resolved["M6"]
+    # registration numbers match regardless of formatting
+    assert resolved["M7"] == resolved["M8"] == "M7"
+
+
+def test_entity_clusters():
+
+    clusters = entity_clusters(resolve_entities(merchants()))
+
+    assert list(clusters["merchant_id"]) == ["M1", "M2", "M3", "M7", "M8"]
+    assert list(clusters["cluster_size"]) == [3, 3, 3, 2, 2]
+
+
+def test_unregistered_name_never_bridges_two_registrations():
+
+    df = pd.DataFrame({
+        "merchant_id": ["M1", "M2", "M3", "M4", "M5", "M6", "M7"],
+        "name": ["Acme Ltd", "Acme Limited", "Acme", "Northwind Trading", "Northwind Tradings",
+                 "Northwind Trading Co", "Northwind Tradings Ltd"],
+        "country": ["United Kingdom"] * 7,
+        "registration_number": [None, "A1", "A2", None, None, "B1", "B2"],
+    })
+
+    resolved = resolve_entities(df).set_index("merchant_id")["entity_id"]
+
+    # M1 matches both A1 and A2 by name: all three stay apart
+    assert resolved[["M1", "M2", "M3"]].tolist() == ["M1", "M2", "M3"]
+    # same through a chain of similar unregistered names
+    assert resolved["M6"] != resolved["M7"]
+    assert resolved["M4"] == resolved["M5"] == "M4"
+
+    # a single registration is still joined
+    resolved = resolve_entities(df[df["merchant_id"] != "M3"]).set_index("merchant_id")["entity_id"]
+    assert resolved["M1"] == resolved["M2"] == "M1"
+
+
+def test_inputs_without_anything_to_match_on():
+
+    empty = merchants().iloc[0:0]
+    assert resolve_entities(empty)["entity_id"].tolist() == []
+
+    # names that normalise to "" (no latin letters or digits) and no registration numbers
+    unnamed = pd.DataFrame({
+        "merchant_id": ["M1", "M2"],
+        "name": ["東京商店", "大阪商店"],
+        "country": ["Japan", "Japan"],
+        "registration_number": [None, None],
+    })
+    assert resolve_entities(unnamed)["entity_id"].tolist() == ["M1", "M2"]
+
+    # one registered row, the other unnamed: the key-building paths see empty name blocks
+    unnamed.loc[0, "registration_number"] = "J1"
+    assert resolve_entities(unnamed)["entity_id"].tolist() == ["M1", "M2"]
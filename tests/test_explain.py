@@ -0,0 +1,25 @@
+import numpy as np
+from model.train_risk_model import predict_risk, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+from model.explain import contribution_matrix
+
+
+def test_contributions_add_up_to_logit(fitted_model, feature_frame):
+
+    model, df = fitted_model, feature_frame()
+    X_transformed = model.named_steps["preprocess"].transform(df[CATEGORICAL_FEATURES + NUMERIC_FEATURES])
+
+    groups, contributions = contribution_matrix(model, X_transformed)
+    logit = contributions.sum(axis=1) + model.named_steps["clf"].intercept_[0]
+
+    assert groups == CATEGORICAL_FEATURES + NUMERIC_FEATURES
+    assert np.allclose(1 / (1 + np.exp(-logit)), model.predict_proba(df)[:, 1])
+
+
+def test_predict_risk_writes_top_drivers(fitted_model, feature_frame):
+
+    model, df = fitted_model, feature_frame()
+
+    scored = predict_risk(model, df, explain_top_k=2)
+
+    assert (scored["risk_driver_1_contribution"] >= scored["risk_driver_2_contribution"]).all()
+    assert set(scored["risk_driver_1"]) <= set(CATEGORICAL_FEATURES + NUMERIC_FEATURES)
@@ -1,5 +1,5 @@
 import pandas as pd
-from features.underwriting_features import build_underwriting_features
+from features.underwriting_features import build_underwriting_features, classify_volume, classify_geo_risk
 
 
 def test_dispute_rate_calculation():
@@ -19,3 +19,11 @@ def test_dispute_rate_calculation():
     features = build_underwriting_features(df)
 
     assert features["dispute_rate"].iloc[0] == 0.05
+
+
+def test_risk_classifiers():
+
+    assert list(classify_volume([500, 10000, 99999.5, 100000])) == ["low", "medium", "medium", "high"]
+
+    region = pd.Series(pd.Categorical(["Africa", "Asia", None, "Europe"]))
+    assert list(classify_geo_risk(region)) == ["high", "medium", "low", "low"]
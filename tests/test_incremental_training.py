@@ -0,0 +1,42 @@
+import joblib
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+
+from model.incremental_training import QuantileSketch, train_model_incremental
+from model.train_risk_model import predict_risk, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+
+def test_merged_sketch_matches_exact_quantile():
+
+    values = np.random.default_rng(0).lognormal(size=200_000)
+
+    left, right = QuantileSketch(), QuantileSketch()
+    for chunk in np.array_split(values[:100_000], 10):
+        left.update(chunk)
+    right.update(values[100_000:])
+
+    merged = left.merge(right)
+
+    assert merged.count == len(values)
+    assert abs(merged.quantile(0.8) - np.quantile(values, 0.8)) / np.quantile(values, 0.8) < 0.02
+
+
+def test_incremental_model_scores_like_a_trained_model(tmp_path, feature_frame):
+
+    df = feature_frame(3000)
+    df.to_csv(tmp_path / "features.csv", index=False)
+
+    model = train_model_incremental(str(tmp_path / "features.csv"), chunksize=700, epochs=2,
+                                    model_path=str(tmp_path / "model.pkl"), registry_dir=str(tmp_path / "registry"))
+
+    # numeric columns use the full-dataset statistics from pass 1
+    X = df[CATEGORICAL_FEATURES + NUMERIC_FEATURES]
+    transformed = model.named_steps["preprocess"].transform(X)
+    expected = StandardScaler().fit_transform(df[NUMERIC_FEATURES])
+    assert np.allclose(transformed[:, -len(NUMERIC_FEATURES):], expected)
+
+    scored = predict_risk(joblib.load(tmp_path / "model.pkl"), df.head(50), explain_top_k=2)
+
+    assert scored["risk_probability"].between(0, 1).all()
+    assert set(scored["predicted_high_risk"]) <= {0, 1}
+    assert set(scored["risk_driver_1"]) <= set(CATEGORICAL_FEATURES + NUMERIC_FEATURES)
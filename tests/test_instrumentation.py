@@ -0,0 +1,52 @@
+import json
+import time
+
+from common import instrumentation
+from common.instrumentation import stage, span
+
+
+def test_disabled_spans_record_nothing():
+
+    instrumentation.disable()
+
+    with stage("noop") as s:
+        s.set_rows(10)
+    with span("noop.call"):
+        pass
+
+    assert stage("noop") is span("noop.call")
+
+
+def test_trace_records_nested_stages_and_calls(tmp_path):
+
+    instrumentation.enable(run_id="test")
+    try:
+        with stage("outer") as outer:
+            with stage("inner", rows=1000):
+                time.sleep(0.01)
+            outer.set_rows(5)
+
+        for _ in range(3):
+            with span("api.lookup"):
+                pass
+
+        trace_path, prom_path = instrumentation.write_trace(str(tmp_path))
+        lines = instrumentation.stage_cost_lines()
+    finally:
+        instrumentation.disable()
+
+    trace = json.loads(open(trace_path).read())
+    stages = {r["stage"]: r for r in trace["stages"]}
+
+    assert set(stages) == {"outer", "outer/inner"}
+    assert stages["outer"]["rows"] == 5
+    assert stages["outer/inner"]["wall_seconds"] >= 0.01
+    assert stages["outer/inner"]["rows_per_second"] > 0
+    assert trace["calls"]["api.lookup"]["count"] == 3
+
+    prom = open(prom_path).read()
+    assert 'underwriting_stage_wall_seconds{stage="outer/inner"}' in prom
+    assert 'underwriting_call_count{call="api.lookup"} 3' in prom
+
+    # slowest first: outer includes inner
+    assert lines[2].strip().startswith("outer ")
@@ -0,0 +1,80 @@
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from common.logger_config import configure_logger, flush_loggers, shutdown_loggers, EntityProgress, _listeners
+
+
+def test_json_logs_are_written_through_the_queue(tmp_path):
+
+    log_file = tmp_path / "structured.log"
+    logger = configure_logger("test_structured", log_file=str(log_file), log_format="json", console=False)
+
+    logger.info("scored batch", extra={"rows": 500})
+    flush_loggers()
+
+    record = json.loads(log_file.read_text().splitlines()[0])
+    assert record["message"] == "scored batch"
+    assert record["rows"] == 500
+    assert record["level"] == "INFO"
+
+
+def test_logging_continues_after_flush_and_shutdown(tmp_path):
+
+    log_file = tmp_path / "lifecycle.log"
+    logger = configure_logger("test_lifecycle", log_file=str(log_file), console=False)
+    configure_logger("test_lifecycle_other", log_file=str(tmp_path / "other.log"), console=False)
+
+    logger.info("before flush")
+    flush_loggers()
+    logger.info("after flush")
+    flush_loggers()
+    assert "after flush" in log_file.read_text()
+
+    # only this test's writer: the other loggers keep theirs for the rest of the session
+    shutdown_loggers("test_lifecycle")
+    logger.info("after shutdown")
+    assert "after shutdown" in log_file.read_text()
+    assert "test_lifecycle_other" in _listeners
+
+
+def _log_in_worker(message):
+    logging.getLogger("test_forked").info(message)
+    return message
+
+
+def test_forked_workers_write_their_records(tmp_path):
+
+    log_file = tmp_path / "forked.log"
+    configure_logger("test_forked", log_file=str(log_file), console=False)
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        list(executor.map(_log_in_worker, ["from worker 1", "from worker 2"]))
+
+    text = log_file.read_text()
+    assert "from worker 1" in text and "from worker 2" in text
+
+
+def test_entity_progress_samples_and_summarises():
+
+    logger = logging.getLogger("test_progress")
+    logger.propagate = False
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    progress = EntityProgress(logger, "merchant_id", total=5000, log_first=5, sample_every=1000, max_failures=3)
+    for i in range(5000):
+        progress.success(f"M{i}")
+    for i in range(10):
+        progress.failure(f"X{i}")
+    progress.close()
+
+    messages = [r.getMessage() for r in records]
+
+    assert sum(m.startswith("SUCCESS") for m in messages) == 5 + 5   # first 5, then every 1000th
+    assert sum(m.startswith("FAILED") for m in messages) == 3
+    assert messages[-1].startswith("merchant_id complete: 5010/5000 done, 10 failed")
+    assert records[-1].failed == 10
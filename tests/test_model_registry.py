@@ -0,0 +1,46 @@
+from sklearn.linear_model import LogisticRegression
+from model.model_registry import register_model, promote, rollback, load_version, ModelHandle
+
+
+def _fitted_model(C):
+    return LogisticRegression(C=C).fit([[0.0], [1.0], [2.0], [3.0]], [0, 0, 1, 1])
+
+
+def test_promote_rollback_and_hot_reload(tmp_path):
+
+    registry = str(tmp_path)
+
+    v1 = register_model(_fitted_model(1.0), {"threshold": 0.3}, registry)
+    promote(v1, registry)
+
+    handle = ModelHandle(registry, check_interval=0)
+    assert handle.get().metadata_["threshold"] == 0.3
+
+    v2 = register_model(_fitted_model(0.1), {"threshold": 0.4}, registry)
+    promote(v2, registry)
+    assert handle.get().C == 0.1
+    assert handle.version == v2
+
+    assert rollback(registry) == v1
+    assert handle.get().C == 1.0
+
+
+def test_load_version_memory_maps_arrays(tmp_path):
+
+    registry = str(tmp_path)
+    version = register_model(_fitted_model(1.0), {}, registry)
+
+    model = load_version(version, registry)
+
+    assert type(model.coef_).__name__ == "memmap"
+
+
+def test_next_version_is_numeric_and_skips_other_folders(tmp_path):
+
+    registry = str(tmp_path)
+    for name in ["v9999", "backup", "v0002-old"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "manifest.json").write_text("{}")
+
+    assert register_model(_fitted_model(1.0), {}, registry) == "v10000"
+    assert register_model(_fitted_model(1.0), {}, registry) == "v10001"
@@ -0,0 +1,13 @@
+import pandas as pd
+from model.train_risk_model import search_hyperparameters, C_GRID, CLASS_WEIGHT_GRID
+
+
+def test_hyperparameter_search_returns_grid_point(feature_frame):
+
+    X = feature_frame(60).drop(columns="merchant_id")
+    y = pd.Series((X["dispute_rate"] >= X["dispute_rate"].quantile(0.8)).astype(int))
+
+    params = search_hyperparameters(X, y, n_jobs=1)
+
+    assert params["C"] in C_GRID
+    assert params["class_weight"] in CLASS_WEIGHT_GRID
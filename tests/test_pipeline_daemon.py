@@ -0,0 +1,130 @@
+import json
+import threading
+
+import pandas as pd
+import pytest
+
+import pipeline_daemon
+from pipeline_daemon import PipelineDaemon, send_command
+
+
+HEADER = "merchant_id,name,country,registration_number,monthly_volume,dispute_count,transaction_count\n"
+
+
+def rows(start, stop, disputes=1):
+    return "".join(f"M{i:03d},Shop {i},United Kingdom,,{1000 * i},{disputes},100\n" for i in range(start, stop))
+
+
+@pytest.fixture
+def lookups(lookups):
+    return lookups.install(pipeline_daemon)
+
+
+def daemon(tmp_path, fitted):
+    return PipelineDaemon(str(tmp_path / "incoming"), str(tmp_path / "out"), control_port=0,
+                          model=fitted, ensure_api=False)
+
+
+def test_new_files_and_appended_rows(tmp_path, lookups, fitted_model):
+
+    d = daemon(tmp_path, fitted_model)
+    path = tmp_path / "incoming" / "batch.csv"
+    path.write_text(HEADER + rows(0, 5))
+
+    d.scan()
+    assert d.accumulator.metrics()["total_merchants"] == 5
+
+    # appended rows, the last one still being written
+    with open(path, "a") as f:
+        f.write(rows(5, 8) + "M008,Shop 8,Uni")
+    lookups.merchant_ids.clear()
+    d.scan()
+
+    assert sorted(lookups.looked_up()) == ["M005", "M006", "M007"]
+    predictions = pd.read_csv(tmp_path / "out" / "merchant_predictions.csv")
+    assert predictions["merchant_id"].tolist() == [f"M{i:03d}" for i in range(8)]
+
+    # nothing new: no work
+    lookups.merchant_ids.clear()
+    d.scan()
+    assert lookups.looked_up() == []
+
+    # a restarted daemon resumes from the saved offset and outputs
+    with open(path, "a") as f:
+        f.write("ted Kingdom,,8000,1,100\n")
+    restarted = daemon(tmp_path, fitted_model)
+    restarted.scan()
+
+    assert lookups.looked_up() == ["M008"]
+    assert restarted.accumulator.metrics()["total_merchants"] == 9
+
+
+def test_updated_merchant_replaces_its_row(tmp_path, lookups, fitted_model):
+
+    d = daemon(tmp_path, fitted_model)
+    (tmp_path / "incoming" / "a.csv").write_text(HEADER + rows(0, 4, disputes=0))
+    d.scan()
+    before = d.accumulator.metrics()
+
+    (tmp_path / "incoming" / "b.csv").write_text(HEADER + rows(0, 4, disputes=0))
+    result = d.scan()
+
+    assert result[0]["updated"] == 4
+    assert d.accumulator.metrics() == before
+    assert len(pd.read_csv(tmp_path / "out" / "portfolio_view.csv")) == 4
+
+
+def test_control_socket(tmp_path, lookups, fitted_model):
+
+    d = daemon(tmp_path, fitted_model)
+    (tmp_path / "incoming" / "a.csv").write_text(HEADER + rows(0, 3))
+    d.poll_seconds = 3600
+
+    thread = threading.Thread(target=d.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        for _ in range(100):
+            if d.server is not None:
+                break
+            threading.Event().wait(0.05)
+
+        # a.csv is picked up by the scan on start or by this run, never twice
+        send_command("run", port=d.control_port)
+        assert send_command("run", port=d.control_port)["processed"] == []
+        assert send_command("status", port=d.control_port)["merchants"] == 3
+
+        extra = tmp_path / "extra.csv"
+        extra.write_text(HEADER + rows(10, 12))
+        assert send_command("process", port=d.control_port, path=str(extra))["scored"] == 2
+        assert send_command("bogus", port=d.control_port)["error"]
+    finally:
+        send_command("stop", port=d.control_port)
+        thread.join(timeout=5)
+
+    assert json.loads((tmp_path / "out" / "portfolio_metrics.json").read_text())["total_merchants"] == 5
+
+
+def test_failing_file_is_quarantined(tmp_path, lookups, fitted_model):
+
+    d = daemon(tmp_path, fitted_model)
+    incoming = tmp_path / "incoming"
+    (incoming / "bad.csv").write_text("merchant_id,name\nM001,Shop 1\n")
+    (incoming / "good.csv").write_text(HEADER + rows(0, 3))
+
+    first = d.scan()
+    assert [r["source"] for r in first] == ["bad.csv", "good.csv"]
+    assert first[0]["attempts"] == 1 and not first[0]["quarantined"]
+
+    for attempt in range(2, pipeline_daemon.MAX_ATTEMPTS + 1):
+        result = d.scan()
+        assert result[0]["attempts"] == attempt
+
+    # moved aside with its error, no longer retried
+    assert result[0]["quarantined"]
+    assert not (incoming / "bad.csv").exists()
+    assert (incoming / "failed" / "bad.csv").exists()
+    assert (incoming / "failed" / "bad.csv.error.txt").read_text().strip()
+    assert d.scan() == []
+    assert d.status()["quarantined"] == 1
+    assert d.accumulator.metrics()["total_merchants"] == 3
@@ -0,0 +1,29 @@
+import pandas as pd
+from model.portfolio_aggregation import PortfolioAccumulator
+
+
+def test_sharded_accumulators_match_single_pass(scored_frame):
+
+    df = scored_frame()
+
+    single = PortfolioAccumulator().update(df)
+
+    shards = [PortfolioAccumulator().update(df.iloc[i:i + 150]) for i in range(0, len(df), 150)]
+    merged = shards[0]
+    for shard in shards[1:]:
+        merged.merge(shard)
+
+    assert merged.metrics() == single.metrics()
+    pd.testing.assert_frame_equal(merged.segment_metrics(), single.segment_metrics())
+
+
+def test_portfolio_metrics_match_direct_computation(scored_frame):
+
+    df = scored_frame()
+    high_risk = df[df["predicted_high_risk"] == 1]
+
+    metrics = PortfolioAccumulator().update(df).metrics()
+
+    assert metrics["high_risk_merchants"] == len(high_risk)
+    assert metrics["high_risk_volume"] == round(high_risk["monthly_volume"].sum(), 2)
+    assert metrics["expected_disputes"] == round((df["risk_probability"] * df["transaction_count"]).sum(), 2)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from model.portfolio_simulation import simulate_portfolio_losses, loss_statistics
+
+
+def test_simulation_is_reproducible_across_worker_counts():
+
+    rng = np.random.default_rng(0)
+    p = rng.uniform(0, 0.3, 2000)
+    volume = rng.uniform(1000, 200000, 2000)
+    region = rng.choice(["Europe", "Africa"], 2000)
+
+    single = simulate_portfolio_losses(p, volume, region, n_scenarios=600, n_workers=1)
+    parallel = simulate_portfolio_losses(p, volume, region, n_scenarios=600, n_workers=2)
+
+    assert np.array_equal(single, parallel)
+
+
+def test_independent_simulation_matches_expected_loss():
+
+    rng = np.random.default_rng(1)
+    p = rng.uniform(0, 0.3, 5000)
+    volume = rng.uniform(1000, 200000, 5000)
+
+    stats = loss_statistics(simulate_portfolio_losses(p, volume, shock_sigma=0, n_scenarios=500, n_workers=1))
+
+    assert abs(stats["expected_disputed_volume"] / (p * volume).sum() - 1) < 0.01
+    assert stats["expected_shortfall_99"] >= stats["var_99"] >= stats["var_95"]
+
+
+def test_categorical_region_with_missing_values():
+
+    rng = np.random.default_rng(2)
+    p = rng.uniform(0, 0.3, 300)
+    volume = rng.uniform(1000, 200000, 300)
+    region = rng.choice(["Europe", "Africa", None], 300)
+
+    # the dtype policy turns region into a categorical
+    losses = simulate_portfolio_losses(p, volume, pd.Categorical(region), n_scenarios=200, n_workers=1)
+
+    assert np.array_equal(losses, simulate_portfolio_losses(p, volume, region, n_scenarios=200, n_workers=1))
@@ -0,0 +1,32 @@
+import os
+
+from common import instrumentation
+from common.instrumentation import stage
+from common.profiling import start_profiling
+
+
+def _busy():
+    return sorted(str(i) for i in range(20000))
+
+
+def test_profiler_writes_per_stage_outputs_and_summary(tmp_path):
+
+    profiler = start_profiling("both", str(tmp_path))
+    try:
+        with stage("busy"):
+            with stage("inner"):
+                data = _busy()
+        summary_path = profiler.stop()
+    finally:
+        instrumentation.disable()
+
+    assert len(data) == 20000
+
+    files = os.listdir(profiler.output_dir)
+    # nested stages are covered by the parent's profile
+    assert sorted(files) == ["cpu_busy.prof", "memory_busy.txt", "summary.txt"]
+
+    summary = open(summary_path).read()
+    assert "--- stage busy" in summary
+    assert "_busy" in summary
+    assert "peak traced memory" in summary
@@ -0,0 +1,116 @@
+import json
+import time
+import pandas as pd
+from reporting.generate_report import generate_underwriting_report
+
+
+def test_report_uses_stub_llm_and_caches(ollama_stub, tmp_path, report_metrics, report_merged):
+
+    report_path = str(tmp_path / "underwriting_report.txt")
+
+    text, provider = generate_underwriting_report(report_metrics, report_merged, report_path)
+    assert provider == "Local LLM"
+    assert text == "Stub underwriting note."
+
+    text, provider = generate_underwriting_report(report_metrics, report_merged, report_path)
+    assert provider == "Local LLM (cached)"
+    assert ollama_stub.generate_calls == 1
+    assert (tmp_path / "report_latency.json").exists()
+
+
+def test_slow_llm_falls_back_at_deadline(ollama_stub, tmp_path, report_metrics, report_merged):
+
+    ollama_stub.delay = 3
+
+    start = time.monotonic()
+    _, provider = generate_underwriting_report(
+        report_metrics, report_merged, str(tmp_path / "underwriting_report.txt"), deadline_seconds=0.5
+    )
+
+    assert provider == "Rule-based fallback"
+    assert time.monotonic() - start < 2
+
+
+def test_segment_reports_fall_back_per_segment(ollama_stub, tmp_path, report_merged):
+
+    from reporting.segment_reports import generate_segment_reports
+
+    merged = report_merged.assign(predicted_high_risk=[1, 0, 0], transaction_count=[100, 100, 100])
+    ollama_stub.delay = 2
+
+    reports_dir = generate_segment_reports(merged, "country", str(tmp_path), max_concurrency=2, segment_timeout=0.3)
+
+    index = pd.read_csv(f"{reports_dir}/index.csv")
+    assert sorted(index["segment"]) == ["France", "Italy", "Spain"]
+    assert set(index["provider"]) == {"Rule-based fallback"}
+    assert (tmp_path / "segment_reports" / "country" / "spain.txt").exists()
+
+
+def test_report_streams_tokens_and_records_rate(ollama_stub, tmp_path, report_metrics, report_merged):
+
+    ollama_stub.response_text = "Portfolio risk is moderate. Recommend monitor."
+    ollama_stub.token_delay = 0.01
+
+    text, provider = generate_underwriting_report(report_metrics, report_merged, str(tmp_path / "underwriting_report.txt"))
+
+    assert provider == "Local LLM"
+    assert text == ollama_stub.response_text
+    assert (tmp_path / "underwriting_report.txt").read_text() == ollama_stub.response_text
+
+    latency = json.loads((tmp_path / "report_latency.json").read_text())["providers"]["Local LLM"]
+    assert latency["tokens"] == 6
+    assert latency["time_to_first_token"] >= 0
+    assert latency["tokens_per_second"] > 0
+
+
+def test_broken_stream_keeps_partial_output(ollama_stub, tmp_path, report_metrics, report_merged):
+
+    ollama_stub.response_text = "Portfolio risk is moderate. Recommend monitor."
+    ollama_stub.break_after = 3
+
+    report_path = tmp_path / "underwriting_report.txt"
+    text, provider = generate_underwriting_report(report_metrics, report_merged, str(report_path))
+
+    assert provider == "Local LLM (partial)"
+    assert text.startswith("Portfolio risk is")
+    assert "interrupted" in report_path.read_text()
+
+    # incomplete reports are not cached
+    _, provider = generate_underwriting_report(report_metrics, report_merged, str(report_path))
+    assert ollama_stub.generate_calls == 2
+
+
+def test_stream_running_past_deadline_is_truncated(ollama_stub, tmp_path, report_metrics, report_merged):
+
+    # ~10 s of streaming against a 1 s deadline
+    ollama_stub.response_text = "Portfolio risk is moderate. " * 250
+    ollama_stub.token_delay = 0.01
+
+    report_path = tmp_path / "underwriting_report.txt"
+    start = time.monotonic()
+    text, provider = generate_underwriting_report(report_metrics, report_merged, str(report_path), deadline_seconds=1)
+
+    assert time.monotonic() - start < 3
+    assert provider == "Local LLM (truncated)"
+    assert text.startswith("Portfolio")
+    assert "truncated" in report_path.read_text()
+    assert not (tmp_path / ".report_cache").exists() or not any((tmp_path / ".report_cache").iterdir())
+
+
+def test_segment_reports_keep_colliding_and_numeric_segments_apart(ollama_stub, tmp_path, report_merged):
+
+    from reporting.segment_reports import generate_segment_reports, segment_metrics, segment_top_risky
+
+    merged = report_merged.assign(
+        predicted_high_risk=[1, 0, 0], transaction_count=[100, 100, 100],
+        channel=["A/B", "A B", None], internal_risk=[1, 0, 1]
+    )
+
+    # numeric segment values resolve to the same keys in both lookups
+    assert set(segment_top_risky(merged, "internal_risk")) == set(segment_metrics(merged, "internal_risk"))
+
+    reports_dir = generate_segment_reports(merged, "channel", str(tmp_path))
+
+    index = pd.read_csv(f"{reports_dir}/index.csv", keep_default_na=False)
+    assert sorted(index["segment"]) == ["A B", "A/B", "unknown"]
+    assert index["path"].nunique() == 3
@@ -0,0 +1,58 @@
+from ingestion.claritypay_scraper import scrape_claritypay, extract_site_data
+
+
+HOME = """
+<html><head><style>.x { content: "$5+"; }</style><script>var promo = "$100+ pay";</script></head>
+<body>
+  <h1>Flexible <b>pay</b>ments at checkout</h1>
+  <p>Transparent terms, no hidden fees.</p>
+  <div><span>10,000+ merchants</span><span>$2B+ processed</span><!-- $9+ --></div>
+  <img alt="Shopify" src="s.png"><img alt="ClarityPay logo" src="l.png"><img src="x.png">
+</body></html>
+"""
+
+
+def test_single_pass_extraction():
+
+    data = extract_site_data(HOME)
+
+    assert data["value_propositions"] == ["Flexiblepayments at checkout", "Transparent terms, no hidden fees."]
+    assert data["partners"] == ["Shopify"]
+    # script, style and comment text is ignored
+    assert data["public_stats"] == ["$2B+ processed", "10,000+ merchants"]
+
+
+def test_conditional_get_and_ttl(html_server, tmp_path):
+
+    html_server.pages["/"] = HOME
+    url = html_server.url + "/"
+    cache_path = str(tmp_path / "scrape_cache.json")
+
+    first = scrape_claritypay(url, cache_path=cache_path)
+    assert first["partners"] == ["Shopify"]
+
+    # within the TTL: no request at all
+    assert scrape_claritypay(url, cache_path=cache_path) == first
+    assert [path for path in html_server.requests if path != "/robots.txt"] == ["/"]
+
+    # TTL expired, page unchanged: revalidated with a 304
+    assert scrape_claritypay(url, cache_path=cache_path, ttl=0) == first
+    assert html_server.not_modified == 1
+
+    # page changed: full download and parse
+    html_server.pages["/"] = HOME.replace("Shopify", "BigCommerce")
+    assert scrape_claritypay(url, cache_path=cache_path, ttl=0)["partners"] == ["BigCommerce"]
+    assert html_server.full_responses == 2
+
+
+def test_failed_fetch_falls_back_to_stale_cache(html_server, tmp_path):
+
+    html_server.pages["/"] = HOME
+    url = html_server.url + "/"
+    cache_path = str(tmp_path / "scrape_cache.json")
+
+    scrape_claritypay(url, cache_path=cache_path)
+    del html_server.pages["/"]
+
+    assert scrape_claritypay(url, cache_path=cache_path, ttl=0)["partners"] == ["Shopify"]
+    assert "error" in scrape_claritypay(html_server.url + "/missing", cache_path=cache_path)
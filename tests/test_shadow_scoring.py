@@ -0,0 +1,19 @@
+from model.train_risk_model import build_model, predict_risk, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+from model.shadow_scoring import shadow_score
+
+
+def test_shadow_scoring_side_by_side(feature_frame):
+
+    df = feature_frame(300, seed=1)
+    X, y = df[CATEGORICAL_FEATURES + NUMERIC_FEATURES], df["dispute_rate"] > 0.04
+
+    champion = build_model().fit(X, y)
+    challenger = build_model(C=0.01).fit(X, y)
+
+    scored = predict_risk(champion, df)
+    side_by_side, summary = shadow_score(scored, {"same": champion, "strong_reg": challenger})
+
+    assert summary["same"]["disagreement_rate"] == 0
+    assert summary["same"]["max_abs_score_shift"] == 0
+    assert summary["strong_reg"]["max_abs_score_shift"] > 0
+    assert list(side_by_side["merchant_id"]) == list(df["merchant_id"])
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sharded_pipeline
+from sharded_pipeline import shard_of, prepare_shards, run_shard, merge_shards, wait_for_shards
+from features.build_features_pipeline import enrich_merchants
+from features.underwriting_features import build_underwriting_features
+from model.train_risk_model import predict_risk
+from model.portfolio_risk import merge_predictions
+
+
+def merchants(n=40):
+    return pd.DataFrame({
+        "merchant_id": [f"M{i:03d}" for i in range(n)],
+        "entity_id": [f"M{i - i % 2:03d}" for i in range(n)],
+        "name": [f"Shop {i}" for i in range(n)],
+        "country": ["United Kingdom", "France"] * (n // 2),
+        "registration_number": [f"0{i}" for i in range(n)],
+        "monthly_volume": [5000 * i for i in range(n)],
+        "transaction_count": [100] * n,
+        "dispute_count": [i % 4 for i in range(n)]
+    })
+
+
+@pytest.fixture
+def lookups(lookups):
+    # M005 is unknown to the internal API
+    lookups.unknown.add("M005")
+    return lookups.install(sharded_pipeline)
+
+
+COUNTRIES = {
+    "United Kingdom": {"country_name": "United Kingdom", "region": "Europe", "subregion": "Northern Europe"},
+    "France": None
+}
+
+
+def test_shard_assignment_is_stable():
+
+    ids = np.array([f"M{i:05d}" for i in range(1000)])
+    shards = shard_of(ids, 8)
+
+    assert set(shards) == set(range(8))
+    # depends on the merchant_id only, not on its position
+    assert list(shard_of(ids[::-1], 8)) == list(shards[::-1])
+    assert shard_of(["M00001"], 8)[0] == shards[1]
+
+
+@pytest.mark.parametrize("n_shards", [1, 3])
+def test_merged_shards_match_single_process(tmp_path, lookups, fitted_model, n_shards):
+
+    df, fitted = merchants(), fitted_model
+
+    prepare_shards(df, str(tmp_path), n_shards, COUNTRIES)
+    for index in range(n_shards):
+        run_shard(str(tmp_path), index, n_shards, model=fitted)
+    frames = merge_shards(df, str(tmp_path), n_shards)
+
+    enriched = enrich_merchants(df, lookups.internal(df["merchant_id"]), COUNTRIES)
+    predictions = predict_risk(fitted, build_underwriting_features(enriched))
+    portfolio = merge_predictions(enriched, predictions)
+
+    assert len(frames["portfolio"]) == len(df) - 1
+    pd.testing.assert_frame_equal(frames["portfolio"].astype(str), portfolio.astype(str))
+    pd.testing.assert_frame_equal(frames["predictions"].astype(str), predictions.astype(str))
+
+    written = pd.read_csv(tmp_path / "portfolio_view.csv", dtype=str)
+    assert written["merchant_id"].tolist() == portfolio["merchant_id"].tolist()
+
+
+def test_coordinator_ignores_other_runs(tmp_path, monkeypatch, lookups, fitted_model):
+
+    monkeypatch.setattr(sharded_pipeline, "WAIT_POLL_SECONDS", 0.01)
+
+    df = merchants()
+    prepare_shards(df, str(tmp_path), 2, COUNTRIES)
+    run_shard(str(tmp_path), 0, 2, model=fitted_model)
+
+    # a fresh preparation invalidates the earlier run's done markers
+    manifest = prepare_shards(df, str(tmp_path), 2, COUNTRIES)
+    with pytest.raises(TimeoutError):
+        wait_for_shards(str(tmp_path), manifest, timeout=0.05)
+
+    with pytest.raises(ValueError):
+        run_shard(str(tmp_path), 0, 3)
+
+
+def test_worker_skips_a_stale_manifest(tmp_path, monkeypatch, lookups, fitted_model):
+
+    monkeypatch.setattr(sharded_pipeline, "WAIT_POLL_SECONDS", 0.01)
+
+    df, fitted = merchants(), fitted_model
+    stale = prepare_shards(df, str(tmp_path), 2, COUNTRIES)
+    run_shard(str(tmp_path), 0, 2, model=fitted)
+
+    # shard 0 of that run is done: a worker started now waits for the next run
+    with pytest.raises(TimeoutError):
+        run_shard(str(tmp_path), 0, 2, model=fitted, wait_seconds=0.05)
+
+    # shard 1 is not done yet, but the worker was told to wait for another run
+    with pytest.raises(TimeoutError):
+        run_shard(str(tmp_path), 1, 2, model=fitted, wait_seconds=0.05, run_id="next-run")
+
+    manifest = prepare_shards(df, str(tmp_path), 2, COUNTRIES)
+    assert run_shard(str(tmp_path), 0, 2, model=fitted, run_id=manifest["run_id"])["run_id"] != stale["run_id"]
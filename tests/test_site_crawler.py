@@ -0,0 +1,125 @@
+import json
+import time
+import asyncio
+
+from ingestion.claritypay_scraper import scrape_claritypay, extract_page
+from ingestion.site_crawler import crawl_site, normalize_url, _HostGate
+
+
+HOME = """
+<html><body>
+  <h1>Flexible payments at checkout</h1>
+  <a href="/partners/">Partners</a>
+  <a href="/pricing?utm_source=nav#plans">Pricing</a>
+  <a href="/legal/terms">Terms</a>
+  <a href="/about">About</a>
+  <a href="/private">Private</a>
+  <a href="https://elsewhere.example/">Elsewhere</a>
+  <a href="mailto:hi@example.com">Mail</a>
+</body></html>
+"""
+
+PARTNERS = '<html><body><img alt="Shopify"><img alt="BigCommerce"><a href="/">Home</a></body></html>'
+PRICING = "<html><body><p>Transparent terms, no hidden fees.</p><span>$0+ setup</span></body></html>"
+TERMS = "<html><body><p>Terms of service</p></body></html>"
+
+
+def site(server):
+    server.pages.update({
+        "/": HOME,
+        "/partners": PARTNERS,
+        "/pricing": PRICING,
+        "/legal/terms": TERMS,
+        # same bytes as the terms page under another URL
+        "/about": TERMS,
+        "/private": PRICING.replace("$0+", "$9+"),
+        "/robots.txt": "User-agent: *\nDisallow: /private\n",
+    })
+    return server.url + "/"
+
+
+def page_requests(server):
+    return [path for path in server.requests if path != "/robots.txt"]
+
+
+def test_normalize_url():
+
+    assert normalize_url("HTTPS://Example.com:443/a/?utm_source=x&b=2&a=1#frag") == "https://example.com/a?a=1&b=2"
+    assert normalize_url("../c/", "http://example.com/a/b/") == "http://example.com/a/c"
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("mailto:hi@example.com") is None
+
+
+def test_crawl_follows_site_links_and_merges(html_server, tmp_path):
+
+    url = site(html_server)
+    data = scrape_claritypay(url, cache_path=str(tmp_path / "cache.json"))
+
+    assert data["partners"] == ["BigCommerce", "Shopify"]
+    assert "Transparent terms, no hidden fees." in data["value_propositions"]
+    assert data["public_stats"] == ["$0+ setup"]
+    # claritypay_site_data.json keeps its original keys
+    assert set(data) == {"value_propositions", "partners", "public_stats"}
+
+    # robots.txt fetched once; disallowed and off-site pages never requested;
+    # /pricing?utm_source=nav#plans and /partners/ fetched once under their normal form
+    assert html_server.requests.count("/robots.txt") == 1
+    assert sorted(page_requests(html_server)) == ["/", "/about", "/legal/terms", "/partners", "/pricing"]
+
+
+def test_duplicate_content_counted_once(html_server):
+
+    url = site(html_server)
+    pages, stats = crawl_site(url, extract_page, host_delay=0)
+
+    assert stats["duplicates"] == 1
+    assert stats["disallowed"] == 1
+    assert len([u for u in pages if u.endswith(("/about", "/legal/terms"))]) == 1
+
+
+def test_pages_without_a_content_hash_are_not_duplicates(html_server, tmp_path):
+
+    url = site(html_server)
+    cache_path = tmp_path / "cache.json"
+    crawl_site(url, extract_page, cache_path=str(cache_path), host_delay=0)
+
+    # entries cached before content hashes were recorded
+    cache = json.loads(cache_path.read_text())
+    for entry in cache.values():
+        entry.pop("content_hash", None)
+    cache_path.write_text(json.dumps(cache))
+
+    pages, stats = crawl_site(url, extract_page, cache_path=str(cache_path), host_delay=0)
+
+    assert stats["duplicates"] == 0
+    assert len(pages) == len(cache)
+
+
+def test_recrawl_downloads_only_changed_pages(html_server, tmp_path):
+
+    url = site(html_server)
+    cache_path = str(tmp_path / "cache.json")
+
+    _, stats = crawl_site(url, extract_page, cache_path=cache_path, host_delay=0)
+    assert stats["fetched"] == 5
+
+    html_server.pages["/partners"] = PARTNERS.replace("Shopify", "Wix")
+    pages, stats = crawl_site(url, extract_page, cache_path=cache_path, host_delay=0, ttl=0)
+
+    # every page revalidated, only the changed one downloaded again
+    assert stats["fetched"] == 1 and stats["not_modified"] == 4
+    assert pages[normalize_url(url + "partners")]["data"]["partners"] == ["BigCommerce", "Wix"]
+
+
+def test_host_gate_spaces_requests():
+
+    async def three_requests():
+        gate = _HostGate(0.05)
+        started = []
+        for _ in range(3):
+            await gate.wait()
+            started.append(time.monotonic())
+        return started
+
+    started = asyncio.run(three_requests())
+    assert started[2] - started[0] >= 0.09
@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+
+import pandas as pd
+
+import features.build_features_pipeline as pipeline
+from features.build_features_pipeline import stream_enriched_batches, enrich_merchants
+
+
+def merchants(n=60):
+    ids = [f"M{i:03d}" for i in range(n)]
+    # a merchant listed twice, far apart
+    ids[50] = "M003"
+    return pd.DataFrame({
+        "merchant_id": ids,
+        "name": [f"Shop {i}" for i in range(n)],
+        "country": ["United Kingdom", "France"] * (n // 2),
+        "registration_number": [None] * n,
+        "monthly_volume": [1000 * i for i in range(n)],
+        "transaction_count": [100] * n,
+        "dispute_count": [1] * n
+    })
+
+
+COUNTRIES = {"United Kingdom": {"country_name": "United Kingdom", "region": "Europe", "subregion": "Northern Europe"}}
+
+
+def internal_record(mid):
+    if mid == "M007":
+        return None
+    return {
+        "internal_risk_flag": "low",
+        "transaction_summary": {"last_30d_volume": float(mid[1:]), "last_30d_txn_count": 10, "avg_ticket_size": 5.0}
+    }
+
+
+def test_stream_matches_fetch_all_then_build(monkeypatch):
+
+    def lookup(mid, session=None):
+        # results come back out of order
+        time.sleep(random.uniform(0, 0.005))
+        return internal_record(mid)
+
+    monkeypatch.setattr(pipeline, "get_internal_risk", lookup)
+    df = merchants()
+
+    stats = {}
+    batches = list(stream_enriched_batches(df, COUNTRIES, max_workers=8, queue_depth=10, batch_size=7, stats=stats))
+    streamed = pd.concat(batches, ignore_index=True)
+
+    expected = enrich_merchants(df, {mid: internal_record(mid) for mid in df["merchant_id"]}, COUNTRIES)
+
+    assert stats["batches"] == len(batches) > 1
+    assert len(streamed) == len(df) - 1
+    pd.testing.assert_frame_equal(streamed.astype(str), expected.astype(str))
+
+
+def test_fetching_pauses_when_consumer_falls_behind(monkeypatch):
+
+    lock = threading.Lock()
+    requested = []
+    consumed = [0]
+    ahead = []
+
+    def lookup(mid, session=None):
+        with lock:
+            requested.append(mid)
+            ahead.append(len(requested) - consumed[0])
+        # every merchant known, so each row comes back as a batch of its own
+        return internal_record("M000")
+
+    monkeypatch.setattr(pipeline, "get_internal_risk", lookup)
+
+    stats = {}
+    for batch in stream_enriched_batches(merchants(), COUNTRIES, max_workers=4, queue_depth=5, batch_size=1, stats=stats):
+        time.sleep(0.005)
+        with lock:
+            consumed[0] += len(batch)
+
+    # never more than queue_depth merchants (+ the batch being handed over) ahead of the consumer
+    assert max(ahead) <= 5 + 1
+    assert stats["stalls"] > 0
+
+
+def test_closing_the_stream_stops_fetching(monkeypatch):
+
+    calls = []
+    monkeypatch.setattr(pipeline, "get_internal_risk", lambda mid, session=None: calls.append(mid) or internal_record(mid))
+
+    stream = stream_enriched_batches(merchants(), COUNTRIES, queue_depth=5, batch_size=2)
+    next(stream)
+    stream.close()
+
+    settled = len(calls)
+    time.sleep(0.05)
+    assert len(calls) == settled < 60
+    assert not any(t.name == "internal-risk-producer" for t in threading.enumerate())
+
+
+def test_batches_with_only_skipped_merchants_are_dropped(monkeypatch):
+
+    warnings = []
+    monkeypatch.setattr(pipeline.logger, "warning", warnings.append)
+    # the whole second batch (rows 4-7) is unknown to the internal API
+    monkeypatch.setattr(pipeline, "get_internal_risk",
+                        lambda mid, session=None: None if 4 <= int(mid[1:]) < 8 else internal_record(mid))
+
+    stats = {}
+    batches = list(stream_enriched_batches(merchants(), COUNTRIES, batch_size=4, stats=stats))
+
+    assert len(batches) == stats["batches"] == 14
+    assert all(len(b) == 4 for b in batches)
+    assert all("dispute_count" in b.columns for b in batches)
+    # the total is reported once, after the stream
+    assert [w for w in warnings if w.startswith("Skipped")] == ["Skipped 4 merchants due to missing internal data"]
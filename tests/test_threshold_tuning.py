@@ -0,0 +1,29 @@
+import numpy as np
+from sklearn.metrics import precision_score, recall_score
+from model.threshold_tuning import threshold_sweep, select_operating_point
+
+
+def test_sweep_matches_direct_metrics():
+
+    rng = np.random.default_rng(0)
+    y = rng.integers(0, 2, 1000)
+    scores = np.clip(y * 0.3 + rng.uniform(0, 0.7, 1000), 0, 1).round(2)
+
+    curve = threshold_sweep(y, scores)
+
+    for _, row in curve.sample(20, random_state=0).iterrows():
+        preds = (scores >= row["threshold"]).astype(int)
+        assert np.isclose(row["precision"], precision_score(y, preds))
+        assert np.isclose(row["recall"], recall_score(y, preds))
+        assert row["alerts"] == preds.sum()
+
+
+def test_operating_point_meets_recall_target():
+
+    y = np.array([0, 0, 1, 0, 1, 1])
+    scores = np.array([0.1, 0.2, 0.3, 0.4, 0.8, 0.9])
+
+    point = select_operating_point(threshold_sweep(y, scores), target_recall=1.0)
+
+    assert point["threshold"] == 0.3
+    assert point["recall"] == 1.0